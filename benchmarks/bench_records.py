@@ -0,0 +1,60 @@
+#!/usr/local/bin/python3
+"""
+Compare the memory held per finding by Finding objects and FindingRecords.
+
+python3 -m benchmarks.bench_records --count=10000
+"""
+import argparse
+import json
+import logging
+import tracemalloc
+
+from benchmarks.generator import FindingGenerator
+from benchmarks.harness import csvo, stubbed
+
+################################################################################
+#### 
+################################################################################
+def measure (name=None, build=None, source=[]):
+    """
+    Build and keep one object per finding, and report the memory they hold.
+    """
+    tracemalloc.start()
+
+    kept = [ build(finding) for finding in source ]
+    held = tracemalloc.get_traced_memory()[0]
+
+    tracemalloc.stop()
+
+    print("%-16s %8d findings %10.0f bytes/finding" \
+        % (name, len(kept), held / len(kept)))
+
+    return held / len(kept)
+################################################################################
+#### 
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=10000,
+        help="Number of synthetic findings")
+
+    arguments = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Round-trip through JSON so that strings are not shared, as they would
+    # not be when parsed from an API response or a CSV file
+    generator = FindingGenerator()
+    source = [ json.loads(json.dumps(finding)) 
+        for finding in generator.findings(arguments.count) ]
+
+    with stubbed(generator=generator):
+        actor = csvo.HubActor(region=generator.regions)
+
+        before = measure("Finding", 
+            lambda finding: csvo.Finding(finding, actor=actor), source)
+        after = measure("FindingRecord", 
+            lambda finding: csvo.FindingRecord.fromFinding(finding, 
+            actor=actor), source)
+
+    print("reduction %.1fx" % (before / after))
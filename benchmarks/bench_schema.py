@@ -0,0 +1,57 @@
+#!/usr/local/bin/python3
+"""
+Compare rows/second converting findings with Finding objects (the per-column
+API) and with the compiled FINDING_SCHEMA.
+
+python3 -m benchmarks.bench_schema --count=100000
+"""
+import argparse
+import logging
+import time
+
+from benchmarks.generator import FindingGenerator
+from benchmarks.harness import csvo, stubbed
+
+################################################################################
+#### 
+################################################################################
+def measure (name=None, convert=None, source=[]):
+    """
+    Convert every finding and report the rate.
+    """
+    started = time.perf_counter()
+
+    for finding in source:
+        convert(finding)
+
+    elapsed = time.perf_counter() - started
+
+    print("%-16s %8d rows %8.2f s %10.0f rows/s" \
+        % (name, len(source), elapsed, len(source) / elapsed))
+
+    return len(source) / elapsed
+################################################################################
+#### 
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000,
+        help="Number of synthetic findings")
+
+    arguments = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    generator = FindingGenerator()
+    source = list(generator.findings(arguments.count))
+
+    with stubbed(generator=generator):
+        actor = csvo.HubActor(region=generator.regions)
+
+        before = measure("Finding.rowList", 
+            lambda finding: csvo.Finding(finding, actor=actor).rowList, source)
+        after = measure("FINDING_SCHEMA", 
+            lambda finding: csvo.FINDING_SCHEMA.row(finding, actor=actor), 
+            source)
+
+    print("speedup %.1fx" % (after / before))
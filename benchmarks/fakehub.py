@@ -0,0 +1,464 @@
+#!/usr/local/bin/python3
+"""
+A local stand-in for the Security Hub API, for load and soak testing
+
+python3 -m benchmarks.fakehub
+       --port=[port]
+       --findings=[findingsPerRegion]
+       --regions=[commaSeparatedRegionList]
+       --latency=[secondsPerRequest]
+       --throttle=[fractionOfRequestsThrottled]
+       --failures=[fractionOfUpdatesUnprocessed]
+
+The server speaks the Security Hub REST/JSON protocol over plain HTTP, so the
+exporter and updater use it through ordinary botocore clients when pointed
+at it with an endpoint URL (e.g. CSV_ENDPOINT_SECURITYHUB=http://localhost:
+8443; see csvObjects.Actor). Clients must still sign their requests, though
+any credentials will do; the region is taken from the signature.
+
+GetFindings pages through findings from a FindingGenerator with NextToken,
+evaluating string, number, date, map and boolean filters on the common
+fields, in the order of any SortCriteria. BatchUpdateFindings applies its changes, which later GetFindings
+calls reflect. DescribeHub and ListFindingAggregators answer as for a hub
+without aggregation. Every request can be delayed, throttled (HTTP 429,
+TooManyRequestsException), and updates can partly fail.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.generator import FindingGenerator
+
+# Filter names and the finding paths they test ([] descends into lists)
+_FIELDS = {
+    "Id": "Id",
+    "ProductArn": "ProductArn",
+    "GeneratorId": "GeneratorId",
+    "AwsAccountId": "AwsAccountId",
+    "Region": "Region",
+    "Type": "Types[]",
+    "Title": "Title",
+    "Description": "Description",
+    "SeverityLabel": "Severity.Label",
+    "SeverityNormalized": "Severity.Normalized",
+    "SeverityProduct": "Severity.Product",
+    "ComplianceStatus": "Compliance.Status",
+    "WorkflowStatus": "Workflow.Status",
+    "WorkflowState": "WorkflowState",
+    "RecordState": "RecordState",
+    "VerificationState": "VerificationState",
+    "Confidence": "Confidence",
+    "Criticality": "Criticality",
+    "ProductFields": "ProductFields",
+    "ProductName": "ProductFields.aws/securityhub/ProductName",
+    "CompanyName": "ProductFields.aws/securityhub/CompanyName",
+    "ResourceType": "Resources[].Type",
+    "ResourceId": "Resources[].Id",
+    "ResourceRegion": "Resources[].Region",
+    "ResourceTags": "Resources[].Tags",
+    "NoteText": "Note.Text",
+    "FirstObservedAt": "FirstObservedAt",
+    "LastObservedAt": "LastObservedAt",
+    "CreatedAt": "CreatedAt",
+    "UpdatedAt": "UpdatedAt"
+}
+
+# Error codes of unprocessed updates, all of which are worth retrying
+_FAILURES = [ "ConcurrentUpdateError", "InternalFailure", "LimitExceeded" ]
+################################################################################
+####
+################################################################################
+def parseTimestamp (value=None):
+    """
+    Parse a Security Hub ISO 8601 timestamp.
+    """
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+#-------------------------------------------------------------------------------
+def values (finding=None, path=""):
+    """
+    Return the values at a dotted path of a finding, descending into every
+    member of a list where a name ends with [].
+    """
+    found = [ finding ]
+
+    for name in path.split("."):
+        many = name.endswith("[]")
+        name = name[:-2] if many else name
+        answer = []
+
+        for value in found:
+            value = value.get(name) if isinstance(value, dict) else None
+
+            if value is None:
+                continue
+            elif many:
+                answer.extend(value)
+            else:
+                answer.append(value)
+
+        found = answer
+
+    return found
+#-------------------------------------------------------------------------------
+def matches (candidate=None, condition={}, now=None):
+    """
+    Does one value satisfy one filter condition?
+    """
+    if "Key" in condition:
+        if not isinstance(candidate, dict):
+            return False
+
+        return matches(candidate.get(condition["Key"]), { "Value": 
+            condition.get("Value"), "Comparison": condition.get("Comparison",
+            "EQUALS") }, now)
+
+    if "Comparison" in condition:
+        value, comparison = condition.get("Value"), condition["Comparison"]
+        text = "" if candidate is None else str(candidate)
+
+        return {
+            "EQUALS": text == value,
+            "NOT_EQUALS": text != value,
+            "PREFIX": text.startswith(value),
+            "PREFIX_NOT_EQUALS": not text.startswith(value),
+            "CONTAINS": value in text,
+            "NOT_CONTAINS": value not in text
+        }.get(comparison, False)
+
+    if ("Start" in condition) or ("End" in condition) or ("DateRange" in condition):
+        if candidate is None:
+            return False
+
+        moment = parseTimestamp(candidate)
+
+        if "DateRange" in condition:
+            start = now - timedelta(days=condition["DateRange"]["Value"])
+            return start <= moment <= now
+
+        return ((not condition.get("Start")) or
+            (parseTimestamp(condition["Start"]) <= moment)) and \
+            ((not condition.get("End")) or (moment <= parseTimestamp(condition["End"])))
+
+    if any(bound in condition for bound in ("Gte", "Lte", "Eq", "Gt", "Lt")):
+        if candidate is None:
+            return False
+
+        number = float(candidate)
+
+        return all([ number >= condition.get("Gte", number),
+            number <= condition.get("Lte", number),
+            number == condition.get("Eq", number),
+            ("Gt" not in condition) or (number > condition["Gt"]),
+            ("Lt" not in condition) or (number < condition["Lt"]) ])
+
+    if "Value" in condition:
+        return candidate == condition["Value"]
+
+    return False
+#-------------------------------------------------------------------------------
+def selected (finding=None, filters={}, now=None):
+    """
+    Does a finding pass a GetFindings Filters object? Every filter must pass.
+    Within a filter, any positive condition (e.g. EQUALS) may match a value,
+    but every negative condition (e.g. NOT_EQUALS) must hold for all values.
+    """
+    for name, conditions in filters.items():
+        if name not in _FIELDS:
+            raise ValueError("unsupported filter %s" % name)
+
+        found = values(finding, _FIELDS[name]) or [ None ]
+        negative = [ condition for condition in conditions
+            if condition.get("Comparison", "").startswith(("NOT_", "PREFIX_NOT_")) ]
+        positive = [ condition for condition in conditions
+            if condition not in negative ]
+
+        if not all(matches(value, condition, now)
+            for condition in negative for value in found):
+            return False
+
+        if positive and not any(matches(value, condition, now)
+            for condition in positive for value in found):
+            return False
+
+    return True
+################################################################################
+####
+################################################################################
+class FakeHub:
+    """
+    The state of the stand-in service: the findings of each region (which
+    are generated as they are paged through), the updates applied to them,
+    and counts of what has been asked of it.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, generator=None, findings=1000, latency=0.0,
+        throttle=0.0, failures=0.0, seed=0):
+        """
+        See class definition for details. Each region has findings findings;
+        latency is in seconds; throttle and failures are fractions of
+        requests and updated findings respectively.
+        """
+        self.generator = generator if generator else FindingGenerator()
+        self.findings = findings
+        self.latency = latency
+        self.throttle = throttle
+        self.failures = failures
+        self.random = random.Random(seed)
+        self.updates = {}
+        self.orders = {}
+        self.lock = threading.Lock()
+        self.stats = { "requests": 0, "throttled": 0, "pages": 0,
+            "findings": 0, "updated": 0, "unprocessed": 0 }
+    #---------------------------------------------------------------------------
+    def count (self, name=None, increment=1):
+        with self.lock:
+            self.stats[name] += increment
+    #---------------------------------------------------------------------------
+    def throttled (self):
+        """
+        Should this request be refused?
+        """
+        with self.lock:
+            self.stats["requests"] += 1
+            answer = self.random.random() < self.throttle
+
+            if answer:
+                self.stats["throttled"] += 1
+
+        return answer
+    #---------------------------------------------------------------------------
+    def finding (self, number=0, region=None):
+        """
+        Return a finding as it stands, with any updates applied.
+        """
+        finding = self.generator.finding(number, region=region)
+        changes = self.updates.get(finding["Id"])
+
+        if changes:
+            for name, value in changes.items():
+                if isinstance(value, dict) and isinstance(finding.get(name), dict):
+                    finding[name] = dict(finding[name], **value)
+                else:
+                    finding[name] = value
+
+        return finding
+    #---------------------------------------------------------------------------
+    def order (self, region=None, criteria=[]):
+        """
+        Return the numbers of a region's findings in the order of GetFindings
+        SortCriteria. Orders are kept until an update is applied.
+        """
+        key = (region, json.dumps(criteria, sort_keys=True))
+
+        with self.lock:
+            answer = self.orders.get(key)
+
+        if answer is None:
+            findings = [ self.finding(number, region=region) 
+                for number in range(self.findings) ]
+            answer = list(range(self.findings))
+
+            # Stable sorts, least significant criterion first
+            for criterion in reversed(criteria):
+                field = criterion.get("Field")
+
+                if field not in _FIELDS:
+                    raise ValueError("unsupported sort field %s" % field)
+
+                found = [ values(finding, _FIELDS[field]) for finding in findings ]
+                answer.sort(key=lambda number: (bool(found[number]),
+                    found[number][:1]),
+                    reverse=(criterion.get("SortOrder") == "desc"))
+
+            with self.lock:
+                self.orders[key] = answer
+
+        return answer
+    #---------------------------------------------------------------------------
+    def getFindings (self, region=None, request={}):
+        """
+        Answer securityhub:GetFindings.
+        """
+        filters = request.get("Filters") or {}
+        criteria = request.get("SortCriteria") or []
+        size = min(int(request.get("MaxResults") or 100), 100)
+        position = int(request.get("NextToken") or 0)
+        numbers = self.order(region, criteria) if criteria else None
+        now = datetime.now(timezone.utc)
+        page = []
+
+        while (position < self.findings) and (len(page) < size):
+            finding = self.finding(numbers[position] if numbers else position,
+                region=region)
+            position += 1
+
+            if selected(finding, filters, now):
+                page.append(finding)
+
+        self.count("pages")
+        self.count("findings", len(page))
+
+        answer = { "Findings": page }
+
+        if position < self.findings:
+            answer["NextToken"] = str(position)
+
+        return answer
+    #---------------------------------------------------------------------------
+    def batchUpdateFindings (self, region=None, request={}):
+        """
+        Answer securityhub:BatchUpdateFindings, failing a fraction of the
+        findings at random.
+        """
+        changes = { name: value for name, value in request.items()
+            if name != "FindingIdentifiers" }
+        processed = []
+        unprocessed = []
+
+        for identifier in request.get("FindingIdentifiers", []):
+            with self.lock:
+                failed = self.random.random() < self.failures
+
+            if failed:
+                unprocessed.append({ "FindingIdentifier": identifier,
+                    "ErrorCode": self.random.choice(_FAILURES),
+                    "ErrorMessage": "Simulated failure" })
+            else:
+                with self.lock:
+                    self.updates.setdefault(identifier["Id"], {}).update(changes)
+                    self.orders.clear()
+
+                processed.append(identifier)
+
+        self.count("updated", len(processed))
+        self.count("unprocessed", len(unprocessed))
+
+        return { "ProcessedFindings": processed,
+            "UnprocessedFindings": unprocessed }
+################################################################################
+####
+################################################################################
+class FakeHubHandler (BaseHTTPRequestHandler):
+    """
+    Route Security Hub REST requests to the server's FakeHub.
+    """
+    protocol_version = "HTTP/1.1"
+    #---------------------------------------------------------------------------
+    def log_message (self, format, *arguments):
+        pass
+    #---------------------------------------------------------------------------
+    @property
+    def region (self):
+        """
+        Return the region from the request's signature.
+        """
+        match = re.search(r'Credential=[^/]+/\d+/([^/]+)/',
+            self.headers.get("Authorization", ""))
+
+        return match.group(1) if match else "us-east-1"
+    #---------------------------------------------------------------------------
+    def respond (self, status=200, document={}, error=None):
+        body = json.dumps(document).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        if error:
+            self.send_header("x-amzn-ErrorType", error)
+
+        self.end_headers()
+        self.wfile.write(body)
+    #---------------------------------------------------------------------------
+    def handle_request (self):
+        hub = self.server.hub
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        if hub.latency:
+            time.sleep(hub.latency)
+
+        if hub.throttled():
+            return self.respond(429, { "__type": "TooManyRequestsException",
+                "Message": "Rate exceeded" }, error="TooManyRequestsException")
+
+        route = (self.command, self.path.split("?")[0])
+
+        try:
+            if route == ("POST", "/findings"):
+                self.respond(200, hub.getFindings(self.region, request))
+            elif route == ("PATCH", "/findings/batchupdate"):
+                self.respond(200, hub.batchUpdateFindings(self.region, request))
+            elif route == ("GET", "/accounts"):
+                self.respond(200, { "HubArn": f"arn:aws:securityhub:{self.region}:" +
+                    "111111111111:hub/default", "AutoEnableControls": True })
+            elif route == ("GET", "/findingAggregator/list"):
+                self.respond(200, { "FindingAggregators": [] })
+            else:
+                self.respond(404, { "__type": "ResourceNotFoundException",
+                    "Message": f"{self.command} {self.path} is not supported" },
+                    error="ResourceNotFoundException")
+
+        except ValueError as thrown:
+            self.respond(400, { "__type": "InvalidInputException",
+                "Message": str(thrown) }, error="InvalidInputException")
+
+    do_GET = do_POST = do_PATCH = handle_request
+################################################################################
+####
+################################################################################
+def serve (port=0, **options):
+    """
+    Start a FakeHub server on localhost in a background thread. The options
+    are those of FakeHub. Returns the server, whose hub attribute is the
+    FakeHub and whose endpoint attribute is its URL; call shutdown() on it
+    to stop.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeHubHandler)
+    server.daemon_threads = True
+    server.hub = FakeHub(**options)
+    server.endpoint = "http://127.0.0.1:%d" % server.server_address[1]
+
+    threading.Thread(target=server.serve_forever, daemon=True,
+        name="fakehub").start()
+
+    return server
+################################################################################
+#### Main body
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8443,
+        help="Port to listen on")
+    parser.add_argument("--findings", type=int, default=100000,
+        help="Number of findings in each region")
+    parser.add_argument("--regions", default="us-east-1,us-west-2,eu-west-1",
+        help="Comma-separated regions the findings are spread across")
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="Seconds to wait before answering each request")
+    parser.add_argument("--throttle", type=float, default=0.0,
+        help="Fraction of requests to refuse with TooManyRequestsException")
+    parser.add_argument("--failures", type=float, default=0.0,
+        help="Fraction of updated findings to leave unprocessed")
+
+    arguments = parser.parse_args()
+
+    server = serve(port=arguments.port,
+        generator=FindingGenerator(regions=arguments.regions.split(",")),
+        findings=arguments.findings, latency=arguments.latency,
+        throttle=arguments.throttle, failures=arguments.failures)
+
+    print(f"fake Security Hub listening on {server.endpoint}", flush=True)
+
+    try:
+        while True:
+            time.sleep(60)
+            print(json.dumps(server.hub.stats), flush=True)
+    except KeyboardInterrupt:
+        server.shutdown()
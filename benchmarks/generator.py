@@ -0,0 +1,175 @@
+"""
+Synthetic Security Hub findings for benchmarks
+
+FindingGenerator produces securityhub:get_findings finding dicts shaped like
+those of real estates: several regions and accounts, lists of resources of
+assorted types, standards product fields, and long descriptions. Findings are
+generated lazily and deterministically (finding number n is the same for a
+given seed, whenever it is generated), so a million of them need not be held
+in memory.
+"""
+
+import random
+
+_RESOURCE_TYPES = [
+    "AwsAccount", "AwsS3Bucket", "AwsEc2Instance", "AwsEc2SecurityGroup",
+    "AwsIamRole", "AwsLambdaFunction", "AwsRdsDbInstance", "AwsKmsKey"
+]
+
+_CONTROLS = [ ("S3.1", "S3 Block Public Access setting should be enabled"),
+    ("EC2.2", "The VPC default security group should not allow inbound and " +
+        "outbound traffic"),
+    ("IAM.1", "IAM policies should not allow full \"*\" administrative " +
+        "privileges"),
+    ("Lambda.1", "Lambda function policies should prohibit public access"),
+    ("RDS.3", "RDS DB instances should have encryption at rest enabled"),
+    ("KMS.4", "AWS KMS key rotation should be enabled") ]
+
+_SEVERITIES = [ ("CRITICAL", 90), ("HIGH", 70), ("MEDIUM", 40), ("LOW", 1),
+    ("INFORMATIONAL", 0) ]
+
+_WORDS = ("control checks whether the resource is configured according to "
+    "best practices and fails if it is not remediation guidance describes how "
+    "to correct the configuration of affected resources in every account "
+    "region and organization unit").split()
+################################################################################
+####
+################################################################################
+class FindingGenerator:
+    """
+    Generate realistic finding dicts.
+
+    Parameters
+    ----------
+    regions : list
+        The regions the findings are spread across
+    accounts : int
+        The number of AWS account IDs the findings are spread across
+    resources : tuple
+        The minimum and maximum number of resources per finding
+    descriptionLength : int
+        The approximate length of each description, in characters
+    productFields : int
+        The number of extra product fields besides the standards fields
+    seed : int
+        The random seed; the same seed always yields the same findings
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, regions=["us-east-1", "us-west-2", "eu-west-1"],
+        accounts=20, resources=(1, 4), descriptionLength=600,
+        productFields=6, seed=20221120):
+        """
+        See class definition for details
+        """
+        self.regions = list(regions)
+        self.accounts = [ "%012d" % (111111111111 * (number % 9 + 1) + number)
+            for number in range(accounts) ]
+        self.resources = resources
+        self.productFields = productFields
+        self.seed = seed
+
+        # A pool of descriptions, so long text costs little to generate
+        generator = random.Random(seed)
+        self.descriptions = [ self._text(descriptionLength, generator) 
+            for number in range(64) ]
+    #---------------------------------------------------------------------------
+    def _text (self, length=0, generator=None):
+        """
+        Return words chosen at random, about length characters in all.
+        """
+        words = []
+        size = 0
+
+        while size < length:
+            word = generator.choice(_WORDS)
+            words.append(word)
+            size += len(word) + 1
+
+        return " ".join(words).capitalize() + "."
+    #---------------------------------------------------------------------------
+    def finding (self, number=0, region=None):
+        """
+        Return finding number (in the given region, or one chosen by number).
+        """
+        generator = random.Random(self.seed * 1000003 + number)
+        choose = generator.choice
+        region = region if region else self.regions[number % len(self.regions)]
+        account = self.accounts[number % len(self.accounts)]
+        control, title = _CONTROLS[number % len(_CONTROLS)]
+        label, normalized = choose(_SEVERITIES)
+        standard = "aws-foundational-security-best-practices/v/1.0.0"
+        day = 1 + number % 28
+
+        productFields = {
+            "StandardsArn": f"arn:aws:securityhub:::standards/{standard}",
+            "ControlId": control,
+            "RecommendationUrl":
+                f"https://docs.aws.amazon.com/console/securityhub/{control}/remediation",
+            "StandardsControlArn": f"arn:aws:securityhub:{region}:{account}:" +
+                f"control/{standard}/{control}",
+            "aws/securityhub/ProductName": "Security Hub",
+            "aws/securityhub/CompanyName": "AWS",
+            "aws/securityhub/FindingId": f"arn:aws:securityhub:{region}::" +
+                f"product/aws/securityhub/{number:012d}",
+            "aws/securityhub/annotation": choose(["", "Resource is compliant",
+                "Unable to describe the resource"])
+        }
+
+        for field in range(self.productFields):
+            productFields["Custom/Field%d" % field] = "value-%d" % (number % 997)
+
+        resources = [ {
+            "Type": choose(_RESOURCE_TYPES),
+            "Id": f"arn:aws:service:{region}:{account}:resource/{number}-{item}",
+            "Partition": "aws",
+            "Region": region,
+            "Tags": { "Owner": "team-%d" % (number % 17), "Environment":
+                choose(["prod", "stage", "dev"]) }
+        } for item in range(generator.randint(*self.resources)) ]
+
+        return {
+            "SchemaVersion": "2018-10-08",
+            "Id": f"arn:aws:securityhub:{region}:{account}:subscription/" +
+                f"{standard}/{control}/finding/{number:012d}",
+            "ProductArn": f"arn:aws:securityhub:{region}::product/aws/securityhub",
+            "GeneratorId": f"{standard}/{control}",
+            "AwsAccountId": account,
+            "Region": region,
+            "Types": ["Software and Configuration Checks/Industry and " +
+                "Regulatory Standards/AWS-Foundational-Security-Best-Practices"],
+            "FirstObservedAt": f"2022-10-{day:02d}T10:00:00.000Z",
+            "LastObservedAt": f"2022-11-{day:02d}T10:00:00.000Z",
+            "CreatedAt": f"2022-10-{day:02d}T10:00:00.000Z",
+            "UpdatedAt": f"2022-11-{day:02d}T10:00:00.000Z",
+            "Severity": { "Product": normalized, "Label": label,
+                "Normalized": normalized, "Original": label },
+            "Title": f"{control} {title}",
+            "Description": choose(self.descriptions),
+            "Remediation": { "Recommendation": { "Text":
+                "For information on how to correct this issue, consult the " +
+                "AWS Security Hub controls documentation.",
+                "Url": productFields["RecommendationUrl"] } },
+            "ProductFields": productFields,
+            "Resources": resources,
+            "Compliance": { "Status": choose(["FAILED", "PASSED", "WARNING"]) },
+            "WorkflowState": "NEW",
+            "Workflow": { "Status": choose(["NEW", "NOTIFIED", "SUPPRESSED"]) },
+            "RecordState": "ACTIVE",
+            "FindingProviderFields": { "Severity": { "Label": label,
+                "Original": label }, "Types": [] }
+        }
+    #---------------------------------------------------------------------------
+    def findings (self, count=0, start=0, region=None):
+        """
+        Generator yields count findings, numbered from start.
+        """
+        for number in range(start, start + count):
+            yield self.finding(number, region=region)
+    #---------------------------------------------------------------------------
+    def pages (self, count=0, size=100, region=None):
+        """
+        Generator yields lists of up to size findings, count in all.
+        """
+        for start in range(0, count, size):
+            yield list(self.findings(min(size, count - start), start=start,
+                region=region))
@@ -0,0 +1,179 @@
+"""
+Benchmark harness: the Lambda modules, and stand-ins for their AWS clients
+
+The Lambda sources are not a package ("lambda" is a keyword), so csvObjects is
+imported from the exporter asset directory and each lambda_function module is
+loaded from its file. stubbed() routes every Actor client to in-memory stubs
+that answer from a FindingGenerator, so the exporter and updater run end to
+end without AWS, and without keeping what they upload. Services left out of
+the stubs use real clients, e.g. of the fake Security Hub in fakehub.
+"""
+
+import contextlib
+import importlib.util
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, os.path.join(_ROOT, "lambda", "exporter"))
+
+import csvObjects as csvo
+################################################################################
+####
+################################################################################
+def load (name=None, path=None):
+    """
+    Load a module from a file relative to the repository root.
+    """
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+exporter = load("exporter_lambda", "lambda/exporter/lambda_function.py")
+updater = load("updater_lambda", "lambda/updater/lambda_function.py")
+################################################################################
+####
+################################################################################
+class StubHubClient:
+    """
+    A securityhub client that pages through count generated findings of its
+    region, and accepts every update.
+    """
+    class exceptions:
+        class InvalidAccessException(Exception):
+            pass
+    #---------------------------------------------------------------------------
+    def __init__ (self, generator=None, region=None, count=0):
+        self.generator = generator
+        self.region = region
+        self.count = count
+        self.updated = 0
+    #---------------------------------------------------------------------------
+    def get_findings (self, Filters=None, MaxResults=100, NextToken=None):
+        start = int(NextToken) if NextToken else 0
+        size = min(MaxResults, self.count - start)
+        answer = { "Findings": list(self.generator.findings(size, start=start,
+            region=self.region)) }
+
+        if start + size < self.count:
+            answer["NextToken"] = str(start + size)
+
+        return answer
+    #---------------------------------------------------------------------------
+    def describe_hub (self):
+        return { "HubArn": f"arn:aws:securityhub:{self.region}:111111111111:hub/default" }
+    #---------------------------------------------------------------------------
+    def list_finding_aggregators (self):
+        return { "FindingAggregators": [] }
+    #---------------------------------------------------------------------------
+    def batch_update_findings (self, FindingIdentifiers=[], **parameters):
+        self.updated += len(FindingIdentifiers)
+
+        return { "ProcessedFindings": list(FindingIdentifiers),
+            "UnprocessedFindings": [] }
+################################################################################
+####
+################################################################################
+class StubS3Client:
+    """
+    An s3 client that counts the bytes uploaded but does not keep them.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self):
+        self.bytes = 0
+    #---------------------------------------------------------------------------
+    def _count (self, Body=b""):
+        if hasattr(Body, "read"):
+            for chunk in iter(lambda: Body.read(1024 * 1024), b""):
+                self.bytes += len(chunk)
+        else:
+            self.bytes += len(Body)
+    #---------------------------------------------------------------------------
+    def put_object (self, Bucket=None, Key=None, Body=b"", **extra):
+        self._count(Body)
+        return { "ETag": '"stub"' }
+    #---------------------------------------------------------------------------
+    def create_multipart_upload (self, Bucket=None, Key=None, **extra):
+        return { "UploadId": "stub" }
+    #---------------------------------------------------------------------------
+    def upload_part (self, Body=b"", PartNumber=0, **parameters):
+        self._count(Body)
+        return { "ETag": '"stub-%d"' % PartNumber }
+    #---------------------------------------------------------------------------
+    def complete_multipart_upload (self, **parameters):
+        return {}
+    #---------------------------------------------------------------------------
+    def abort_multipart_upload (self, **parameters):
+        return {}
+################################################################################
+####
+################################################################################
+class StubSsmClient:
+    """
+    An ssm client holding a dict of parameters.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, parameters={}):
+        self.parameters = dict(parameters)
+    #---------------------------------------------------------------------------
+    def get_parameters (self, Names=[]):
+        return {
+            "Parameters": [ { "Name": name, "Value": self.parameters[name] }
+                for name in Names if name in self.parameters ],
+            "InvalidParameters": [ name for name in Names
+                if name not in self.parameters ]
+        }
+    #---------------------------------------------------------------------------
+    def put_parameter (self, Name=None, Value=None, **parameters):
+        self.parameters[Name] = Value
+        return { "Version": 1 }
+################################################################################
+####
+################################################################################
+@contextlib.contextmanager
+def stubbed (generator=None, count=0, services=("ssm", "s3", "securityhub"),
+    quotas={ None: None }):
+    """
+    Route the Actor clients of services to stubs for the duration of the 
+    block, which receives the dict of stubs. The count findings are divided
+    evenly between the generator's regions. Actors are authorized without
+    calling STS. Calls are paced to quotas (see RateLimiterRegistry), which
+    by default leaves them unpaced.
+    """
+    regions = generator.regions
+    clients = {
+        "ssm": StubSsmClient({
+            "/csvManager/bucket": "bucket",
+            "/csvManager/folder/findings": "SecurityHub",
+            "/csvManager/regionList": ",".join(regions)
+        }),
+        "s3": StubS3Client(),
+        "securityhub": { region: StubHubClient(generator=generator,
+            region=region, count=count // len(regions) +
+            (1 if index < count % len(regions) else 0))
+            for index, region in enumerate(regions) }
+    }
+
+    saved = (csvo.Actor.getClient, csvo.Actor.authorize, csvo.LIMITERS)
+
+    def getClient (self, region, endpoint=None):
+        if self.service not in services:
+            return saved[0](self, region, endpoint=endpoint)
+
+        candidate = clients[self.service]
+        return candidate.get(region) if isinstance(candidate, dict) else candidate
+
+    def authorize (self, regions=None):
+        self.principal = { "UserId": "benchmark" }
+        return self
+
+    csvo.Actor.getClient, csvo.Actor.authorize = getClient, authorize
+    csvo.LIMITERS = csvo.RateLimiterRegistry(quotas=quotas)
+
+    try:
+        yield clients
+    finally:
+        csvo.Actor.getClient, csvo.Actor.authorize, csvo.LIMITERS = saved
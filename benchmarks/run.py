@@ -0,0 +1,252 @@
+#!/usr/local/bin/python3
+"""
+Run the exporter and updater benchmarks
+
+python3 -m benchmarks.run
+       --cases=[commaSeparatedCaseList]
+       --sizes=[commaSeparatedFindingCounts]
+       --json=[resultFile]
+
+Each case is run once per size in a fresh Python process, so that its peak
+resident set size (RSS) is its own. Cases:
+
+generate    generating the synthetic findings alone (a baseline for the rest,
+            which all generate their findings as they go)
+finding     constructing a Finding from each finding dict
+export      the exporter executor writing CSV straight to (stubbed) S3
+parse       the updater's CSV parsing and MinimumUpdateList grouping
+endtoend    an export to a local file, then an update from it, with every
+            AWS client stubbed
+soak        the same through botocore and HTTP against the fake Security Hub
+            (see fakehub), with some latency, throttling and failed updates,
+            paced to 1000 calls per second
+
+Throughput is reported in findings (rows) per second.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import fakehub
+from benchmarks.generator import FindingGenerator
+from benchmarks.harness import csvo, exporter, stubbed, updater
+
+_SIZES = [10000, 100000, 1000000]
+################################################################################
+#### Benchmark cases: each returns the number of findings processed
+################################################################################
+def generate (count=0, directory=None):
+    generator = FindingGenerator()
+
+    for finding in generator.findings(count):
+        pass
+
+    return count
+#-------------------------------------------------------------------------------
+def finding (count=0, directory=None):
+    generator = FindingGenerator()
+
+    with stubbed(generator=generator, count=count):
+        actor = csvo.HubActor(region=generator.regions)
+
+        for source in generator.findings(count):
+            csvo.Finding(source, actor=actor)
+
+    return count
+#-------------------------------------------------------------------------------
+def export (count=0, directory=None):
+    generator = FindingGenerator()
+
+    with stubbed(generator=generator, count=count):
+        answer = exporter.executor(region=generator.regions[0], filters={},
+            direct=True, regions=generator.regions)
+
+    assert answer["success"], answer
+
+    return count
+#-------------------------------------------------------------------------------
+def parse (count=0, directory=None):
+    generator = FindingGenerator()
+    path = os.path.join(directory, "updates.csv")
+
+    # Write the update file beforehand, without timing it
+    with open(path, "w", newline="", encoding="utf-8") as target:
+        writer = csv.writer(target)
+        writer.writerow(csvo.FINDING_SCHEMA.columns)
+
+        for page in generator.pages(count):
+            writer.writerows(csvo.FINDING_SCHEMA.rows(page))
+
+    with stubbed(generator=generator, count=count):
+        actor = csvo.HubActor(region=generator.regions)
+        updates = csvo.MinimumUpdateList()
+
+        started = time.perf_counter()
+
+        with csvo.S3Actor(region=generator.regions[0]).open(file=path) as stream:
+            for row in csv.reader(stream):
+                if row and (row[0] != "Id"):
+                    updates.add(csvo.Finding(row, actor=actor))
+
+    return count, time.perf_counter() - started
+#-------------------------------------------------------------------------------
+def endtoend (count=0, directory=None):
+    generator = FindingGenerator()
+
+    with stubbed(generator=generator, count=count):
+        answer = exporter.executor(region=generator.regions[0], filters={},
+            retain=True, regions=generator.regions)
+        path = os.path.join("/tmp", os.path.basename(answer["exportKey"]))
+
+        try:
+            result = updater.executor(region=generator.regions[0], input=path)
+        finally:
+            os.unlink(path)
+
+    assert len(result["processed"]) == count, result.get("message")
+
+    return count
+#-------------------------------------------------------------------------------
+def soak (count=0, directory=None):
+    generator = FindingGenerator()
+    server = fakehub.serve(generator=generator,
+        findings=-(-count // len(generator.regions)),
+        latency=0.002, throttle=0.01, failures=0.01)
+
+    # Requests to the fake must be signed, but with any credentials
+    environment = { "CSV_ENDPOINT_SECURITYHUB": server.endpoint,
+        "AWS_ACCESS_KEY_ID": "fakehub", "AWS_SECRET_ACCESS_KEY": "fakehub" }
+    saved = { name: os.environ.get(name) for name in environment }
+    os.environ.update(environment)
+
+    try:
+        with stubbed(generator=generator, count=count, services=("ssm", "s3"),
+            quotas={ None: (1000, 2000) }):
+            answer = exporter.executor(region=generator.regions[0],
+                filters={}, retain=True, regions=generator.regions)
+            path = os.path.join("/tmp", os.path.basename(answer["exportKey"]))
+
+            try:
+                updater.executor(region=generator.regions[0], input=path)
+            finally:
+                os.unlink(path)
+    finally:
+        server.shutdown()
+
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    return server.hub.stats["findings"]
+
+_CASES = {
+    "generate": generate,
+    "finding": finding,
+    "export": export,
+    "parse": parse,
+    "endtoend": endtoend,
+    "soak": soak
+}
+################################################################################
+####
+################################################################################
+def measure (case=None, count=0):
+    """
+    Run one case in this process and return its measurements. A case may
+    return its own elapsed time (leaving out its setup) with the count.
+    """
+    directory = tempfile.mkdtemp(prefix="hubaccel-bench-")
+
+    try:
+        started = time.perf_counter()
+        answer = _CASES[case](count=count, directory=directory)
+        elapsed = time.perf_counter() - started
+
+        if isinstance(answer, tuple):
+            answer, elapsed = answer
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "case": case,
+        "findings": answer,
+        "seconds": round(elapsed, 3),
+        "rowsPerSecond": round(answer / elapsed) if elapsed else None,
+        # ru_maxrss is in kilobytes on Linux
+        "peakRssMb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            / 1024, 1)
+    }
+#-------------------------------------------------------------------------------
+def spawn (case=None, count=0):
+    """
+    Run one case in a fresh process and return its measurements.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    child = subprocess.run(
+        [ sys.executable, "-m", "benchmarks.run", "--child", case, str(count) ],
+        cwd=root, capture_output=True, text=True
+    )
+
+    if child.returncode != 0:
+        raise RuntimeError(f"{case} at {count} findings failed:\n{child.stderr}")
+
+    return json.loads(child.stdout.strip().splitlines()[-1])
+#-------------------------------------------------------------------------------
+def report (result=None):
+    """
+    Print the measurements as a line of a table, or the table heading if 
+    there are none.
+    """
+    if not result:
+        print("%-10s %10s %10s %12s %12s" % ("case", "findings", "seconds",
+            "rows/s", "peak RSS MB"))
+    else:
+        print("%-10s %10d %10.2f %12d %12.1f" % (result["case"],
+            result["findings"], result["seconds"], result["rowsPerSecond"],
+            result["peakRssMb"]), flush=True)
+################################################################################
+#### Main body
+################################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", default=",".join(_CASES),
+        help="Comma-separated benchmark cases to run")
+    parser.add_argument("--sizes", default=",".join(map(str, _SIZES)),
+        help="Comma-separated numbers of findings to run each case with")
+    parser.add_argument("--json", required=False, default=None,
+        help="File to write the measurements to as JSON")
+    parser.add_argument("--child", nargs=2, default=None,
+        metavar=("CASE", "COUNT"), help=argparse.SUPPRESS)
+
+    arguments = parser.parse_args()
+
+    # Keep the Lambda modules' progress messages out of the measurements
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if arguments.child:
+        print(json.dumps(measure(case=arguments.child[0],
+            count=int(arguments.child[1]))))
+        sys.exit(0)
+
+    results = []
+    report()
+
+    for case in arguments.cases.split(","):
+        for count in [ int(size) for size in arguments.sizes.split(",") ]:
+            results.append(spawn(case=case, count=count))
+            report(results[-1])
+
+    if arguments.json:
+        with open(arguments.json, "w") as target:
+            json.dump(results, target, indent=2)
@@ -167,13 +167,14 @@ class HubaccelStack(Stack):
                         Sid="Sts"
                     ),
                     dict(
-                        Action=["s3:PutObject","s3:GetObject"], 
+                        Action=["s3:PutObject","s3:GetObject","s3:AbortMultipartUpload","s3:DeleteObject"], 
                         Effect="Allow",
                         Resource=[s3_arn,s3_arn_2],
                         Sid="S3"
                     ),
                     dict(
-                        Action=["securityhub:GetFindings","securityhub:BatchUpdateFindings"], 
+                        Action=["securityhub:GetFindings","securityhub:BatchUpdateFindings","securityhub:DescribeHub",
+                            "securityhub:ListFindingAggregators","securityhub:GetFindingAggregator"], 
                         Effect="Allow",
                         Resource="*",
                         Sid="SecurityHub"
@@ -210,8 +211,100 @@ class HubaccelStack(Stack):
         roles=[hubaccel_lambda_role.role_name]
         )
 
+        # creates state machine exporting each region (and account shard) in parallel, then merging the parts
+        export_plan = step_tasks.LambdaInvoke(
+            self,
+            "hubaccel_export_plan",
+            lambda_function=lambda_function_exporter,
+            payload=step.TaskInput.from_object({
+                "mode": "plan",
+                "options": step.JsonPath.entire_payload,
+            }),
+            payload_response_only=True,
+        )
+
+        export_part = step_tasks.LambdaInvoke(
+            self,
+            "hubaccel_export_part",
+            lambda_function=lambda_function_exporter,
+            payload_response_only=True,
+            result_selector={
+                "partKey.$": "$.partKey",
+                "count.$": "$.count",
+                "resultCode.$": "$.resultCode",
+            },
+        )
+
+        export_shards = step.Map(
+            self,
+            "hubaccel_export_shards",
+            items_path="$.shards",
+            max_concurrency=config['fanout']['max_concurrency'],
+            parameters={
+                "mode": "part",
+                "options.$": "$.options",
+                "shard.$": "$$.Map.Item.Value",
+            },
+            result_path="$.parts",
+        )
+        # A part that fails outright (e.g. times out) is reported to the merge as failed
+        export_part.add_catch(
+            step.Pass(self, "hubaccel_export_part_failed",
+                parameters={
+                    # A literal None is dropped from the definition, so build the null
+                    "partKey.$": "States.StringToJson('null')",
+                    "count": 0,
+                    "resultCode": 500,
+                },
+            ),
+            errors=["States.ALL"],
+        )
+        export_shards.iterator(export_part)
+
+        export_merge = step_tasks.LambdaInvoke(
+            self,
+            "hubaccel_export_merge",
+            lambda_function=lambda_function_exporter,
+            payload=step.TaskInput.from_object({
+                "mode": "merge",
+                "options": step.JsonPath.string_at("$.options"),
+                "run": step.JsonPath.string_at("$.run"),
+                "parts": step.JsonPath.string_at("$.parts"),
+            }),
+            payload_response_only=True,
+        )
+
+        # An incomplete export leaves its parts for inspection, and fails the execution
+        export_merged = step.Choice(self, "hubaccel_export_merged")
+        export_merged.when(
+            step.Condition.number_equals("$.resultCode", 200),
+            step.Succeed(self, "hubaccel_export_succeeded")
+        )
+        export_merged.otherwise(step.Fail(self, "hubaccel_export_merge_failed",
+            cause="The export is incomplete"))
+
+        export_planned = step.Choice(self, "hubaccel_export_planned")
+        export_planned.when(
+            step.Condition.number_equals("$.resultCode", 200),
+            export_shards.next(export_merge).next(export_merged)
+        )
+        export_planned.otherwise(step.Fail(self, "hubaccel_export_plan_failed",
+            cause="The export could not be planned"))
+
+        export_state_machine = step.StateMachine(
+            self,
+            "hubaccel_export_state_machine",
+            definition=export_plan.next(export_planned),
+            timeout=Duration.hours(2),
+        )
+
+        CfnOutput(self, "hubaccel_export_state_machine_arn",
+            value=export_state_machine.state_machine_arn,
+            description="Step Functions state machine exporting regions in parallel"
+        )
+
         # creates event bridge rule with a lambda target
-        
+
         # rule_target_input_properties = events.RuleTargetInput.from_text(
         #     f"The Pipeline {events.RuleTargetInput.from_event_path('$.detail.pipeline')} has {events.RuleTargetInput.from_event_path('$.detail.state')}"
         # )
@@ -6,12 +6,46 @@
 import boto3
 import botocore
 import time
+import csv
 import re
+import io
+import os
+import sys
+import json
+import copy
+import collections
+import contextlib
+import functools
+import gzip
+import hashlib
 import logging
+import queue
+import random
+import threading
+import weakref
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor
+import botocore.config
+import botocore.session
 from botocore import exceptions
 from botocore.exceptions import ClientError
+import botocore.credentials
+from botocore.credentials import RefreshableCredentials
 from boto3.session import Session
 
+# Zstandard compression is optional, gzip is used if it isn't installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Parquet output is optional and requires pyarrow (e.g. from a Lambda layer)
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
 # The current supported version
 _CURRENT_VERSION = "2021-01-01"
 
@@ -421,6 +455,16 @@ class Finding:
         Security Hub findings dictionary. See the FindingColumn object for
         details.
         """
+        # A weak reference avoids a finding -> column -> finding cycle, which
+        # would otherwise leave every finding for the cyclic garbage collector
+        return Finding.columnMap(actor=self.actor, finding=weakref.proxy(self))
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def columnMap (actor=None, finding=None):
+        """
+        Build the FindingColumnMap for a finding (see fullMap). The actor and
+        finding are passed to the transforms that need them.
+        """
         map = FindingColumnMap([
             FindingColumn(
 				columnName="Id", 
@@ -457,9 +501,9 @@ class Finding:
                 keys=["Note", "UpdatedBy"],
                 isUpdatable=True,
                 d2l=FindingActions.noteUpdater,
-                d2lParameters={"actor" : self.actor , "finding": self },
+                d2lParameters={"actor" : actor , "finding": finding },
                 l2d=FindingActions.noteUpdater,
-                l2dParameters={"actor" : self.actor , "finding": self }
+                l2dParameters={"actor" : actor , "finding": finding }
             ),
             FindingColumn(
                 columnName="CustomerOwner",
@@ -640,6 +684,9 @@ class FindingActions:
         "RESOLVED", 
         "SUPPRESSED"
     ]
+
+    _TIMESTAMP = re.compile(r'^(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})' +
+        r'(?:\.(\d+))?(Z|[+-]\d{2}:?\d{2})?$')
     #---------------------------------------------------------------------------
     @staticmethod
     def noteUpdater (value=None, actor=None, finding=None):
@@ -792,566 +839,3431 @@ class FindingActions:
             answer = None
 
         return answer
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def parseTimestamp (value=None):
+        """
+        Convert an ISO 8601 timestamp as used by Security Hub (for example
+        2020-03-22T13:22:13.933Z) to a timezone-aware datetime. Any number of
+        fractional digits is accepted; None is returned if the value can't be
+        parsed.
+        """
+        match = FindingActions._TIMESTAMP.match(value) \
+            if isinstance(value, str) else None
+
+        if not match:
+            answer = None
+        else:
+            date, clock, fraction, zone = match.groups()
+            fraction = (fraction or "0")[:6].ljust(6, "0")
+            zone = "+00:00" if (not zone) or (zone == "Z") else zone
+
+            if len(zone) == 5:
+                zone = zone[:3] + ":" + zone[3:]
+
+            answer = datetime.fromisoformat(f'{date}T{clock}.{fraction}{zone}')
+
+        return answer
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def formatTimestamp (value=None):
+        """
+        Convert a datetime to the ISO 8601 form used by Security Hub filters,
+        in UTC with millisecond precision.
+        """
+        value = value.astimezone(timezone.utc)
+
+        return value.strftime("%Y-%m-%dT%H:%M:%S.") + \
+            "%03dZ" % (value.microsecond // 1000)
 ################################################################################
 # 
 ################################################################################
-class ActorException (Exception):
-    pass
-################################################################################
-# 
-################################################################################
-class Actor:
-    _REGION_MODE_SINGLE = 1    # A simple, single-region client
-    _REGION_MODE_MULTIPLE = 1   # Requires a ServiceRegionBroker
+class FindingSchema:
     """
-    An abstract class for API functions. The class defines clients in each of 
-    a set of supported regions, and then carries out actions using those
-    clients.
-
-    The following APIs are used by the abstract class:
-    sts:AssumeRole
-    sts:GetCallerIdentity
+    The FindingColumnMap compiled once into a plan for converting 
+    securityhub:get_findings dictionaries to rows. Each column becomes a tuple
+    of its key path, the kind of transform, and the transform itself, so a 
+    row is produced by a single loop without building FindingColumn objects. 
+    Rows are tuples in column order and hold the same values as Finding.rowList.
+
+    The module-level FINDING_SCHEMA instance is shared by everything that 
+    converts findings in bulk; Finding objects remain available when the 
+    per-column API is needed.
     """
+    _PLAIN = 0      # The value is used as is
+    _CALL = 1       # The value is passed to a callable transform
+    _FIXED = 2      # The transform is the value
+    _NOTE = 3       # The value is the principal if the note text is set
     #---------------------------------------------------------------------------
-    def __init__ (self, service=None, region=None, role=None):
+    def __init__ (self, columnMap=None):
         """
-        See the class definition for details.
+        See class definition for details.
         """
-        self.role = role
-        self.authorized = False
-        self.accessKeyId = None
-        self.accessKey = None
-        self.sessionToken = None
-        self.client = {}
-        self.principal = None
-        self.service = service
+        columnMap = columnMap if columnMap else Finding.columnMap()
+        plan = []
+
+        for column in columnMap.itemList:
+            transform = column.d2l
+
+            if not transform:
+                kind = FindingSchema._PLAIN
+            elif transform is FindingActions.noteUpdater:
+                kind = FindingSchema._NOTE
+            elif callable(transform):
+                kind = FindingSchema._CALL
+            else:
+                kind = FindingSchema._FIXED
 
-        # Some things depend on whether we were passed a region or a list 
-        if isinstance(region, list):
-            self.regions = region
-            self.mode = Actor._REGION_MODE_MULTIPLE
+            plan.append((tuple(column.keys), kind, transform))
 
-            _LOGGER.debug(f'496140d service {service} set to _REGION_MODE_MULTIPLE')
+        self.plan = tuple(plan)
+        self.columns = tuple(column.columnName for column in columnMap.itemList)
+        self.index = { name: number for number, name in enumerate(self.columns) }
+        self.keys = tuple(column.columnName for column in columnMap.itemList 
+            if column.isKey)
+        self._note = self.index.get("NoteText")
+    #---------------------------------------------------------------------------
+    def row (self, finding={}, actor=None):
+        """
+        Convert a securityhub:get_findings dictionary to a row tuple.
+        """
+        values = []
+        append = values.append
+        principal = None
 
-        elif isinstance(region, str):
-            self.regions = [ region ]
-            self.mode = Actor._REGION_MODE_SINGLE
+        for keys, kind, transform in self.plan:
+            if kind == FindingSchema._FIXED:
+                value = transform
+            else:
+                # The same walk as FindingColumn.deep
+                value = finding
 
-        else:
-            raise ActorException("496150t region must be a region name or list of regions [%s]" % region)
+                for key in keys:
+                    value = value.get(key, None)
 
-        # Get authorization
-        self.authorize(regions=self.regions)
+                    if not value:
+                        break
+
+                if kind == FindingSchema._CALL:
+                    value = transform(value)
+                elif kind == FindingSchema._NOTE:
+                    if values[self._note] and (principal == None):
+                        principal = actor.principal.get("UserId") \
+                            if isinstance(actor, Actor) else None
 
-        # Create a client for the specified regions
-        for region in self.regions:
-            _LOGGER.debug("496160d create %s client in region %s" 
-                % (self.service, region))
+                    value = principal if values[self._note] else None
 
-            self.client[region] = self.getClient(region)
+            append(value if value != '' else None)
+
+        return tuple(values)
     #---------------------------------------------------------------------------
-    def getPartition(self, region:str) -> str:
+    def rows (self, findings=[], actor=None):
         """
-        Get an AWS partition name from a given region. This must be possible to
-        do more elegantly, but...
+        Generator yields a row tuple for each finding dictionary.
         """
-        candidate = region if region else self.primaryRegion
-        
-        if re.match(r'^us-gov.*', candidate):
-            answer = "aws-us-gov"
-        elif re.match(r'^us-', candidate):
-            answer = "aws"
-        else:
-            raise ActorException("496170s region %s can't be mapped to a partition")
+        row = self.row
 
-        _LOGGER.debug(f'496180d mapped region {candidate} to partition {answer}')
-        
-        return answer
+        for finding in findings:
+            yield row(finding, actor)
     #---------------------------------------------------------------------------
-    def getSupportedRegions(self, region:str=None, service:str=None) -> list:
+    def rowMap (self, row=()):
         """
-        Return a list of supported regions for this servce
+        Return a row as a dict keyed by column name (as Finding.rowMap).
         """
-        region = self.primaryRegion if not region else region
-        partition = self.getPartition(region)
-        service = self.service if not service else service
+        return dict(zip(self.columns, row))
 
-        answer = Session(region_name=region) \
-            .get_available_regions(
-                service,
-                partition_name=partition
-            )
+FINDING_SCHEMA = FindingSchema()
+""" Compiled schema shared by bulk finding conversions """
+################################################################################
+# 
+################################################################################
+class FindingRecord:
+    """
+    A compact, read-only finding: its column values in FINDING_SCHEMA order and
+    nothing else. Column names are resolved through the shared schema, so 
+    record.Id, record.keys and record.rowMap work as they do for a Finding,
+    but a record holds a single tuple instead of the finding dictionary, rows,
+    and column objects. Values of columns that repeat across findings (such as
+    ProductArn and AwsAccountId) are interned, so they are stored only once.
+    """
+    __slots__ = ("values",)
+
+    _INTERNED = [
+        "ProductArn",
+        "AwsAccountId",
+        "GeneratorId",
+        "SeverityLabel",
+        "VerificationState",
+        "Workflow",
+        "UpdateVersion",
+        "Types",
+        "Title",
+        "StandardsArn",
+        "StandardsSubscriptionArn",
+        "ControlId",
+        "RecommendationUrl",
+        "StandardsControlArn",
+        "ProductName",
+        "CompanyName",
+        "ComplianceStatus",
+        "WorkflowState",
+        "RecordState"
+    ]
 
-        return answer
+    _INTERNED_INDEX = tuple(FINDING_SCHEMA.index[name] for name in _INTERNED)
     #---------------------------------------------------------------------------
-    def getClient (self, region:str) -> object:
+    def __init__ (self, values=()):
         """
-        Create an AWS API client associated with a specific region
+        See class definition for details. Values must be in schema order.
         """
-        try:
-            client = boto3.client(
-                self.service,
-                aws_access_key_id=self.accessKeyId, 
-                aws_secret_access_key=self.accessKey, 
-                aws_session_token=self.sessionToken ,
-                region_name=region             
-           )
+        values = list(values)
 
-        except Exception as thrown:
-            _LOGGER.critical(f'496190s error obtaining client for {self.service} ' + 
-                f'in {region}: {thrown}') 
-            client = None
+        for number in FindingRecord._INTERNED_INDEX:
+            if isinstance(values[number], str):
+                values[number] = sys.intern(values[number])
 
-        return client
+        self.values = tuple(values)
+    #---------------------------------------------------------------------------
+    @classmethod
+    def fromFinding (cls, finding={}, actor=None):
+        """
+        Build a record from a securityhub:get_findings dictionary.
+        """
+        return cls(FINDING_SCHEMA.row(finding, actor=actor))
+    #---------------------------------------------------------------------------
+    @classmethod
+    def fromObject (cls, finding=None):
+        """
+        Build a record from the (transformed) attributes of a Finding object.
+        """
+        return cls(getattr(finding, name, None) 
+            for name in FINDING_SCHEMA.columns)
+    #---------------------------------------------------------------------------
+    def __getattr__ (self, name):
+        """
+        Resolve a column name to its value.
+        """
+        index = FINDING_SCHEMA.index.get(name) if name != "values" else None
+
+        if index == None:
+            raise AttributeError(name)
+
+        return self.values[index]
     #---------------------------------------------------------------------------
     @property
-    def primaryRegion (self):
+    def columns (self):
         """
-        Return the SRB's primary region or just use the supplied region
+        Return a list of CSV column names.
         """
-        return self.regions[0]
+        return list(FINDING_SCHEMA.columns)
     #---------------------------------------------------------------------------
     @property
-    def primaryClient (self):
+    def keys (self):
         """
-        Return the client for the primary region
+        Return a dict of the key values that uniquely identify the finding.
         """
-        return self.client[self.primaryRegion]
+        return { name: self.values[FINDING_SCHEMA.index[name]] 
+            for name in FINDING_SCHEMA.keys }
     #---------------------------------------------------------------------------
-    def authorize (self, regions=None):
+    @property
+    def rowList (self):
         """
-        If no role is supplied to the actor, the authorization is implicit
-        through the credentials already in the environment. Otherwise, use
-        sts:assume_role to gain the privileges associated with the supplied
-        role ARN.
+        Return the values as a list in column order.
         """
-        _LOGGER.debug("496200d request to authorize %s client region %s"
-            % (self.service, regions[0]))
+        return list(self.values)
+    #---------------------------------------------------------------------------
+    @property
+    def rowMap (self):
+        """
+        Return the values as a dict keyed by column name.
+        """
+        return FINDING_SCHEMA.rowMap(self.values)
+################################################################################
+# 
+################################################################################
+class ParquetFindingWriter:
+    """
+    Write CSV-style finding rows to a Parquet file, buffering rows into row
+    groups of rowGroupSize so that memory use is bounded regardless of the 
+    number of findings. Columns follow the FindingColumnMap, with integer,
+    floating point and timestamp types where the values allow, and dictionary
+    encoding for low-cardinality columns. Requires pyarrow.
 
-        # Obtain an STS client
-        try:
-            # Obtain an STS client
-            client = boto3.client("sts", region_name=regions[0])
-            _LOGGER.debug("496210d obtained STS client %s" % client)
+    Parameters
+    ----------
+    sink : str or writable binary file
+        Where the Parquet file is written; a file object is not closed
+    columns : list of str
+        The column names, in the order of the rows to be written
+    rowGroupSize : int
+        The number of rows buffered before a row group is written (by default
+        _ROW_GROUP_SIZE)
+    compression : str
+        The Parquet codec (snappy, gzip, zstd, ...)
+    """
+    _ROW_GROUP_SIZE = 10000
 
-            # No role supplied - use environment credentials
-            if not self.role:
-                self.authorized = True
-                _LOGGER.debug("496220d authorized from environment")
+    _INTEGER_COLUMNS = [
+        "Criticality",
+        "Confidence"
+    ]
 
-            # Role supplied, try to assume the role
-            else:
-                _LOGGER.debug("496230d attempt to assume role %s" % self.role)
+    _FLOAT_COLUMNS = [
+        "ProductSeverity",
+        "NormalizedSeverity"
+    ]
 
-                answer = client.assume_role(
-                    RoleArn=self.role, 
-                    RoleSessionName=("%s-access" % self.service)
-                )
+    _TIMESTAMP_COLUMNS = [
+        "FirstObservedAt",
+        "LastObservedAt",
+        "CreatedAt",
+        "UpdatedAt"
+    ]
 
-                self.accessKeyId = answer["Credentials"]["AccessKeyId"]
-                self.accessKey = answer["Credentials"]["SecretAccessKey"]
-                self.sessionToken = answer["Credentials"]["SessionToken"]
-                self.authorized = True
+    _DICTIONARY_COLUMNS = [
+        "ProductArn",
+        "SeverityLabel",
+        "Workflow",
+        "VerificationState",
+        "UpdateVersion",
+        "GeneratorId",
+        "AwsAccountId",
+        "StandardsArn",
+        "StandardsSubscriptionArn",
+        "ControlId",
+        "ProductName",
+        "CompanyName",
+        "ComplianceStatus",
+        "WorkflowState",
+        "RecordState"
+    ]
+    #---------------------------------------------------------------------------
+    def __init__ (self, sink=None, columns=[], rowGroupSize=None, 
+        compression="snappy"):
+        """
+        See class definition for details.
+        """
+        if not pyarrow:
+            raise FindingValueError("496760t pyarrow is required for parquet")
+
+        self.columns = list(columns)
+        self.rowGroupSize = rowGroupSize if rowGroupSize \
+            else ParquetFindingWriter._ROW_GROUP_SIZE
+        self.rows = 0
+        self.schema = pyarrow.schema([ (name, self.columnType(name))
+            for name in self.columns ])
+        self.converters = [ FindingActions.parseTimestamp 
+            if name in ParquetFindingWriter._TIMESTAMP_COLUMNS else None
+            for name in self.columns ]
+        self._buffer = [ [] for name in self.columns ]
+
+        self.writer = pyarrow.parquet.ParquetWriter(
+            sink, 
+            self.schema,
+            compression=compression,
+            use_dictionary=[ name for name in self.columns 
+                if name in ParquetFindingWriter._DICTIONARY_COLUMNS ]
+        )
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def columnType (name=None):
+        """
+        Return the Parquet (Arrow) type of a named column.
+        """
+        if name in ParquetFindingWriter._INTEGER_COLUMNS:
+            answer = pyarrow.int32()
+        elif name in ParquetFindingWriter._FLOAT_COLUMNS:
+            answer = pyarrow.float64()
+        elif name in ParquetFindingWriter._TIMESTAMP_COLUMNS:
+            answer = pyarrow.timestamp("ms", tz="UTC")
+        else:
+            answer = pyarrow.string()
 
-                _LOGGER.info("496240i assumed role %s for service %s" \
-                    % (self.role, self.service))
+        return answer
+    #---------------------------------------------------------------------------
+    def write (self, row=[]):
+        """
+        Add a row (a sequence of values in column order) to the current row
+        group, writing the group once it is full.
+        """
+        for column, converter, value in zip(self._buffer, self.converters, row):
+            column.append(converter(value) if converter else value)
 
-            # Now get the principal name of the authorized identity
-            self.principal = client.get_caller_identity()
-        
-        # Catch client errors
-        except ClientError as thrown:
-            _LOGGER.critical(f'496250d threw {errorCode(thrown)}: {thrown}')
-            self.authorized = False
+        self.rows += 1
 
-        # If we got this far, we're authorized
-        else:
-            self.authorized = True
+        if len(self._buffer[0]) >= self.rowGroupSize:
+            self.flush()
+    #---------------------------------------------------------------------------
+    def flush (self):
+        """
+        Write any buffered rows as a row group.
+        """
+        if self._buffer and self._buffer[0]:
+            table = pyarrow.Table.from_arrays(
+                [ pyarrow.array(values, type=field.type) 
+                    for values, field in zip(self._buffer, self.schema) ],
+                schema=self.schema
+            )
 
-        # Complain if we aren't authorized
-        if not self.authorized:
-            raise ActorException('496260t authorization failed')
+            self.writer.write_table(table)
 
-        return self
+            self._buffer = [ [] for name in self.columns ]
+    #---------------------------------------------------------------------------
+    def close (self):
+        """
+        Write the last row group and the Parquet footer.
+        """
+        self.flush()
+        self.writer.close()
 ################################################################################
 # 
 ################################################################################
-class SsmActor (Actor):
+class ActorException (Exception):
+    pass
+################################################################################
+# 
+################################################################################
+class MetricsCollector:
     """
-    Perform systems manager (SSM) actions. The following SSM APIs are used 
-    in this concrete class:
-
-    ssm:PutParameter
-    ssm:GetParameters
+    Process-wide performance metrics of an invocation: the seconds spent in
+    each phase of the work (e.g. auth, ssm, download, transform, write, 
+    upload, parse, grouping, apply), and counters (e.g. pages, findings, 
+    bytesUploaded). Phases and counters may also be kept per region.
+
+    Phases are exclusive: time spent in a phase nested inside another (in the
+    same thread) counts only towards the inner phase. Phases in concurrent 
+    threads each count in full, so a phase may add up to more than the time
+    that has passed.
+
+    Every botocore client built by the ClientRegistry reports to the 
+    collector, which counts apiCalls, retries, throttles (responses with a
+    throttling error code) and bytesReceived (response content lengths).
+    Time spent waiting on LIMITERS (pacing and backoff before retries) is 
+    the throttleWait phase.
+
+    The summary is returned by the Lambda handlers, and emitted as CloudWatch
+    embedded metric format (EMF) log lines in the _NAMESPACE namespace.
     """
-    _PARAMETERS = [
-        "/csvManager/bucket", 
-        "/csvManager/folder/code", 
-        "/csvManager/folder/findings", 
-        "/csvManager/object/codeArchive",
-        "/csvManager/partition",
-        "/csvManager/regionList"
-    ]
+    _NAMESPACE = "HubAccel"         # CloudWatch namespace of emitted metrics
+    _THROTTLES = ("Throttling", "ThrottlingException", "ThrottledException",
+        "TooManyRequestsException", "RequestLimitExceeded", 
+        "RequestThrottled", "SlowDown")
+                                    # Error codes meaning a request was throttled
     #---------------------------------------------------------------------------
-    def __init__ (self, region=None, role=None, resolve=_PARAMETERS):
+    def __init__ (self):
         """
-        See the class definition for details.
+        See class definition for details.
         """
-        super().__init__(
-            service="ssm",
-            region=region,
-            role=role
-        )
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+    #---------------------------------------------------------------------------
+    def reset (self):
+        """
+        Forget everything collected so far, e.g. at the start of an invocation.
+        """
+        with self.lock:
+            self.phases = collections.defaultdict(float)
+            self.counters = collections.defaultdict(int)
+            self.regions = collections.defaultdict(
+                lambda: collections.defaultdict(float))
+            self.started = time.perf_counter()
+    #---------------------------------------------------------------------------
+    def time (self, name=None, seconds=0.0, region=None):
+        """
+        Add seconds to a phase (and to the region's phase, given a region).
+        """
+        with self.lock:
+            self.phases[name] += seconds
 
-        if resolve:
-            answers = self.getValue(resolve)
+            if region:
+                self.regions[region][name] += seconds
+    #---------------------------------------------------------------------------
+    def count (self, name=None, increment=1, region=None):
+        """
+        Add increment to a counter (and to the region's counter, given a 
+        region).
+        """
+        with self.lock:
+            self.counters[name] += increment
 
-            for name, value in answers.items():
-                setattr(self, name, value)
+            if region:
+                self.regions[region][name] += increment
     #---------------------------------------------------------------------------
-    # Set an SSM parameter value
-    def putValue (self, name=None, description=None, value=None, type="String"):
+    @contextlib.contextmanager
+    def phase (self, name=None, region=None):
         """
-        Set the value of an SSM parameter.
+        Context manager timing the block as the named phase.
         """
+        stack = self.local.__dict__.setdefault("stack", [])
+        nested = [ 0.0 ]
+        stack.append(nested)
+        started = time.perf_counter()
+
         try:
-            answer = self.primaryClient.put_parameter(
-                Name=name,
-                Description=description,
-                Type=type,
-                Value=value,
-                Overwrite=True
-           )
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stack.pop()
 
-        except Exception as thrown:
-            _LOGGER.info(f'496270s cannot set parameter: {thrown}')
+            if stack:
+                stack[-1][0] += elapsed
 
-            answer = None
+            self.time(name, elapsed - nested[0], region=region)
+    #---------------------------------------------------------------------------
+    def timed (self, name=None, function=None, region=None):
+        """
+        Return function wrapped so that each call is timed as the named phase
+        (of the region, given a region).
+        """
+        @functools.wraps(function)
+        def wrapper (*arguments, **keywords):
+            with self.phase(name, region=region):
+                return function(*arguments, **keywords)
 
-        return answer
+        return wrapper
     #---------------------------------------------------------------------------
-    # Get SSM parameter values
-    def getValue (self, names:list[str]=[]):
+    def instrument (self, client=None):
         """
-        Retrieve the value of an SSM parameter.
+        Have a botocore client report its calls, retries, throttles and bytes.
+        Anything else (e.g. a stand-in without botocore's meta) is left as it
+        is.
         """
-        if isinstance(names, list):
-            single = False
-            answer = {}
-        else:
-            names = [names]
-            single = True
-            answer = None
+        meta = getattr(client, "meta", None)
 
-        try:
-            answer = self.primaryClient.get_parameters(Names=names)
+        if hasattr(meta, "events"):
+            meta.events.register("before-call", 
+                functools.partial(self.called, region=meta.region_name))
+            meta.events.register("needs-retry",
+                functools.partial(self.attempted, region=meta.region_name))
 
-            _LOGGER.debug("496280d result from ssm:get_parameters %s" % answer)
+        return client
+    #---------------------------------------------------------------------------
+    def called (self, region=None, **event):
+        """
+        botocore before-call event handler: an API call is starting.
+        """
+        self.count("apiCalls", region=region)
+    #---------------------------------------------------------------------------
+    def attempted (self, region=None, response=None, attempts=1, **event):
+        """
+        botocore needs-retry event handler: an attempt at an API call has 
+        ended, with response a (raw, parsed) response tuple if one arrived. 
+        Returns None, leaving the retry decision to botocore.
+        """
+        if attempts > 1:
+            self.count("retries", region=region)
 
-            for candidate in answer["Parameters"]:
-                name = candidate["Name"]
-                value = candidate["Value"]
+        if response:
+            raw, parsed = response
+            code = (parsed or {}).get("Error", {}).get("Code")
 
-                if single:
-                    answer = value
-                else:
-                    answer[name] = value
+            if (raw.status_code == 429) or (code in MetricsCollector._THROTTLES):
+                self.count("throttles", region=region)
+
+            length = raw.headers.get("content-length")
+
+            if length and length.isdigit():
+                self.count("bytesReceived", int(length))
+
+        return None
+    #---------------------------------------------------------------------------
+    def summary (self):
+        """
+        Return the metrics collected so far as a JSON-serializable dict.
+        """
+        with self.lock:
+            return {
+                "elapsed": round(time.perf_counter() - self.started, 3),
+                "phases": { name: round(seconds, 3) 
+                    for name, seconds in self.phases.items() },
+                "counters": dict(self.counters),
+                "regions": { region: { name: round(value, 3) 
+                    for name, value in values.items() }
+                    for region, values in self.regions.items() }
+            }
+    #---------------------------------------------------------------------------
+    def document (self, dimensions={}, values={}, units={}):
+        """
+        Return an EMF document recording values (with their units) against 
+        dimensions, both dicts of names to values.
+        """
+        return dict({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [ {
+                    "Namespace": os.environ.get("CSV_METRICS_NAMESPACE",
+                        MetricsCollector._NAMESPACE),
+                    "Dimensions": [ list(dimensions) ],
+                    "Metrics": [ { "Name": name, "Unit": units[name] } 
+                        for name in values ]
+                } ]
+            }
+        }, **dimensions, **values)
+    #---------------------------------------------------------------------------
+    def emit (self, function=None, stream=None, **properties):
+        """
+        Write the metrics to stream (standard output by default) as EMF JSON
+        lines, one for the whole invocation and one for each region, with 
+        function as the Function dimension. Any properties are added to the
+        first line, where they are searchable but are not dimensions. Phases
+        are reported in seconds, as the phase name with "Time" appended.
+        """
+        stream = stream if stream else sys.stdout
+        summary = self.summary()
+
+        #-----------------------------------------------------------------------
+        def measure (phases={}, counters={}):
+            values = {}
+            units = {}
+
+            for name, seconds in phases.items():
+                values[name + "Time"] = seconds
+                units[name + "Time"] = "Seconds"
+
+            for name, value in counters.items():
+                values[name] = value
+                units[name] = "Bytes" if name.startswith("bytes") else "Count"
+
+            return values, units
+
+        values, units = measure(dict(summary["phases"], 
+            elapsed=summary["elapsed"]), summary["counters"])
+        lines = [ dict(self.document(dimensions={ "Function": function }, 
+            values=values, units=units), **properties) ]
+
+        for region, entries in summary["regions"].items():
+            values, units = measure(
+                { name: value for name, value in entries.items() 
+                    if name in summary["phases"] },
+                { name: int(value) for name, value in entries.items() 
+                    if name not in summary["phases"] })
+            lines.append(self.document(dimensions={ "Function": function,
+                "Region": region }, values=values, units=units))
+
+        for line in lines:
+            stream.write(json.dumps(line) + "\n")
+
+        stream.flush()
+
+        return lines
+################################################################################
+# Metrics shared by every Actor
+################################################################################
+METRICS = MetricsCollector()
+################################################################################
+# 
+################################################################################
+class RateLimiter:
+    """
+    Pace the calls to one API operation in one region, shared by every thread
+    making them. A token bucket admits rate calls per second, in bursts of up
+    to burst calls, and no more than limit calls may be in flight at once.
+
+    Both the rate and the limit are adjusted by additive increase and 
+    multiplicative decrease (AIMD): each throttled call halves them, and each
+    successful call adds a step back, up to the starting rate and the 
+    maximum concurrency. Throughput thus settles just under the limit the 
+    service is actually enforcing.
+    """
+    _FLOOR = 0.1                # Lowest rate (calls per second)
+    _STEPS = 20                 # Successes to win back the starting rate
+    #---------------------------------------------------------------------------
+    def __init__ (self, rate=10.0, burst=10, concurrency=16):
+        """
+        See class definition for details.
+        """
+        self.ceiling = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.maximum = max(1, concurrency)
+        self.limit = float(self.maximum)
+        self.inFlight = 0
+        self.refilled = time.monotonic()
+        self.condition = threading.Condition()
+    #---------------------------------------------------------------------------
+    def refill (self):
+        """
+        Add the tokens earned since the last refill. Call with the lock held.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, 
+            self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+    #---------------------------------------------------------------------------
+    def acquire (self):
+        """
+        Wait for a token and a free slot, then take them.
+        """
+        with self.condition:
+            while True:
+                self.refill()
+
+                if self.inFlight >= int(self.limit):
+                    self.condition.wait()
+                elif self.tokens < 1:
+                    self.condition.wait(timeout=(1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.inFlight += 1
+                    return
+    #---------------------------------------------------------------------------
+    def release (self, throttled=False):
+        """
+        Give back the slot of a finished call, adjusting the rate and limit
+        by whether it was throttled.
+        """
+        with self.condition:
+            self.inFlight -= 1
+
+            if throttled:
+                self.rate = max(self.rate / 2, RateLimiter._FLOOR)
+                self.limit = max(self.limit / 2, 1.0)
+                self.tokens = min(self.tokens, 0.0)
+            else:
+                self.rate = min(self.rate + self.ceiling / RateLimiter._STEPS,
+                    self.ceiling)
+                self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+            self.condition.notify_all()
+################################################################################
+# 
+################################################################################
+class RateLimiterRegistry:
+    """
+    Process-wide RateLimiters, one per region and API operation, and the 
+    retry of throttled and transiently failed calls through them.
+
+    Quotas maps an operation name to its (rate, burst) quota, with the None
+    entry applying to any other operation; a quota of None leaves calls 
+    unpaced (but still retried). The defaults are the Security Hub API 
+    quotas.
+
+    A call that is throttled, or fails with a transient error, is retried up
+    to attempts times in all, after an exponential backoff with full jitter 
+    (a random wait of up to backoff * 2^n seconds, capped at _CAP). Since 
+    this replaces botocore's own retries, the ClientRegistry builds 
+    securityhub clients that make a single attempt (see _RETRIES there), so
+    every securityhub call must be made through call.
+    """
+    _QUOTAS = { "GetFindings": (3, 6), "BatchUpdateFindings": (10, 30), 
+        None: (10, 30) }
+    _CONCURRENCY = 16               # Most calls in flight per limiter
+    _ATTEMPTS = 8                   # Attempts at a call before giving up
+    _BACKOFF = 0.1                  # Seconds of the first backoff, at most
+    _CAP = 20.0                     # Seconds of the longest backoff, at most
+    _TRANSIENT = ("InternalException", "InternalFailure", "InternalError",
+        "ServiceUnavailable", "ServiceUnavailableException")
+                                    # Error codes worth another attempt
+    #---------------------------------------------------------------------------
+    def __init__ (self, quotas=_QUOTAS, concurrency=_CONCURRENCY, 
+        attempts=_ATTEMPTS, backoff=_BACKOFF):
+        """
+        See class definition for details.
+        """
+        self.quotas = dict(quotas)
+        self.concurrency = concurrency
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.limiters = {}
+        self.lock = threading.Lock()
+    #---------------------------------------------------------------------------
+    def get (self, region=None, operation=None):
+        """
+        Return the RateLimiter for an operation in a region, or None if the
+        operation's calls aren't paced.
+        """
+        with self.lock:
+            key = (region, operation)
+
+            if key not in self.limiters:
+                quota = self.quotas.get(operation, self.quotas.get(None))
+
+                self.limiters[key] = RateLimiter(rate=quota[0], 
+                    burst=quota[1], concurrency=self.concurrency) \
+                    if quota else None
+
+            return self.limiters[key]
+    #---------------------------------------------------------------------------
+    def wait (self, attempt=0):
+        """
+        Sleep before retrying after attempt (counting from zero) failed.
+        """
+        time.sleep(random.uniform(0, min(RateLimiterRegistry._CAP, 
+            self.backoff * 2 ** attempt)))
+    #---------------------------------------------------------------------------
+    def call (self, region=None, operation=None, function=None, **parameters):
+        """
+        Call function with parameters, paced by the limiter of the operation
+        in the region, retrying throttled and transiently failed attempts. 
+        The last attempt's exception is raised if every attempt fails. Waits
+        for the limiter and between attempts are timed as the throttleWait 
+        phase (see MetricsCollector).
+        """
+        limiter = self.get(region=region, operation=operation)
+
+        for attempt in range(self.attempts):
+            if limiter:
+                with METRICS.phase("throttleWait", region=region):
+                    limiter.acquire()
+
+            throttled = False
+
+            try:
+                return function(**parameters)
+
+            except ClientError as thrown:
+                code = errorCode(thrown)
+                throttled = code in MetricsCollector._THROTTLES
+
+                if (attempt + 1 >= self.attempts) or not (throttled or 
+                    (code in RateLimiterRegistry._TRANSIENT)):
+                    raise
+
+                _LOGGER.debug(f'497000d {operation} in {region} failed ' +
+                    f'with {code}, attempt {attempt + 1}')
+
+            except (exceptions.ConnectionError, 
+                exceptions.HTTPClientError) as thrown:
+                if attempt + 1 >= self.attempts:
+                    raise
+
+                _LOGGER.debug(f'497010d {operation} in {region} failed: ' +
+                    f'{thrown}, attempt {attempt + 1}')
+
+            finally:
+                if limiter:
+                    limiter.release(throttled=throttled)
+
+            METRICS.count("retries", region=region)
+
+            with METRICS.phase("throttleWait", region=region):
+                self.wait(attempt)
+################################################################################
+# Rate limiters shared by every Actor
+################################################################################
+LIMITERS = RateLimiterRegistry()
+################################################################################
+# 
+################################################################################
+class RoleCredentials (botocore.credentials.CredentialProvider):
+    """
+    A botocore credential provider answering with the RefreshableCredentials
+    of an assumed role, which fetch obtains as botocore credential metadata.
+    """
+    METHOD = "sts-assume-role"
+    #---------------------------------------------------------------------------
+    def __init__ (self, fetch=None):
+        """
+        See class definition for details.
+        """
+        super().__init__()
+
+        self.fetch = fetch
+    #---------------------------------------------------------------------------
+    def load (self):
+        return RefreshableCredentials.create_from_metadata(
+            metadata=self.fetch(),
+            refresh_using=self.fetch,
+            method=RoleCredentials.METHOD
+        )
+################################################################################
+# 
+################################################################################
+class CredentialProvider:
+    """
+    Process-wide cache of credentials and caller identities. Sessions are
+    keyed by role ARN (None for the credentials already in the environment)
+    and service: each role is assumed with sts:AssumeRole once per service,
+    with the session name "<service>-access" (so CloudTrail shows which part
+    of the work acted), and the resulting credentials are held in a boto3 
+    session shared by every client of that service using that role. They 
+    are botocore RefreshableCredentials, which assume the role again 
+    shortly before the credentials expire, so a long export never runs on 
+    stale credentials.
+
+    A cold invocation therefore still makes one sts:AssumeRole call per 
+    service, as each actor did before; what is saved is a role's 
+    sts:GetCallerIdentity call after the first (the principal is cached per
+    role), and every call again in warm invocations and for later actors. 
+    A single assumption can't be shared between services, since the session
+    name, SourceIdentity and session tags all apply to the whole session.
+
+    The following APIs are used:
+    sts:AssumeRole
+    sts:GetCallerIdentity
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self):
+        """
+        See class definition for details.
+        """
+        self.sessions = {}
+        self.principals = {}
+        self.lock = threading.Lock()
+        self.assumed = 0
+    #---------------------------------------------------------------------------
+    def session (self, role=None, region=None, service=None):
+        """
+        Return the boto3 session for a role and service, assuming the role 
+        (using STS in the given region) the first time it is asked for.
+        """
+        key = (role, service) if role else None
+
+        with self.lock:
+            if key not in self.sessions:
+                self.sessions[key] = self.buildSession(role=role, 
+                    region=region, service=service)
+
+            return self.sessions[key]
+    #---------------------------------------------------------------------------
+    def buildSession (self, role=None, region=None, service=None):
+        """
+        Build a boto3 session for a role whose credentials refresh themselves.
+        Without a role, the session uses the environment's credentials.
+        """
+        if not role:
+            _LOGGER.debug("496220d authorized from environment")
+            return Session()
+
+        client = boto3.client("sts", region_name=region)
+        _LOGGER.debug("496210d obtained STS client %s" % client)
+
+        #-----------------------------------------------------------------------
+        def fetch ():
+            """
+            Assume the role, returning credentials as botocore metadata.
+            """
+            _LOGGER.debug("496230d attempt to assume role %s" % role)
+
+            answer = client.assume_role(
+                RoleArn=role,
+                RoleSessionName=("%s-access" % service)
+            )["Credentials"]
+
+            self.assumed += 1
+
+            _LOGGER.info("496240i assumed role %s until %s" \
+                % (role, answer["Expiration"]))
+
+            return {
+                "access_key": answer["AccessKeyId"],
+                "secret_key": answer["SecretAccessKey"],
+                "token": answer["SessionToken"],
+                "expiry_time": answer["Expiration"].isoformat()
+            }
+
+        # The session resolves its credentials from the assumed role alone
+        core = botocore.session.Session()
+        core.register_component("credential_provider", 
+            botocore.credentials.CredentialResolver(
+                providers=[ RoleCredentials(fetch=fetch) ]))
+        answer = Session(botocore_session=core)
+
+        # Assume the role now, so that a role that can't be assumed fails 
+        # authorization rather than the first API call
+        answer.get_credentials()
+
+        return answer
+    #---------------------------------------------------------------------------
+    def principal (self, role=None, region=None):
+        """
+        Return the (cached) sts:get_caller_identity response of the identity
+        that assumes the role.
+        """
+        with self.lock:
+            if role not in self.principals:
+                self.principals[role] = boto3.client("sts", 
+                    region_name=region).get_caller_identity()
+
+            return self.principals[role]
+    #---------------------------------------------------------------------------
+    def clear (self):
+        """
+        Forget every cached session and identity.
+        """
+        with self.lock:
+            self.sessions.clear()
+            self.principals.clear()
+################################################################################
+# Credentials shared by every Actor
+################################################################################
+CREDENTIALS = CredentialProvider()
+################################################################################
+# 
+################################################################################
+class ClientRegistry:
+    """
+    Process-wide cache of boto3 clients, keyed by role, service, region, and
+    connection pool size. Building a client resolves endpoints, loads the
+    service model and opens a new connection pool, so every Actor shares the
+    clients in this registry; being module-level, the cache also survives 
+    across warm Lambda invocations. Clients take their credentials from the
+    role's CredentialProvider session, so they stay usable as the 
+    credentials are refreshed.
+
+    Clients are thread-safe once built. The least recently used clients are 
+    dropped once more than _CAPACITY are held.
+
+    A client may be built for an endpoint URL other than the service's own,
+    e.g. a local stand-in for load testing. Services whose calls are retried
+    by the RateLimiterRegistry get clients without botocore's own retries.
+    """
+    _CAPACITY = 64                  # Most clients held at once
+    _POOL_CONNECTIONS = 10          # botocore's default connection pool size
+    _RETRIES = { "securityhub": { "mode": "standard", 
+        "total_max_attempts": 1 } }
+                                    # Services retried by RateLimiterRegistry
+    #---------------------------------------------------------------------------
+    def __init__ (self):
+        """
+        See class definition for details.
+        """
+        self.clients = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.created = 0
+    #---------------------------------------------------------------------------
+    def get (self, service=None, region=None, role=None, 
+        connections=_POOL_CONNECTIONS, endpoint=None):
+        """
+        Return the cached client for the given service and region, building
+        it on first use. Role is the assumed role ARN, or None for the 
+        environment's credentials; the client's connection pool holds at 
+        least connections connections. Endpoint overrides the endpoint URL.
+        """
+        connections = max(connections or 0, ClientRegistry._POOL_CONNECTIONS)
+        key = (role, service, region, connections, endpoint)
+
+        with self.lock:
+            if key in self.clients:
+                self.clients.move_to_end(key)
+                return self.clients[key]
+
+            client = CREDENTIALS.session(role=role, region=region, 
+                service=service).client(
+                service,
+                region_name=region,
+                endpoint_url=endpoint,
+                config=botocore.config.Config(max_pool_connections=connections,
+                    retries=ClientRegistry._RETRIES.get(service))
+            )
+
+            METRICS.instrument(client)
+
+            _LOGGER.debug(f'496810d built {service} client in {region} with ' +
+                f'{connections} connections' + 
+                (f' for {endpoint}' if endpoint else ''))
+
+            self.clients[key] = client
+            self.created += 1
+
+            while len(self.clients) > ClientRegistry._CAPACITY:
+                self.clients.popitem(last=False)
+
+            return client
+    #---------------------------------------------------------------------------
+    def clear (self):
+        """
+        Forget every cached client.
+        """
+        with self.lock:
+            self.clients.clear()
+################################################################################
+# Clients shared by every Actor
+################################################################################
+CLIENTS = ClientRegistry()
+################################################################################
+# 
+################################################################################
+class ClientMap (dict):
+    """
+    The per-region clients of an Actor, keyed by region name. A region's 
+    client is created by factory (normally Actor.getClient) the first time
+    it is looked up, so startup cost follows the regions actually used 
+    rather than the regions listed.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, factory=None):
+        """
+        See class definition for details.
+        """
+        super().__init__()
+        self.factory = factory
+    #---------------------------------------------------------------------------
+    def __missing__ (self, region):
+        """
+        Create, remember and return the client for a region. A client that
+        couldn't be created (None) isn't remembered, so it is retried.
+        """
+        _LOGGER.debug("496160d create client in region %s" % region)
+
+        client = self.factory(region)
+
+        if client is not None:
+            self[region] = client
+
+        return client
+################################################################################
+# 
+################################################################################
+class Actor:
+    _REGION_MODE_SINGLE = 1    # A simple, single-region client
+    _REGION_MODE_MULTIPLE = 1   # Requires a ServiceRegionBroker
+    """
+    An abstract class for API functions. The class defines clients in each of 
+    a set of supported regions, and then carries out actions using those
+    clients.
+
+    The following APIs are used by the abstract class:
+    sts:AssumeRole
+    sts:GetCallerIdentity
+
+    Clients use the service's endpoint unless an endpoint URL is given, or
+    set in the environment variable _ENDPOINT_VARIABLE with the service name
+    appended (e.g. CSV_ENDPOINT_SECURITYHUB=http://localhost:8443).
+    """
+    _ENDPOINT_VARIABLE = "CSV_ENDPOINT_"
+    #---------------------------------------------------------------------------
+    def __init__ (self, service=None, region=None, role=None, 
+        connections=ClientRegistry._POOL_CONNECTIONS, endpoint=None):
+        """
+        See the class definition for details. Connections sizes each client's
+        connection pool, and should be at least the number of threads that 
+        will share a client.
+        """
+        self.role = role
+        self.connections = connections
+        self.endpoint = endpoint if endpoint else os.environ.get(
+            Actor._ENDPOINT_VARIABLE + str(service).upper().replace("-", "_"))
+        self.authorized = False
+        self.client = ClientMap(self.getClient)
+        self.principal = None
+        self.service = service
+
+        # Some things depend on whether we were passed a region or a list 
+        if isinstance(region, list):
+            self.regions = region
+            self.mode = Actor._REGION_MODE_MULTIPLE
+
+            _LOGGER.debug(f'496140d service {service} set to _REGION_MODE_MULTIPLE')
+
+        elif isinstance(region, str):
+            self.regions = [ region ]
+            self.mode = Actor._REGION_MODE_SINGLE
+
+        else:
+            raise ActorException("496150t region must be a region name or list of regions [%s]" % region)
+
+        # Get authorization
+        self.authorize(regions=self.regions)
+    #---------------------------------------------------------------------------
+    def getPartition(self, region:str) -> str:
+        """
+        Get an AWS partition name from a given region. This must be possible to
+        do more elegantly, but...
+        """
+        candidate = region if region else self.primaryRegion
+        
+        if re.match(r'^us-gov.*', candidate):
+            answer = "aws-us-gov"
+        elif re.match(r'^us-', candidate):
+            answer = "aws"
+        else:
+            raise ActorException("496170s region %s can't be mapped to a partition")
+
+        _LOGGER.debug(f'496180d mapped region {candidate} to partition {answer}')
+        
+        return answer
+    #---------------------------------------------------------------------------
+    def getSupportedRegions(self, region:str=None, service:str=None) -> list:
+        """
+        Return a list of supported regions for this servce
+        """
+        region = self.primaryRegion if not region else region
+        partition = self.getPartition(region)
+        service = self.service if not service else service
+
+        answer = Session(region_name=region) \
+            .get_available_regions(
+                service,
+                partition_name=partition
+            )
+
+        return answer
+    #---------------------------------------------------------------------------
+    def getClient (self, region:str, endpoint:str=None) -> object:
+        """
+        Get the AWS API client associated with a specific region from the 
+        shared client registry, creating it if necessary. The endpoint URL
+        defaults to the actor's.
+        """
+        try:
+            client = CLIENTS.get(
+                service=self.service,
+                region=region,
+                role=self.role,
+                connections=self.connections,
+                endpoint=endpoint if endpoint else self.endpoint
+            )
+
+        except Exception as thrown:
+            _LOGGER.critical(f'496190s error obtaining client for {self.service} ' + 
+                f'in {region}: {thrown}') 
+            client = None
+
+        return client
+    #---------------------------------------------------------------------------
+    def warmClients (self, regions=None):
+        """
+        Create the clients for regions (by default, every region of this
+        actor) in a background thread, so that building them overlaps with
+        other work. Clients are built one at a time since a boto3 session 
+        is not thread-safe; returns the (daemon) thread doing the work.
+        """
+        regions = self.regions if regions is None else regions
+
+        #-----------------------------------------------------------------------
+        def warm ():
+            for region in regions:
+                self.client[region]
+
+        thread = threading.Thread(target=warm, daemon=True,
+            name=f'{self.service}-clients')
+        thread.start()
+
+        return thread
+    #---------------------------------------------------------------------------
+    @property
+    def primaryRegion (self):
+        """
+        Return the SRB's primary region or just use the supplied region
+        """
+        return self.regions[0]
+    #---------------------------------------------------------------------------
+    @property
+    def primaryClient (self):
+        """
+        Return the client for the primary region
+        """
+        return self.client[self.primaryRegion]
+    #---------------------------------------------------------------------------
+    def authorize (self, regions=None):
+        """
+        If no role is supplied to the actor, the authorization is implicit
+        through the credentials already in the environment. Otherwise, use
+        sts:assume_role to gain the privileges associated with the supplied
+        role ARN. Credentials and the caller identity come from the shared
+        CredentialProvider, so a role is assumed once per service per process,
+        and not again by later actors or warm invocations.
+        """
+        _LOGGER.debug("496200d request to authorize %s client region %s"
+            % (self.service, regions[0]))
+
+        try:
+            with METRICS.phase("auth"):
+                # Assume the role (if not already assumed) 
+                CREDENTIALS.session(role=self.role, region=regions[0], 
+                    service=self.service)
+
+                # Now get the principal name of the authorized identity
+                self.principal = CREDENTIALS.principal(role=self.role, 
+                    region=regions[0])
+        
+        # Catch client errors
+        except ClientError as thrown:
+            _LOGGER.critical(f'496250d threw {errorCode(thrown)}: {thrown}')
+            self.authorized = False
+
+        # If we got this far, we're authorized
+        else:
+            self.authorized = True
+
+        # Complain if we aren't authorized
+        if not self.authorized:
+            raise ActorException('496260t authorization failed')
+
+        return self
+################################################################################
+# 
+################################################################################
+class SsmActor (Actor):
+    """
+    Perform systems manager (SSM) actions. The following SSM APIs are used 
+    in this concrete class:
+
+    ssm:PutParameter
+    ssm:GetParameters
+    """
+    _PARAMETERS = [
+        "/csvManager/bucket", 
+        "/csvManager/folder/code", 
+        "/csvManager/folder/findings", 
+        "/csvManager/object/codeArchive",
+        "/csvManager/partition",
+        "/csvManager/regionList"
+    ]
+    #---------------------------------------------------------------------------
+    def __init__ (self, region=None, role=None, resolve=_PARAMETERS):
+        """
+        See the class definition for details.
+        """
+        super().__init__(
+            service="ssm",
+            region=region,
+            role=role
+        )
+
+        if resolve:
+            answers = self.getValue(resolve)
+
+            for name, value in answers.items():
+                setattr(self, name, value)
+    #---------------------------------------------------------------------------
+    # Set an SSM parameter value
+    def putValue (self, name=None, description=None, value=None, type="String"):
+        """
+        Set the value of an SSM parameter.
+        """
+        try:
+            with METRICS.phase("ssm"):
+                answer = self.primaryClient.put_parameter(
+                    Name=name,
+                    Description=description,
+                    Type=type,
+                    Value=value,
+                    Overwrite=True
+                )
+
+        except Exception as thrown:
+            _LOGGER.info(f'496270s cannot set parameter: {thrown}')
+
+            answer = None
+
+        return answer
+    #---------------------------------------------------------------------------
+    # Get SSM parameter values
+    def getValue (self, names:list[str]=[]):
+        """
+        Retrieve the value of an SSM parameter.
+        """
+        if isinstance(names, list):
+            single = False
+            answer = {}
+        else:
+            names = [names]
+            single = True
+            answer = None
+
+        try:
+            with METRICS.phase("ssm"):
+                response = self.primaryClient.get_parameters(Names=names)
+
+            _LOGGER.debug("496280d result from ssm:get_parameters %s" % response)
+
+            for candidate in response["Parameters"]:
+                name = candidate["Name"]
+                value = candidate["Value"]
+
+                if single:
+                    answer = value
+                else:
+                    answer[name] = value
 
                 _LOGGER.debug(f'496290i SSM {name} = {value}')
 
-            for name in answer["InvalidParameters"]:
-                _LOGGER.info("496300d parameter '%s' not found" % name)
-                answer[name] = None
+            for name in response["InvalidParameters"]:
+                _LOGGER.info("496300d parameter '%s' not found" % name)
+
+                if not single:
+                    answer[name] = None
+
+        except Exception as thrown:
+            _LOGGER.error("496310e cannot get parameters: %s" % str(thrown))
+
+            if not single:
+                for name in names:
+                    _LOGGER.info("496320d parameter '%s' set to None" % name)
+                    answer[name] = None
+
+        return answer
+################################################################################
+# 
+################################################################################
+class S3StreamWriter (io.RawIOBase):
+    """
+    A writable binary file object that uploads to an S3 object as it is
+    written, without touching the local file system. Data is collected into
+    parts of partSize bytes, each of which is sent with s3:UploadPart in the
+    background while writing continues; closing the writer uploads the final 
+    part and completes the upload. Output smaller than one part is stored with
+    a single s3:PutObject instead.
+
+    If the writer is used as a context manager and the block raises, or if
+    abort() is called, the multipart upload is aborted and no object is
+    created.
+
+    An upload can also be suspended (see suspend) and continued by a later 
+    writer created with the state suspend returned, e.g. in another process.
+
+    Existing objects can be appended without downloading them (see copy).
+
+    The following S3 API operations are used:
+
+    s3:PutObject
+    s3:GetObject
+    s3:CreateMultipartUpload
+    s3:UploadPart
+    s3:UploadPartCopy
+    s3:CompleteMultipartUpload
+    s3:AbortMultipartUpload
+    """
+    _PART_SIZE = 8 * 1024 * 1024
+    _MINIMUM_PART_SIZE = 5 * 1024 * 1024
+    _MAXIMUM_PART_SIZE = 5 * 1024 * 1024 * 1024
+    #---------------------------------------------------------------------------
+    def __init__ (self, client=None, bucket=None, key=None, partSize=_PART_SIZE,
+        concurrency=2, extra={}, state=None):
+        """
+        See class definition for details. The extra dict holds additional 
+        s3:PutObject/s3:CreateMultipartUpload parameters (e.g. ContentType).
+        """
+        super().__init__()
+
+        if partSize < S3StreamWriter._MINIMUM_PART_SIZE:
+            raise ActorException("496660t part size must be at least %d bytes" \
+                % S3StreamWriter._MINIMUM_PART_SIZE)
+
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.partSize = partSize
+        self.concurrency = concurrency
+        self.extra = dict(extra)
+        self.uploadId = None
+        self.parts = []
+        self.bytes = 0
+        self.completed = False
+        self.suspended = False
+        self._buffer = bytearray()
+        self._pool = None
+
+        # Continue a suspended upload, whose parts have all been sent
+        if state:
+            self.uploadId = state.get("uploadId")
+            self.bytes = state.get("bytes", 0)
+
+            for number, tag in state.get("parts", []):
+                future = Future()
+                future.set_result({ "ETag": tag })
+                self.parts.append((number, future))
+    #---------------------------------------------------------------------------
+    def writable (self):
+        return True
+    #---------------------------------------------------------------------------
+    def tell (self):
+        """
+        Return the number of bytes written so far (the stream is write-only).
+        """
+        return self.bytes
+    #---------------------------------------------------------------------------
+    def write (self, data):
+        """
+        Add data to the current part, sending every full part to S3.
+        """
+        if self.closed:
+            raise ValueError("496670e write to closed S3StreamWriter")
+
+        self._buffer += data
+        self.bytes += len(data)
+
+        while len(self._buffer) >= self.partSize:
+            self._send(bytes(self._buffer[:self.partSize]))
+
+            del self._buffer[:self.partSize]
+
+        return len(data)
+    #---------------------------------------------------------------------------
+    def copy (self, key=None, size=0, bucket=None):
+        """
+        Append the size bytes of an existing object (by default in the same
+        bucket) to the upload. As much as possible is copied by S3 itself with
+        s3:UploadPartCopy; only enough of the object to complete the part being
+        written is read, and an object (or remainder) too small to be a part of
+        its own is read into the next part. Returns the number of bytes 
+        appended.
+        """
+        source = { "Bucket": bucket if bucket else self.bucket, "Key": key }
+        position = 0
+
+        # Complete the part being written from the start of the object
+        if self._buffer:
+            position = min(size, self.partSize - len(self._buffer))
+            self.write(self._read(source, 0, position))
+
+        # Copy the rest in as few parts as possible, unless it is too small
+        remaining = size - position
+
+        if remaining < S3StreamWriter._MINIMUM_PART_SIZE:
+            self.write(self._read(source, position, size))
+        else:
+            count = -(-remaining // S3StreamWriter._MAXIMUM_PART_SIZE)
+            length = -(-remaining // count)
+
+            for start in range(position, size, length):
+                end = min(start + length, size)
+
+                self._submit(self._copyPart, CopySource=source,
+                    CopySourceRange="bytes=%d-%d" % (start, end - 1))
+
+                self.bytes += end - start
+
+        return size
+    #---------------------------------------------------------------------------
+    def _read (self, source={}, start=0, end=0):
+        """
+        Return bytes start to end (exclusive) of an object.
+        """
+        if end <= start:
+            return b""
+
+        return self.client.get_object(
+            Range="bytes=%d-%d" % (start, end - 1),
+            **source
+        )["Body"].read()
+    #---------------------------------------------------------------------------
+    def _copyPart (self, **parameters):
+        """
+        Copy a range of an object as a part, answering as s3:UploadPart does.
+        """
+        answer = self.client.upload_part_copy(**parameters)
+
+        return { "ETag": answer["CopyPartResult"]["ETag"] }
+    #---------------------------------------------------------------------------
+    def _send (self, data):
+        """
+        Upload one part in the background.
+        """
+        METRICS.count("bytesUploaded", len(data))
+
+        self._submit(self.client.upload_part, Body=data)
+    #---------------------------------------------------------------------------
+    def _submit (self, operation=None, **parameters):
+        """
+        Start an operation creating the next part in the background, waiting 
+        first if the maximum number of parts are already in flight.
+        """
+        if not self.uploadId:
+            answer = self.client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=self.key,
+                **self.extra
+            )
+
+            self.uploadId = answer["UploadId"]
+
+            _LOGGER.debug(f'496680d started upload {self.uploadId} to ' +
+                f's3://{self.bucket}/{self.key}')
+
+        if not self._pool:
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency,
+                thread_name_prefix="s3-parts")
+
+        inFlight = [ future for number, future in self.parts if not future.done() ]
+
+        if len(inFlight) >= self.concurrency:
+            inFlight[0].result()
+
+        number = len(self.parts) + 1
+
+        self.parts.append((number, self._pool.submit(
+            METRICS.timed("upload", operation),
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.uploadId,
+            PartNumber=number,
+            **parameters
+        )))
+    #---------------------------------------------------------------------------
+    def close (self):
+        """
+        Upload anything that remains and complete the upload.
+        """
+        if self.closed:
+            return
+
+        try:
+            if not self.uploadId:
+                METRICS.count("bytesUploaded", len(self._buffer))
+
+                with METRICS.phase("upload"):
+                    self.client.put_object(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        Body=bytes(self._buffer),
+                        **self.extra
+                    )
+            else:
+                if self._buffer:
+                    self._send(bytes(self._buffer))
+
+                parts = [ { "ETag": future.result()["ETag"], "PartNumber": number }
+                    for number, future in self.parts ]
+
+                with METRICS.phase("upload"):
+                    self.client.complete_multipart_upload(
+                        Bucket=self.bucket,
+                        Key=self.key,
+                        UploadId=self.uploadId,
+                        MultipartUpload={ "Parts": parts }
+                    )
+
+            self.completed = True
+
+            _LOGGER.info(f'496690i wrote {self.bytes} bytes in ' +
+                f'{max(len(self.parts), 1)} parts to s3://{self.bucket}/{self.key}')
+
+        except Exception:
+            self.abort()
+            raise
+
+        finally:
+            self._release()
+    #---------------------------------------------------------------------------
+    def suspend (self):
+        """
+        Stop writing without completing (or aborting) the upload. Waits for
+        the parts in flight, then returns the JSON-serializable state from 
+        which another writer can continue, and the bytes not yet sent (which
+        must be written to that writer first). The state is None if no part
+        had been sent, in which case the tail holds everything written.
+        """
+        tail = bytes(self._buffer)
+        state = None
+
+        try:
+            if self.uploadId:
+                state = {
+                    "uploadId": self.uploadId,
+                    "parts": [ [ number, future.result()["ETag"] ] 
+                        for number, future in self.parts ],
+                    "bytes": self.bytes - len(tail)
+                }
+
+            self.suspended = True
+
+            _LOGGER.info(f'496940i suspended upload to s3://{self.bucket}/' +
+                f'{self.key} after {self.bytes} bytes')
+
+        except Exception:
+            self.abort()
+            raise
+
+        finally:
+            self._release()
+
+        return state, tail
+    #---------------------------------------------------------------------------
+    def abort (self):
+        """
+        Abandon the upload, discarding any parts already sent.
+        """
+        if self.closed:
+            return
+
+        try:
+            if self.uploadId:
+                for number, future in self.parts:
+                    future.cancel()
+
+                self.client.abort_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.uploadId
+                )
+
+                _LOGGER.warning(f'496700w aborted upload to s3://{self.bucket}/' +
+                    f'{self.key}')
+
+        except botocore.exceptions.ClientError as thrown:
+            _LOGGER.critical(f'496710s cannot abort upload {self.uploadId}: ' +
+                f'{thrown}')
+
+        finally:
+            self._release()
+    #---------------------------------------------------------------------------
+    def _release (self):
+        """
+        Stop the part upload threads and mark the writer closed.
+        """
+        if self._pool:
+            self._pool.shutdown(wait=True)
+
+        self._buffer = bytearray()
+
+        super().close()
+    #---------------------------------------------------------------------------
+    def __exit__ (self, kind, value, traceback):
+        """
+        Complete the upload, or abort it if the block raised an exception.
+        """
+        if kind:
+            self.abort()
+        else:
+            self.close()
+    #---------------------------------------------------------------------------
+    def __del__ (self):
+        """
+        A writer that was never closed holds an incomplete export, so abort it.
+        """
+        if not self.closed:
+            self.abort()
+################################################################################
+# 
+################################################################################
+class S3StreamReader (io.RawIOBase):
+    """
+    Present the Body of an s3:GetObject response (a botocore StreamingBody) as
+    a raw binary file, so that it can be buffered, decompressed and decoded 
+    incrementally with the standard io classes.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, body=None):
+        """
+        See class definition for details.
+        """
+        super().__init__()
+
+        self.body = body
+    #---------------------------------------------------------------------------
+    def readable (self):
+        return True
+    #---------------------------------------------------------------------------
+    def readinto (self, buffer):
+        """
+        Read up to len(buffer) bytes from the body into buffer.
+        """
+        data = self.body.read(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+    #---------------------------------------------------------------------------
+    def close (self):
+        if not self.closed:
+            self.body.close()
+
+        super().close()
+################################################################################
+# 
+################################################################################
+class GzipStreamReader (gzip.GzipFile):
+    """
+    Decompress a binary stream that is closed along with the reader (a plain
+    GzipFile leaves the fileobj it is given open).
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self, stream=None):
+        """
+        See class definition for details.
+        """
+        super().__init__(fileobj=stream, mode="rb")
+
+        self.stream = stream
+    #---------------------------------------------------------------------------
+    def close (self):
+        try:
+            super().close()
+        finally:
+            self.stream.close()
+################################################################################
+# 
+################################################################################
+class S3Actor(Actor):
+    """
+    Perform AWS Simple Storage Service (S3) API operations. The following S3
+    API operations are used by this concrete class:
+
+    s3:PutObject
+    s3:GetObject
+    s3:HeadObject
+    s3:DeleteObject
+
+    and the operations used by S3StreamWriter.
+
+    Exports are CSV unless format is "parquet". If compression is "gzip" or 
+    "zstd", CSV objects are compressed as they are written (see compressor), 
+    the key suffix is extended accordingly, and the object's ContentEncoding 
+    is set; Parquet objects use the codec internally instead.
+    """
+    _PREFIX = "SecurityHub"
+    _SUFFIX = None
+    _FOLDER = "SecurityHub"
+    _FORMATS = {
+        "csv": (".csv", "text/csv"),
+        "parquet": (".parquet", "application/vnd.apache.parquet")
+    }
+    _COMPRESSION = {
+        "gzip": ".gz",
+        "zstd": ".zst"
+    }
+    #---------------------------------------------------------------------------
+    def __init__ (self, bucket=None, folder=_FOLDER, prefix=_PREFIX, 
+        suffix=_SUFFIX, region=None, role=None, compression=None, format="csv"):
+        """
+        See the class definition for details
+        """
+        super().__init__("s3", region=region, role=role)
+
+        if not (format in S3Actor._FORMATS):
+            raise ActorException("496740t unsupported format %s" % format)
+
+        if (format == "parquet") and not pyarrow:
+            raise ActorException("496750t pyarrow is required for parquet")
+
+        if compression and not (compression in S3Actor._COMPRESSION):
+            raise ActorException("496720t unsupported compression %s" \
+                % compression)
+
+        if (compression == "zstd") and not zstandard and (format == "csv"):
+            _LOGGER.warning("496730w zstandard is not installed, using gzip")
+            compression = "gzip"
+
+        self.format = format
+        self.compression = compression
+        self.prefix = prefix
+        self.suffix = suffix if suffix else S3Actor._FORMATS[format][0]
+        self.folder = folder 
+        self.bucket = bucket
+        self._filename = None
+
+        if self.streamCompression:
+            self.suffix += S3Actor._COMPRESSION[compression]
+    #---------------------------------------------------------------------------
+    @property
+    def objectParameters (self):
+        """
+        Return the additional s3:PutObject parameters describing the content
+        of an export object.
+        """
+        answer = { "ContentType": self.contentType }
+
+        if self.streamCompression:
+            answer["ContentEncoding"] = self.compression
+
+        return answer
+    #---------------------------------------------------------------------------
+    @property
+    def contentType (self):
+        """
+        Return the MIME type of the (uncompressed) export.
+        """
+        return S3Actor._FORMATS[self.format][1]
+    #---------------------------------------------------------------------------
+    @property
+    def streamCompression (self):
+        """
+        True if the whole object is compressed (as opposed to a Parquet file,
+        which compresses its column chunks).
+        """
+        return bool(self.compression) and (self.format == "csv")
+    #---------------------------------------------------------------------------
+    def compressor (self, sink=None):
+        """
+        Return a writable binary stream that compresses into sink according to
+        the compression setting, or sink itself if there is no compression. 
+        Closing the stream finishes the compressed data but leaves sink open.
+        """
+        if not self.streamCompression:
+            answer = sink
+        elif self.compression == "gzip":
+            answer = gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=6)
+        elif self.compression == "zstd":
+            answer = zstandard.ZstdCompressor(level=3) \
+                .stream_writer(sink, closefd=False)
+        else:
+            answer = sink
+
+        return answer
+    #---------------------------------------------------------------------------
+    def buildFilename (self, bucket=None, folder=None, name=None, 
+        extension=None):
+        """
+        Construct an fully qualified S3 name from the bucket, folder, 
+        filename, and extention.
+        """
+        answer = (bucket if bucket else self.bucket) + "/" + \
+            (folder if folder else self.folder) + "/" + \
+            ((name + "." + extension) if extension else name)
+
+        return answer
+    #---------------------------------------------------------------------------
+    @property
+    def filename (self):
+        """
+        Return the unique S3 key associated with this object.
+        """
+        if self._filename:
+            answer = self._filename
+        else:
+            answer = self.prefix + "-" + \
+                time.strftime("%Y%m%d-%H%M%S") + \
+                self.suffix
+
+            self._filename = answer
+
+        return answer
+    #---------------------------------------------------------------------------
+    @filename.setter
+    def filename (self, value=None):
+        """
+        Use a given filename, e.g. that of an export being resumed.
+        """
+        self._filename = value
+    #---------------------------------------------------------------------------
+    def filePath (self, directory = "/tmp"):
+        """
+        Return a local fully qualified file path.
+        """
+        return "/".join([directory, self.filename])
+    #---------------------------------------------------------------------------
+    @property
+    def objectKey (self):
+        """
+        Return an S3 object key from the "folder" and unique filename.
+        """
+        return "/".join([self.folder, self.filename]) 
+    #---------------------------------------------------------------------------
+    def put (self, inputFile = None, outputObject = None ):
+        """
+        Store an object in the S3 bucket. The inputFile is read from
+        the local filesystem and stored to S3 as outputObject.
+        """
+        source = inputFile if inputFile else self.filePath()
+        target = outputObject if outputObject else self.objectKey
+
+        try:
+            METRICS.count("bytesUploaded", os.path.getsize(source))
+
+            with open(source, "rb") as source, METRICS.phase("upload"):
+                answer = self.primaryClient.put_object(
+                    Bucket=self.bucket,
+                    Key=target,
+                    Body=source,
+                    **self.objectParameters
+                )
+
+        except botocore.exceptions.ClientError as thrown:
+            answer = None
+            _LOGGER.critical("496330s cannot put object %s to bucket %s: %s" \
+                % (target, self.bucket, str(thrown)))
+
+        return answer
+    #---------------------------------------------------------------------------
+    @property
+    def manifestKey (self):
+        """
+        Return the key of the JSON manifest describing the export object.
+        """
+        return self.objectKey + ".manifest.json"
+    #---------------------------------------------------------------------------
+    def putManifest (self, document={}):
+        """
+        Store a JSON manifest next to the export object.
+        """
+        try:
+            answer = self.primaryClient.put_object(
+                Bucket=self.bucket,
+                Key=self.manifestKey,
+                Body=json.dumps(document, indent=2).encode("utf-8"),
+                ContentType="application/json"
+            )
+
+        except botocore.exceptions.ClientError as thrown:
+            answer = None
+            _LOGGER.critical("496920s cannot put manifest %s to bucket %s: %s" \
+                % (self.manifestKey, self.bucket, str(thrown)))
+
+        return answer
+    #---------------------------------------------------------------------------
+    def writer (self, outputObject=None, partSize=S3StreamWriter._PART_SIZE,
+        state=None):
+        """
+        Return an S3StreamWriter which uploads directly to outputObject (by 
+        default the unique object key) as it is written, continuing the 
+        suspended upload described by state if there is one.
+        """
+        return S3StreamWriter(
+            client=self.primaryClient,
+            bucket=self.bucket,
+            key=outputObject if outputObject else self.objectKey,
+            partSize=partSize,
+            extra=self.objectParameters,
+            state=state
+        )
+    #---------------------------------------------------------------------------
+    def delete (self, key=None):
+        """
+        Delete an object from the bucket.
+        """
+        try:
+            answer = self.primaryClient.delete_object(Bucket=self.bucket, Key=key)
+
+        except botocore.exceptions.ClientError as thrown:
+            answer = None
+            _LOGGER.error("496950e cannot delete object %s from bucket %s: %s" \
+                % (key, self.bucket, str(thrown)))
+
+        return answer
+    #---------------------------------------------------------------------------
+    def partKey (self, index=0):
+        """
+        Return the key of one part of an export written in parts (e.g. one per
+        region), which are kept in a folder named after the export.
+        """
+        return "/".join([self.folder, "parts", self.filename,
+            "%05d%s" % (index, self.suffix)])
+    #---------------------------------------------------------------------------
+    def concatenate (self, keys=[], header=b"", outputObject=None):
+        """
+        Assemble the export object (by default the unique object key) from
+        header followed by the part objects in the order given, then delete
+        the parts. The parts are copied within S3 (see S3StreamWriter.copy),
+        so little of them passes through this process; the bytes are copied
+        as they are, so compressed parts must each be complete gzip members or
+        zstd frames. A part may be the output object itself, which is not
+        deleted. Returns the number of bytes written.
+        """
+        with self.writer(outputObject=outputObject, 
+            partSize=S3StreamWriter._MINIMUM_PART_SIZE) as sink:
+            sink.write(header)
+
+            for key in keys:
+                try:
+                    size = self.primaryClient.head_object(
+                        Bucket=self.bucket,
+                        Key=key
+                    ).get("ContentLength")
+                except botocore.exceptions.ClientError as thrown:
+                    _LOGGER.critical("496970s cannot get part %s from bucket %s: %s" \
+                        % (key, self.bucket, str(thrown)))
+                    raise
+
+                sink.copy(key=key, size=size)
+
+            answer = sink.bytes
+
+        for key in keys:
+            if key != sink.key:
+                self.delete(key=key)
+
+        _LOGGER.info(f'496980i assembled s3://{self.bucket}/{sink.key} from ' +
+            f'{len(keys)} parts in {max(len(sink.parts), 1)} upload parts')
+
+        return answer
+    #---------------------------------------------------------------------------
+    def parseS3Url (self, url=None):
+        """
+        Parse an S3 url into bucket and key components.
+        """
+        # This pattern will match s3://[bucket]/[key]
+        pattern = re.compile(
+            r'^s3://(?!^(\d{1,3}\.){3}\d{1,3}$)(^[a-z0-9]([a-z0-9-]*(\.[a-z0-9])?)*$)(/*(.*))',
+            flags=re.IGNORECASE
+        )
+
+        # Perform the match
+        match = pattern.match(url) if url else None
+
+        if not match:
+            answer = None
+        else:
+            answer = ( match.group(1), match.group(3) )
+
+        return answer
+    #---------------------------------------------------------------------------
+    def open (self, file=None, bucket=None, key=None, encoding="utf-8-sig"):
+        """
+        Open an object in S3 or a local file for reading as a stream of text,
+        which is downloaded, decompressed (if it is gzip or zstd) and decoded
+        as it is read. Memory use does not depend on the size of the object. 
+        The stream is opened with newline="" as the csv module requires, so
+        quoted values may contain newlines. The caller must close the stream.
+
+        Parameters
+        ----------
+        file : str 
+            A local file path 
+        bucket : str
+            Mutually exclusive with file, specifies an S3 bucket name
+        key : str
+            Mutually exclusive with file, specifies an S3 object key
+        """
+        # Specifying a local file overrides S3
+        if file:
+            name = file
+            contentEncoding = None
+            raw = io.FileIO(file, "r")
+        else:
+            bucket = bucket if bucket else self.bucket
+            key = key if key else self.objectKey
+            name = key
+
+            try:
+                response = self.primaryClient.get_object(
+                    Bucket=bucket,
+                    Key=key
+                )
+            except botocore.exceptions.ClientError as thrown:
+                _LOGGER.critical("496350s cannot get object %s from bucket %s: %s" \
+                    % (key, bucket, str(thrown)))
+                raise
+
+            contentEncoding = response.get("ContentEncoding")
+            raw = S3StreamReader(response.get("Body"))
+
+        stream = io.BufferedReader(raw, buffer_size=256 * 1024)
+
+        if name.endswith(".gz") or (contentEncoding == "gzip"):
+            stream = GzipStreamReader(stream)
+        elif name.endswith(".zst") or (contentEncoding == "zstd"):
+            if not zstandard:
+                raise ActorException("496770t zstandard is required to read %s" \
+                    % name)
+
+            # Exports may be several frames (e.g. header, parts or segments)
+            stream = io.BufferedReader(zstandard.ZstdDecompressor() \
+                .stream_reader(stream, closefd=True, read_across_frames=True))
+
+        return io.TextIOWrapper(stream, encoding=encoding, newline="")
+    #---------------------------------------------------------------------------
+    def get (self, file=None, bucket=None, key=None, split=False):
+        """
+        Retrieve an object from S3 or a local file and return the entire body.
+
+        Parameters
+        ----------
+        file : str 
+            A local file path 
+        bucket : str
+            Mutually exclusive with file, specifies an S3 bucket name
+        key : str
+            Mutually exclusive with file, specifies an S3 object key
+        """
+        # Specifying a local file overrides S3
+        if file:
+            source = file
+
+            try:
+                with open(source, "r") as input:
+                    candidate = input.read()
+
+                if not split:
+                    answer = candidate
+                else:
+                    answer = [ line.strip() for line in candidate.splitlines() ]
+            except Exception as thrown:
+                answer = None
+                _LOGGER.critical("496340s cannot read file %s: %s" \
+                    % (source, str(thrown)))
+        else:
+            bucket = bucket if bucket else self.bucket
+            key = key if key else self.objectKey
+
+            try:
+                response = self.primaryClient.get_object(
+                    Bucket=bucket,
+                    Key=key
+                )
+
+                candidate = response.get("Body").read().decode("utf-8")
+
+                if not split:
+                    answer = candidate
+                else:
+                    answer = [ line.strip() for line in candidate.splitlines() ]
+            except botocore.exceptions.ClientError as thrown:
+                answer = None
+                _LOGGER.critical("496350s cannot get object %s from bucket %s: %s" \
+                    % (key, bucket, str(thrown)))
+
+        return answer   
+################################################################################
+# 
+################################################################################
+class ExportCheckpoint:
+    """
+    The saved progress of an export that stopped before the Lambda deadline,
+    from which a later invocation continues. It is stored as two S3 objects
+    under the export folder's _FOLDER: a JSON state document (whose key is 
+    the continuation token) and the export bytes written since the last 
+    uploaded part (the tail, which is too small to be a part of its own).
+    """
+    _FOLDER = "checkpoints"
+    #---------------------------------------------------------------------------
+    def __init__ (self, s3Actor=None, key=None):
+        """
+        See class definition for details. Without a key, the checkpoint is
+        named after the S3Actor's export.
+        """
+        self.s3Actor = s3Actor
+        self.key = key if key else "/".join([ s3Actor.folder, 
+            ExportCheckpoint._FOLDER, s3Actor.filename + ".json" ])
+    #---------------------------------------------------------------------------
+    @property
+    def tailKey (self):
+        """
+        Return the key of the object holding the tail.
+        """
+        return self.key + ".tail"
+    #---------------------------------------------------------------------------
+    def save (self, state={}, tail=b""):
+        """
+        Store the state document and tail, returning the continuation token.
+        """
+        client = self.s3Actor.primaryClient
+
+        client.put_object(Bucket=self.s3Actor.bucket, Key=self.tailKey, 
+            Body=tail)
+        client.put_object(Bucket=self.s3Actor.bucket, Key=self.key,
+            Body=json.dumps(state).encode("utf-8"), 
+            ContentType="application/json")
+
+        _LOGGER.info(f'496960i checkpoint saved to s3://{self.s3Actor.bucket}/' +
+            f'{self.key}')
+
+        return self.key
+    #---------------------------------------------------------------------------
+    def load (self):
+        """
+        Return the stored (state, tail).
+        """
+        client = self.s3Actor.primaryClient
+
+        state = json.loads(client.get_object(Bucket=self.s3Actor.bucket, 
+            Key=self.key)["Body"].read())
+        tail = client.get_object(Bucket=self.s3Actor.bucket, 
+            Key=self.tailKey)["Body"].read()
+
+        return state, tail
+    #---------------------------------------------------------------------------
+    def delete (self):
+        """
+        Remove the checkpoint once the export it belongs to is complete.
+        """
+        self.s3Actor.delete(key=self.tailKey)
+        self.s3Actor.delete(key=self.key)
+################################################################################
+# 
+################################################################################
+class PartitionedExport:
+    """
+    Write an export as one CSV object per Hive-style partition, under 
+    dt=YYYY-MM-DD/region=REGION/severity=LABEL/ prefixes of the export folder
+    (dt is the date of the export), so that queries filtering on those columns
+    read only the matching objects. Rows are written in a single pass as they
+    arrive; each partition has an S3StreamWriter, of which at most maxOpen 
+    are open at once. Rows are best written region by region (the order in 
+    which streamFindings yields pages, even with several workers), calling 
+    flush between regions.
+
+    When a partition's writer has to be closed to make room for another, the 
+    object it wrote is complete; anything later written to that partition is
+    stored as a further segment under the parts folder, and the segments are
+    appended to the partition's object (within S3) when the export is closed.
+    Each segment is a complete gzip member or zstd frame if compressed.
+    """
+    _OPEN = 16                      # Most partition writers open at once
+    #---------------------------------------------------------------------------
+    def __init__ (self, s3Actor=None, columns=(), maxOpen=_OPEN, date=None):
+        """
+        See class definition for details. The date defaults to today (UTC).
+        """
+        self.s3Actor = s3Actor
+        self.columns = columns
+        self.maxOpen = maxOpen
+        self.date = date if date else \
+            datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        self.writers = collections.OrderedDict()
+        self.segments = {}
+        self.count = 0
+    #---------------------------------------------------------------------------
+    def partition (self, finding={}, region=None):
+        """
+        Return the partition of a finding dict, as a tuple of name=value 
+        strings.
+        """
+        severity = (finding.get("Severity") or {}).get("Label") or "UNKNOWN"
+        region = finding.get("Region") or region or "UNKNOWN"
+
+        return tuple([ "%s=%s" % (name, re.sub(r'[/=]', "_", value)) 
+            for name, value in (("dt", self.date), ("region", region), 
+            ("severity", severity)) ])
+    #---------------------------------------------------------------------------
+    def key (self, partition=(), segment=0):
+        """
+        Return the key of a partition's object, or of a later segment of it.
+        """
+        if segment == 0:
+            answer = "/".join([ self.s3Actor.folder, *partition, 
+                self.s3Actor.filename ])
+        else:
+            answer = "/".join([ self.s3Actor.folder, "parts", 
+                self.s3Actor.filename, *partition, 
+                "%05d%s" % (segment, self.s3Actor.suffix) ])
+
+        return answer
+    #---------------------------------------------------------------------------
+    @property
+    def keys (self):
+        """
+        Return the keys of the partition objects written so far.
+        """
+        return sorted([ segments[0] for segments in self.segments.values() ])
+    #---------------------------------------------------------------------------
+    def writerows (self, partition=(), rows=[]):
+        """
+        Write rows to a partition, opening its writer if need be.
+        """
+        if partition in self.writers:
+            self.writers.move_to_end(partition)
+        else:
+            self._open(partition)
+
+        sink, stream, target, writer = self.writers[partition]
+
+        for row in rows:
+            writer.writerow(row)
+            self.count += 1
+    #---------------------------------------------------------------------------
+    def _open (self, partition=()):
+        """
+        Open a writer for a partition (a new segment if it has been written
+        before), closing the least recently used writer if too many are open.
+        """
+        while len(self.writers) >= self.maxOpen:
+            self._close(next(iter(self.writers)))
+
+        segments = self.segments.setdefault(partition, [])
+        key = self.key(partition=partition, segment=len(segments))
+
+        segments.append(key)
+
+        sink = self.s3Actor.writer(outputObject=key, 
+            partSize=S3StreamWriter._MINIMUM_PART_SIZE)
+        stream = self.s3Actor.compressor(sink)
+        target = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        writer = csv.writer(target)
+
+        if len(segments) == 1:
+            writer.writerow(self.columns)
+
+        self.writers[partition] = (sink, stream, target, writer)
+    #---------------------------------------------------------------------------
+    def _close (self, partition=()):
+        """
+        Finish a partition's writer, completing its object.
+        """
+        sink, stream, target, writer = self.writers.pop(partition)
+
+        try:
+            target.flush()
+            target.detach()
+
+            if stream is not sink:
+                stream.close()
+
+        except Exception:
+            sink.abort()
+            raise
+
+        sink.close()
+    #---------------------------------------------------------------------------
+    def flush (self):
+        """
+        Finish every open writer, e.g. once a region's findings are complete,
+        since its partitions won't be written again.
+        """
+        while self.writers:
+            self._close(next(iter(self.writers)))
+    #---------------------------------------------------------------------------
+    def close (self):
+        """
+        Finish every open writer, then append any later segments of each
+        partition to its object.
+        """
+        self.flush()
+
+        segments = sum([ len(keys) for keys in self.segments.values() ])
+
+        for partition, keys in self.segments.items():
+            if len(keys) > 1:
+                self.s3Actor.concatenate(keys=keys, outputObject=keys[0])
+
+        _LOGGER.info(f'496990i wrote {self.count} rows to ' +
+            f'{len(self.segments)} partitions in {segments} segments')
+
+        if segments > len(self.segments):
+            _LOGGER.warning(f'497040w {segments - len(self.segments)} ' +
+                f'segments appended, more than {self.maxOpen} partitions ' +
+                'were written at once')
+    #---------------------------------------------------------------------------
+    def abort (self):
+        """
+        Abandon the open writers. Objects already completed are deleted.
+        """
+        for sink, stream, target, writer in self.writers.values():
+            sink.abort()
+
+        self.writers.clear()
+
+        for segments in self.segments.values():
+            for key in segments:
+                self.s3Actor.delete(key=key)
+    #---------------------------------------------------------------------------
+    def __enter__ (self):
+        return self
+    #---------------------------------------------------------------------------
+    def __exit__ (self, kind, value, traceback):
+        """
+        Close the export, or abort it if the block raised an exception.
+        """
+        if kind:
+            self.abort()
+        else:
+            self.close()
+################################################################################
+# 
+################################################################################
+class TimeShard:
+    """
+    A slice of a securityhub:get_findings query restricted to a time window on
+    one date field (UpdatedAt or CreatedAt). Windows are half-open, start <= 
+    value < end, unless closed is set, in which case the end is included. The
+    window bounds are also enforced on the findings returned, so adjacent 
+    shards never share a finding whatever the precision of the timestamps.
+
+    A window may be open before its start or after its end (e.g. the first 
+    and last shards when the user gave no window), so that findings dated 
+    outside it are not lost; the bounds then only place the splits, and the
+    query's filter reaches from _MINIMUM or to _MAXIMUM instead.
+
+    Parameters
+    ----------
+    field : str
+        The finding date field the query is sharded on
+    start, end : datetime
+        The window bounds
+    closed : boolean
+        True if findings at exactly the end of the window belong to this shard
+    skip : set of tuple
+        (Id, ProductArn) keys already returned by a shard this one was split
+        from, which must not be returned again
+    token : str
+        The NextToken to continue the shard's query from, if it was stopped
+        without being split
+    openStart, openEnd : boolean
+        True if findings before the start, or after the end, belong to this
+        shard
+    """
+    _EPOCH = datetime(2018, 1, 1, tzinfo=timezone.utc)
+    _MINIMUM = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    _MAXIMUM = datetime(9999, 12, 31, 23, 59, 59, tzinfo=timezone.utc)
+                                    # Filter bounds of open windows
+    #---------------------------------------------------------------------------
+    def __init__ (self, field="UpdatedAt", start=None, end=None, closed=False, 
+        skip=None, token=None, openStart=False, openEnd=False):
+        """
+        See class definition for details.
+        """
+        self.field = field
+        self.start = start
+        self.end = end
+        self.closed = closed
+        self.skip = skip if skip else set()
+        self.token = token
+        self.openStart = openStart
+        self.openEnd = openEnd
+    #---------------------------------------------------------------------------
+    def __repr__ (self):
+        return "%s%s%s, %s%s" % (self.field, 
+            "(.." if self.openStart else "[",
+            FindingActions.formatTimestamp(self.start), 
+            FindingActions.formatTimestamp(self.end), 
+            "..)" if self.openEnd else "]" if self.closed else ")")
+    #---------------------------------------------------------------------------
+    def filters (self, filters={}):
+        """
+        Return a copy of the user's filters with this shard's date range in 
+        place of any existing filter on the sharded field.
+        """
+        # Filters have millisecond precision, so round the window outwards
+        excess = self.end.microsecond % 1000
+        end = self.end + timedelta(microseconds=(1000 - excess) if excess else 0)
+
+        answer = dict(filters)
+        answer[self.field] = [{
+            "Start": FindingActions.formatTimestamp(TimeShard._MINIMUM 
+                if self.openStart else self.start),
+            "End": FindingActions.formatTimestamp(TimeShard._MAXIMUM 
+                if self.openEnd else end)
+        }]
+
+        return answer
+    #---------------------------------------------------------------------------
+    def contains (self, finding={}):
+        """
+        True if a finding belongs to this shard. Findings without a parseable
+        date are kept, since the service matched them.
+        """
+        value = FindingActions.parseTimestamp(finding.get(self.field))
+
+        if (finding.get("Id"), finding.get("ProductArn")) in self.skip:
+            answer = False
+        elif value == None:
+            answer = True
+        elif value < self.start:
+            answer = self.openStart
+        elif value > self.end:
+            answer = self.openEnd
+        else:
+            answer = self.closed or self.openEnd or (value < self.end)
+
+        return answer
+    #---------------------------------------------------------------------------
+    def split (self, parts=2):
+        """
+        Split this shard into a number of shards of equal duration. Findings
+        to be skipped remain with the first shard, which shares the start; 
+        the first and last shards keep any open start and end respectively.
+        """
+        step = (self.end - self.start) / parts
+        answer = []
+
+        for part in range(parts):
+            last = part == parts - 1
+
+            answer.append(TimeShard(
+                field=self.field,
+                start=self.start + (step * part),
+                end=self.end if last else self.start + (step * (part + 1)),
+                closed=self.closed if last else False,
+                skip=self.skip if part == 0 else None,
+                openStart=self.openStart if part == 0 else False,
+                openEnd=self.openEnd if last else False
+            ))
+
+        return answer
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def window (filters={}, field="UpdatedAt", now=None):
+        """
+        Return the (start, end) datetimes covered by the user's filters on the
+        sharded field, or None if they can't be expressed as a single window.
+        Without a filter on the field, the window runs from the launch of 
+        Security Hub until a day from now, and should be left open at both 
+        ends (see TimeShard).
+        """
+        now = now if now else datetime.now(timezone.utc)
+        candidates = filters.get(field) if filters else None
+
+        if not candidates:
+            answer = (TimeShard._EPOCH, now + timedelta(days=1))
+        elif len(candidates) != 1:
+            answer = None
+        elif candidates[0].get("DateRange"):
+            dateRange = candidates[0]["DateRange"]
+
+            if dateRange.get("Unit", "DAYS") != "DAYS":
+                answer = None
+            else:
+                answer = (now - timedelta(days=dateRange.get("Value", 0)), now)
+        else:
+            start = FindingActions.parseTimestamp(candidates[0].get("Start"))
+            end = FindingActions.parseTimestamp(candidates[0].get("End"))
+
+            if start and end:
+                answer = (start, end)
+            else:
+                answer = None
+
+        return answer
+################################################################################
+# 
+################################################################################
+class HubActor (Actor):
+    """
+    Perform Security Hub API actions. The following API actions are used 
+    by this concrete class:
 
+    securityhub:GetFindings
+    securityhub:BatchUpdateFindings
+    securityhub:DescribeHub
+    securityhub:ListFindingAggregators
+    securityhub:GetFindingAggregator
+    """
+    _DISABLED = ("InvalidAccessException", "ResourceNotFoundException",
+        "UnrecognizedClientException", "InvalidClientTokenId")
+                                    # Errors meaning a region isn't usable
+    _SHARD_FIELD = "UpdatedAt"      # Date field used to shard a region's query
+    _SHARD_PAGES = 20               # Pages a shard may return before splitting
+    _PREFETCH = 4                   # Pages a region may download ahead
+    #---------------------------------------------------------------------------
+    def __init__ (self, region=None, role = None, 
+        connections=ClientRegistry._POOL_CONNECTIONS, breaker=None):
+        """
+        See class definition for details. If a RegionBreaker is supplied, 
+        regions it has opened are skipped by streamFindings, and the outcome 
+        of each region's download is reported to it.
+
+        Unsharded downloads keep each region's next NextToken in tokens (None 
+        once the region is exhausted), and continue from the tokens already 
+        there, so that a download can be stopped and later resumed.
+        """
+        super().__init__(
+            "securityhub",
+            region=region,
+            role=role,
+            connections=connections
+        )
+
+        self.findings = []
+        self.count = 0
+        self.breaker = breaker
+        self.regionFilters = {}
+        self.completed = set()
+        self.tokens = {}
+    #---------------------------------------------------------------------------
+    def updateFindings (self, region=None, parameters=None):
+        """
+        Update a finding. Parameters are generated by the MinimalUpdateList
+        parameterSets method. This method returns the untouched response
+        structure from the API call. Calls are paced and retried by LIMITERS;
+        None is returned if every attempt fails.
+        """
+        client = self.client[region]
+
+        try:
+            response = LIMITERS.call(region, "BatchUpdateFindings",
+                client.batch_update_findings, **parameters)
         except Exception as thrown:
-            _LOGGER.error("496310e cannot get parameters: %s" % str(thrown))
+            response = None
 
-            if not single:
-                for name in names:
-                    _LOGGER.info("496320d parameter '%s' set to None" % name)
-                    answer[name] = None
+            _LOGGER.critical("496360t securityhub:batch_update_findings: %s" \
+                % str(thrown))
+
+        return response
+    #---------------------------------------------------------------------------
+    def downloadFindings (self, regions=None, filters={}, limit=0, workers=1,
+        shards=1, shardField=_SHARD_FIELD, unique=None):
+        """
+        Get findings from Security Hub using the securityhub:get_findings API,
+        applying filters as necessary, and limiting results as necessary.
+        """
+        self.findings = []
+
+        for region, findings in self.streamFindings(regions=regions, 
+            filters=filters, limit=limit, workers=workers, shards=shards,
+            shardField=shardField, unique=unique):
+            self.findings += findings
+
+        return self.findings
+    #---------------------------------------------------------------------------
+    def streamFindings (self, regions=None, filters={}, limit=0, workers=1,
+        prefetch=_PREFETCH, shards=1, shardField=_SHARD_FIELD, unique=None):
+        """
+        Generator yields a (region, findings) tuple for each successive page
+        returned by the securityhub:get_findings API, applying filters and 
+        limiting results as necessary. Only the current page is held, so the
+        memory used does not depend on the total number of findings.
+
+        If workers is greater than one, regions are paged concurrently (see
+        concurrentPages) but pages are still yielded in region order, so the
+        results and the limit behave exactly as they do for a serial download.
+        Each region downloads at most prefetch pages ahead of the consumer.
+
+        If shards is greater than one, each region's query is itself split into
+        that many concurrent time windows (see shardedPages).
+
+        If unique is set, findings already yielded (by Id and ProductArn) are
+        dropped from later pages; by default this is done whenever more than 
+        one region is queried, since an aggregation region also returns the 
+        findings of its linked regions.
+        """
+        regions = regions if regions else self.regions
+
+        # Skip the regions that keep failing
+        if self.breaker:
+            skipped = [ region for region in regions 
+                if not self.breaker.allow(region) ]
+            regions = [ region for region in regions if region not in skipped ]
+
+            if skipped:
+                _LOGGER.warning(f'496820w skipping failing regions {skipped}')
+
+            for region in skipped:
+                self.tokens[region] = None
+
+        if (workers > 1) and (len(regions) > 1):
+            pages = self.concurrentPages(regions=regions, filters=filters, 
+                workers=workers, prefetch=prefetch, shards=shards, 
+                shardField=shardField)
+        else:
+            pages = self.serialPages(regions=regions, filters=filters,
+                shards=shards, shardField=shardField)
+
+        self.count = 0
+        downloaded = 0
+        seen = FindingKeySet() if (unique or 
+            ((unique is None) and (len(regions) > 1))) else None
+
+        try:
+            for region, findings in pages:
+                if seen is not None:
+                    findings = [ finding for finding in findings 
+                        if seen.add(finding) ]
+
+                    if not findings:
+                        continue
+
+                downloaded += len(findings)
+                self.count = downloaded
+
+                if (downloaded % 1000) == 0:
+                    _LOGGER.info("496380i ... %8d findings retrieved" \
+                        % downloaded)
+
+                yield region, findings
+
+                # If we've exceeded the finding limit, we're done
+                if (limit != 0) and (downloaded > limit):
+                    _LOGGER.info("496390i %d findings exceeds limit of %d" \
+                        % (downloaded, limit))
+                    break
+        finally:
+            pages.close()
+
+        _LOGGER.info("496410i retrieved %d total findings from all regions" \
+            % downloaded)
+
+        if seen and seen.duplicates:
+            _LOGGER.info(f'496890i dropped {seen.duplicates} duplicate findings')
+    #---------------------------------------------------------------------------
+    def remainingRegions (self, regions=None):
+        """
+        Return the regions that still have findings to page through after a
+        download stopped early: those not yet started, and those with a 
+        saved NextToken (see tokens) to continue from.
+        """
+        regions = regions if regions else self.regions
+
+        return [ region for region in regions 
+            if (region not in self.tokens) or self.tokens[region] ]
+    #---------------------------------------------------------------------------
+    def serialPages (self, regions=None, filters={}, shards=1, 
+        shardField=_SHARD_FIELD):
+        """
+        Generator yields (region, findings) pages one region after another.
+        """
+        for region in regions:
+            _LOGGER.info(f'496370i retrieving findings from region {region}')
+
+            for findings in self.regionPages(region=region, filters=filters,
+                shards=shards, shardField=shardField):
+                yield region, findings
+    #---------------------------------------------------------------------------
+    def concurrentPages (self, regions=None, filters={}, workers=4, 
+        prefetch=_PREFETCH, shards=1, shardField=_SHARD_FIELD):
+        """
+        Generator yields (region, findings) pages in the same order as 
+        serialPages, while a pool of worker threads pages through the regions
+        concurrently. Each region has its own queue of downloaded pages, which
+        holds at most prefetch pages (zero means unbounded, which holds every
+        later region in memory while an earlier one is consumed); a region's
+        pages are yielded only once all earlier regions are exhausted, and a
+        worker whose queue is full waits for it to drain.
+
+        Closing the generator stops the workers after their current request.
+        """
+        stop = threading.Event()
+        pipes = [ queue.Queue(maxsize=prefetch) for region in regions ]
+        pool = ThreadPoolExecutor(max_workers=workers, 
+            thread_name_prefix="findings")
+
+        _LOGGER.info(f'496620i paging {len(regions)} regions with ' +
+            f'{workers} workers')
+
+        #-----------------------------------------------------------------------
+        def deliver (pipe, item):
+            """
+            Queue an item, giving up if the consumer has gone away.
+            """
+            while not stop.is_set():
+                try:
+                    pipe.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+        #-----------------------------------------------------------------------
+        def produce (region, pipe):
+            """
+            Download every page of one region into its queue, followed by the
+            exception that ended the download (if any) and a None sentinel.
+            """
+            try:
+                if not stop.is_set():
+                    _LOGGER.info(f'496370i retrieving findings from region {region}')
+
+                    for findings in self.regionPages(region=region, 
+                        filters=filters, shards=shards, shardField=shardField):
+                        deliver(pipe, findings)
+
+                        if stop.is_set():
+                            break
+            except Exception as thrown:
+                deliver(pipe, thrown)
+            finally:
+                deliver(pipe, None)
+
+        try:
+            for region, pipe in zip(regions, pipes):
+                pool.submit(produce, region, pipe)
+
+            for region, pipe in zip(regions, pipes):
+                while True:
+                    item = pipe.get()
+
+                    if item is None:
+                        break
+                    elif isinstance(item, Exception):
+                        raise item
+
+                    yield region, item
+        finally:
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+    #---------------------------------------------------------------------------
+    def regionPages (self, region=None, filters={}, shards=1, 
+        shardField=_SHARD_FIELD):
+        """
+        Generator yields each successive page of findings for a single region,
+        following the NextToken chain of the securityhub:get_findings API, or
+        the chains of several time-window shards if shards is greater than one.
+        """
+        # Get SecurityHub client for this region
+        client = self.client[region]
+
+        # Apply any filters particular to this region, unless overridden
+        filters = dict(self.regionFilters.get(region, {}), **filters)
+
+        try:
+            window = TimeShard.window(filters=filters, field=shardField) \
+                if shards > 1 else None
+
+            if window:
+                # Without a user window, findings dated outside it are kept
+                unbounded = not filters.get(shardField)
+
+                yield from self.shardedPages(region=region, filters=filters, 
+                    shards=TimeShard(shardField, *window, closed=True,
+                    openStart=unbounded, openEnd=unbounded).split(shards))
+            else:
+                if shards > 1:
+                    _LOGGER.warning(f'496630w {shardField} filter in {region} ' +
+                        'is not a single window, query not sharded')
+
+                # Continue from a saved NextToken, if there is one
+                token = self.tokens.get(region)
+
+                while True:
+                    parameters = { "Filters": filters, "MaxResults": 100 }
+
+                    if token:
+                        parameters["NextToken"] = token
+
+                    answer = self.getPage(region=region, parameters=parameters)
+
+                    token = answer.get("NextToken", None)
+
+                    # Where to continue once this page has been consumed
+                    self.tokens[region] = token
+
+                    if not token:
+                        self.completed.add(region)
+
+                    yield answer.get("Findings", [])
+
+                    # This is the last set of findings if there is no "nexttoken"
+                    if not token: 
+                        break
+
+        except client.exceptions.InvalidAccessException as thrown:
+            _LOGGER.error('496400e cannot retrieve findings for ' 
+                + f'region {region}: {thrown.response["Error"]["Message"]}')
+
+            self.tokens[region] = None
+
+            if self.breaker:
+                self.breaker.failure(region)
+
+        except Exception:
+            if self.breaker:
+                self.breaker.failure(region)
+
+            raise
+
+        else:
+            self.completed.add(region)
+
+            if self.breaker:
+                self.breaker.success(region)
+    #---------------------------------------------------------------------------
+    def getPage (self, region=None, parameters={}):
+        """
+        Return one securityhub:get_findings response for a region, timing its
+        calls as the region's download and counting its page and findings (see
+        MetricsCollector). Calls are paced and retried by LIMITERS, whose waits
+        are not part of the download.
+        """
+        answer = LIMITERS.call(region, "GetFindings", METRICS.timed("download",
+            self.client[region].get_findings, region=region), **parameters)
+
+        METRICS.count("pages", region=region)
+        METRICS.count("findings", len(answer.get("Findings", [])), 
+            region=region)
+
+        return answer
+    #---------------------------------------------------------------------------
+    def shardedPages (self, region=None, filters={}, shards=[]):
+        """
+        Generator yields the pages of a region's query split into disjoint 
+        time-window shards, which are paginated concurrently. A shard that
+        returns more than _SHARD_PAGES pages stops, and the rest of its window
+        is split into two new shards which take its place in the queue. Pages
+        are yielded in shard (time window) order.
+
+        No more than twice the number of initial shards are downloaded ahead
+        of the consumer, which bounds the memory used.
+        """
+        workers = len(shards)
+        pending = list(shards)
+        futures = {}
+        pool = ThreadPoolExecutor(max_workers=workers, 
+            thread_name_prefix=f'shards-{region}')
+
+        _LOGGER.info(f'496640i paging {region} in {workers} shards')
+
+        try:
+            while pending:
+                for shard in pending[:workers * 2]:
+                    if not shard in futures:
+                        futures[shard] = pool.submit(self.shardPages, 
+                            region=region, filters=filters, shard=shard)
+
+                shard = pending.pop(0)
+                pages, remainder = futures.pop(shard).result()
+
+                for findings in pages:
+                    yield findings
+
+                if remainder and remainder.token:
+                    _LOGGER.debug(f'497030d continuing {remainder} in {region}')
+
+                    pending[0:0] = [ remainder ]
+                elif remainder:
+                    _LOGGER.debug(f'496650d splitting {remainder} in {region}')
+
+                    pending[0:0] = remainder.split(2)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    #---------------------------------------------------------------------------
+    def shardPages (self, region=None, filters={}, shard=None):
+        """
+        Download the pages of a single shard, sorted on the sharded field. 
+        Returns a tuple of the pages and, if the shard returned more than
+        _SHARD_PAGES pages, a shard covering the rest of its window (else None).
+        If no split point makes progress (e.g. every finding shares one 
+        timestamp), that shard continues the same query from its NextToken, 
+        so no more than _SHARD_PAGES pages are ever held.
+        """
+        parameters = {
+            "Filters": shard.filters(filters),
+            "SortCriteria": [{"Field": shard.field, "SortOrder": "asc"}],
+            "MaxResults": 100
+        }
+        pages = []
+        remainder = None
+
+        if shard.token:
+            parameters["NextToken"] = shard.token
+
+        while True:
+            answer = self.getPage(region=region, parameters=parameters)
+            findings = answer.get("Findings", [])
+            token = answer.get("NextToken", None)
+
+            pages.append([ finding for finding in findings 
+                if shard.contains(finding) ])
+
+            if not token:
+                break
+
+            parameters["NextToken"] = token
+
+            # Too many pages, split the remaining window if progress was made
+            if len(pages) >= HubActor._SHARD_PAGES:
+                last = FindingActions.parseTimestamp(findings[-1] \
+                    .get(shard.field)) if findings else None
+
+                # The findings at the last timestamp, which the rest of the
+                # window may return again (a continued shard carries those
+                # of its earlier pages)
+                seen = set(shard.skip)
+
+                for page in pages:
+                    for finding in page:
+                        if FindingActions.parseTimestamp(
+                            finding.get(shard.field)) == last:
+                            seen.add((finding.get("Id"), 
+                                finding.get("ProductArn")))
+
+                if last and (last > shard.start) and (last < shard.end):
+                    remainder = TimeShard(shard.field, last, shard.end, 
+                        closed=shard.closed, skip=seen, openEnd=shard.openEnd)
+                else:
+                    remainder = TimeShard(shard.field, shard.start, shard.end,
+                        closed=shard.closed, skip=seen, token=token,
+                        openStart=shard.openStart, openEnd=shard.openEnd)
+
+                break
+
+        return pages, remainder
+    #---------------------------------------------------------------------------
+    def getFinding (self):
+        """
+        Generator yields each successive finding from a previous 
+        downloadFindings operation.
+        """
+        for finding in self.findings:
+            yield finding
+    #---------------------------------------------------------------------------
+    def probeRegions (self, regions=None, workers=8):
+        """
+        Return the regions (in their original order) that have Security Hub 
+        enabled, calling securityhub:describe_hub in each concurrently. Only
+        errors showing that the hub or region is unusable rule a region out;
+        any other failure leaves it in, for the RegionBreaker to judge. Calls
+        are paced and retried by LIMITERS.
+        """
+        regions = regions if regions else self.regions
+
+        #-----------------------------------------------------------------------
+        def probe (region):
+            try:
+                LIMITERS.call(region, "DescribeHub", 
+                    self.client[region].describe_hub)
+
+            except ClientError as thrown:
+                if errorCode(thrown) in HubActor._DISABLED:
+                    _LOGGER.info(f'496830i Security Hub not enabled in {region}')
+                    return False
+
+                _LOGGER.warning(f'496840w cannot probe {region}: {thrown}')
+
+            return True
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(regions))),
+            thread_name_prefix="probe") as pool:
+            enabled = list(pool.map(probe, regions))
+
+        return [ region for region, answer in zip(regions, enabled) if answer ]
+    #---------------------------------------------------------------------------
+    def findingAggregator (self):
+        """
+        Return the cross-region aggregation configuration from the
+        securityhub:get_finding_aggregator API, or None if aggregation isn't
+        configured (or can't be determined). Calls are paced and retried by 
+        LIMITERS, since a lost configuration means duplicate findings.
+        """
+        try:
+            aggregators = LIMITERS.call(self.primaryRegion, 
+                "ListFindingAggregators", 
+                self.primaryClient.list_finding_aggregators) \
+                .get("FindingAggregators", [])
+
+            if not aggregators:
+                return None
+
+            arn = aggregators[0]["FindingAggregatorArn"]
+            region = arn.split(":")[3]
+
+            # The configuration can only be read in the aggregation region
+            return LIMITERS.call(region, "GetFindingAggregator",
+                self.client[region].get_finding_aggregator,
+                FindingAggregatorArn=arn)
+
+        except ClientError as thrown:
+            _LOGGER.warning(f'496900w cannot determine finding aggregation: ' +
+                f'{errorCode(thrown)}')
+
+        return None
+    #---------------------------------------------------------------------------
+    def aggregatedRegions (self, regions=None):
+        """
+        Return the regions that need to be queried to obtain the findings of 
+        regions, taking cross-region aggregation into account: the 
+        aggregation region replaces every region linked to it, and is given a
+        Region filter (see regionFilters) so that it only returns findings 
+        for the regions it replaces.
+        """
+        regions = list(regions if regions else self.regions)
+        aggregator = self.findingAggregator()
+
+        if not aggregator:
+            return regions
+
+        home = aggregator.get("FindingAggregationRegion")
+        mode = aggregator.get("RegionLinkingMode")
+        listed = set(aggregator.get("Regions", []))
+
+        #-----------------------------------------------------------------------
+        def linked (region):
+            if region == home:
+                return True
+            elif mode == "SPECIFIED_REGIONS":
+                return region in listed
+            elif mode == "ALL_REGIONS_EXCEPT_SPECIFIED":
+                return region not in listed
+
+            return mode == "ALL_REGIONS"
+
+        covered = [ region for region in regions if linked(region) ]
+
+        if not covered:
+            return regions
+
+        # Only the aggregation region and unlinked regions are queried
+        answer = [ home ] + [ region for region in regions if not linked(region) ]
+
+        self.regionFilters[home] = { "Region": [ { "Value": region, 
+            "Comparison": "EQUALS" } for region in covered ] }
+
+        _LOGGER.info(f'496910i {home} aggregates {covered}, querying {answer}')
 
         return answer
 ################################################################################
 # 
 ################################################################################
-class S3Actor(Actor):
+class FindingKeySet:
     """
-    Perform AWS Simple Storage Service (S3) API operations. The following S3
-    API operations are used by this concrete class:
+    A compact set of findings, by their (Id, ProductArn) key. Each key is 
+    held as a 64-bit blake2b digest rather than as its strings (typically
+    well over 150 characters), so remembering every finding of a large 
+    export costs tens of bytes per finding; a false match needs a 64-bit 
+    collision.
+    """
+    #---------------------------------------------------------------------------
+    def __init__ (self):
+        """
+        See class definition for details.
+        """
+        self.digests = set()
+        self.duplicates = 0
+    #---------------------------------------------------------------------------
+    @staticmethod
+    def digest (finding={}):
+        """
+        Return the 64-bit digest of a finding's key.
+        """
+        key = "%s\n%s" % (finding.get("Id"), finding.get("ProductArn"))
 
-    s3:PutObject
-    s3:GetObject
+        return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), 
+            digest_size=8).digest(), "little")
+    #---------------------------------------------------------------------------
+    def add (self, finding={}):
+        """
+        Add a finding, returning False if it was already present.
+        """
+        digest = FindingKeySet.digest(finding)
+
+        if digest in self.digests:
+            self.duplicates += 1
+            return False
+
+        self.digests.add(digest)
+
+        return True
+    #---------------------------------------------------------------------------
+    def __len__ (self):
+        return len(self.digests)
+################################################################################
+# 
+################################################################################
+class RegionBreaker:
     """
-    _PREFIX = "SecurityHub"
-    _SUFFIX = ".csv"
-    _FOLDER = "SecurityHub"
+    Circuit breaker for Security Hub regions. A region that fails threshold
+    times in a row (across runs, if the state is persisted) is opened and 
+    skipped until cooldown has passed. It is then tried again: a success 
+    closes the breaker, while another failure opens it for a further 
+    cooldown.
+
+    The state is a JSON-serializable dict of region to failure count and 
+    the time the breaker was opened.
+    """
+    _THRESHOLD = 3                      # Consecutive failures before opening
+    _COOLDOWN = timedelta(hours=24)     # How long an open region is skipped
+    #---------------------------------------------------------------------------
+    def __init__ (self, state=None, threshold=_THRESHOLD, cooldown=_COOLDOWN, 
+        now=None):
+        """
+        See class definition for details.
+        """
+        self.state = { region: dict(entry) 
+            for region, entry in (state or {}).items() }
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.now = now if now else datetime.now(timezone.utc)
+        self.lock = threading.Lock()
+        self.changed = False
     #---------------------------------------------------------------------------
-    def __init__ (self, bucket=None, folder=_FOLDER, prefix=_PREFIX, 
-        suffix=_SUFFIX, region=None, role=None):
+    def allow (self, region=None):
         """
-        See the class definition for details
+        Should region be queried?
         """
-        super().__init__("s3", region=region, role=role)
+        with self.lock:
+            entry = self.state.get(region)
 
-        self.prefix = prefix
-        self.suffix = suffix
-        self.folder = folder 
-        self.bucket = bucket
-        self._filename = None
+            if (not entry) or (entry.get("failures", 0) < self.threshold):
+                return True
+
+            opened = FindingActions.parseTimestamp(entry.get("openedAt"))
+
+            return (not opened) or (self.now - opened >= self.cooldown)
     #---------------------------------------------------------------------------
-    def buildFilename (self, bucket=None, folder=None, name=None, 
-        extension=None):
+    def success (self, region=None):
         """
-        Construct an fully qualified S3 name from the bucket, folder, 
-        filename, and extention.
+        Record that a region worked, closing its breaker.
         """
-        answer = (bucket if bucket else self.bucket) + "/" + \
-            (folder if folder else self.folder) + "/" + \
-            ((name + "." + extension) if extension else name)
-
-        return answer
+        with self.lock:
+            if region in self.state:
+                del self.state[region]
+                self.changed = True
     #---------------------------------------------------------------------------
-    @property
-    def filename (self):
+    def failure (self, region=None):
         """
-        Return the unique S3 key associated with this object.
+        Record that a region failed, opening its breaker at the threshold.
         """
-        if self._filename:
-            answer = self._filename
-        else:
-            answer = self.prefix + "-" + \
-                time.strftime("%Y%m%d-%H%M%S") + \
-                self.suffix
+        with self.lock:
+            entry = self.state.setdefault(region, {"failures": 0})
+            entry["failures"] += 1
+            self.changed = True
 
-            self._filename = answer
+            if entry["failures"] >= self.threshold:
+                entry["openedAt"] = FindingActions.formatTimestamp(self.now)
 
-        return answer
+                _LOGGER.warning(f'496850w {region} failed {entry["failures"]} ' +
+                    'times, skipping it for now')
+################################################################################
+# 
+################################################################################
+class RegionDiscovery:
+    """
+    Determine which Security Hub regions are worth querying. The regions 
+    configured in the CSV_SECURITYHUB_REGIONLIST environment variable or the
+    /csvManager/regionList parameter are used as they are. Otherwise, every 
+    region supporting Security Hub is probed (see HubActor.probeRegions), 
+    and the enabled regions are cached for ttl in the _PARAMETER parameter,
+    along with the state of the RegionBreaker.
+
+    The following APIs are used:
+    ssm:GetParameters
+    ssm:PutParameter
+    securityhub:DescribeHub
+    """
+    _PARAMETER = "/csvManager/enabledRegions"
+    _TTL = timedelta(hours=24)
     #---------------------------------------------------------------------------
-    def filePath (self, directory = "/tmp"):
+    def __init__ (self, ssmActor=None, role=None, ttl=_TTL, now=None):
         """
-        Return a local fully qualified file path.
+        See class definition for details.
         """
-        return "/".join([directory, self.filename])
+        self.ssmActor = ssmActor
+        self.role = role
+        self.ttl = ttl
+        self.now = now if now else datetime.now(timezone.utc)
+
+        try:
+            document = json.loads(ssmActor.getValue(RegionDiscovery._PARAMETER) 
+                or "{}")
+        except ValueError as thrown:
+            _LOGGER.warning(f'496860w ignoring malformed ' +
+                f'{RegionDiscovery._PARAMETER}: {thrown}')
+            document = {}
+
+        self.checked = FindingActions.parseTimestamp(document.get("checked"))
+        self.enabled = document.get("enabled")
+        self.probed = False
+        self.breaker = RegionBreaker(state=document.get("breaker"), now=self.now)
     #---------------------------------------------------------------------------
     @property
-    def objectKey (self):
+    def fresh (self):
         """
-        Return an S3 object key from the "folder" and unique filename.
+        Is the cached list of enabled regions still usable?
         """
-        return "/".join([self.folder, self.filename]) 
+        return (self.enabled is not None) and (self.checked is not None) \
+            and (self.now - self.checked < self.ttl)
     #---------------------------------------------------------------------------
-    def put (self, inputFile = None, outputObject = None ):
+    def configuredRegions (self):
         """
-        Store an object in the S3 bucket. The inputFile is read from
-        the local filesystem and stored to S3 as outputObject.
+        Return the explicitly configured region list, or None.
         """
-        source = inputFile if inputFile else self.filePath()
-        target = outputObject if outputObject else self.objectKey
-
-        try:
-            with open(source, "rb") as source:
-                answer = self.primaryClient.put_object(
-                    Bucket=self.bucket,
-                    Key=target,
-                    Body=source
-                )
+        configured = os.environ.get("CSV_SECURITYHUB_REGIONLIST") or \
+            getattr(self.ssmActor, "/csvManager/regionList", None)
 
-        except botocore.exceptions.ClientError as thrown:
-            answer = None
-            _LOGGER.critical("496330s cannot put object %s to bucket %s: %s" \
-                % (target, self.bucket, str(thrown)))
+        if not configured:
+            return None
 
-        return answer
+        return [ region for region in re.split(r"\s*,\s*", configured.strip()) 
+            if region ]
     #---------------------------------------------------------------------------
-    def parseS3Url (self, url=None):
+    def enabledRegions (self, candidates=[], workers=8):
         """
-        Parse an S3 url into bucket and key components.
+        Return the candidate regions that have Security Hub enabled, from the
+        cache if it is fresh, otherwise by probing them.
         """
-        # This pattern will match s3://[bucket]/[key]
-        pattern = re.compile(
-            r'^s3://(?!^(\d{1,3}\.){3}\d{1,3}$)(^[a-z0-9]([a-z0-9-]*(\.[a-z0-9])?)*$)(/*(.*))',
-            flags=re.IGNORECASE
-        )
-
-        # Perform the match
-        match = pattern.match(url) if url else None
-
-        if not match:
-            answer = None
+        if self.fresh:
+            _LOGGER.info(f'496870i using enabled regions checked at {self.checked}')
         else:
-            answer = ( match.group(1), match.group(3) )
+            self.enabled = HubActor(region=list(candidates), role=self.role) \
+                .probeRegions(workers=workers)
+            self.checked = self.now
+            self.probed = True
 
-        return answer
+            _LOGGER.info(f'496880i probed {len(candidates)} regions, ' +
+                f'{len(self.enabled)} have Security Hub enabled')
+
+        return [ region for region in candidates if region in self.enabled ]
     #---------------------------------------------------------------------------
-    def get (self, file=None, bucket=None, key=None, split=False):
+    def regions (self, candidates=[], workers=8):
         """
-        Retrieve an object from S3 or a local file and return the entire body.
-
-        Parameters
-        ----------
-        file : str 
-            A local file path 
-        bucket : str
-            Mutually exclusive with file, specifies an S3 bucket name
-        key : str
-            Mutually exclusive with file, specifies an S3 object key
+        Return the configured regions or, failing those, the enabled regions
+        among the candidates.
         """
-        # Specifying a local file overrides S3
-        if file:
-            source = file
-
-            try:
-                with open(source, "r") as input:
-                    candidate = input.read()
-
-                if not split:
-                    answer = candidate
-                else:
-                    answer = [ line.strip() for line in candidate.splitlines() ]
-            except Exception as thrown:
-                answer = None
-                _LOGGER.critical("496340s cannot read file %s: %s" \
-                    % (source, str(thrown)))
-        else:
-            bucket = bucket if bucket else self.bucket
-            key = key if key else self.objectKey
-
-            try:
-                response = self.primaryClient.get_object(
-                    Bucket=bucket,
-                    Key=key
-                )
-
-                candidate = response.get("Body").read().decode("utf-8")
-
-                if not split:
-                    answer = candidate
-                else:
-                    answer = [ line.strip() for line in candidate.splitlines() ]
-            except botocore.exceptions.ClientError as thrown:
-                answer = None
-                _LOGGER.critical("496350s cannot get object %s from bucket %s: %s" \
-                    % (key, bucket, str(thrown)))
-
-        return answer   
+        return self.configuredRegions() or \
+            self.enabledRegions(candidates=candidates, workers=workers)
+    #---------------------------------------------------------------------------
+    def save (self):
+        """
+        Store the enabled regions and breaker state, if either has changed.
+        """
+        if not (self.probed or self.breaker.changed):
+            return None
+
+        document = {
+            "checked": FindingActions.formatTimestamp(self.checked) \
+                if self.checked else None,
+            "enabled": self.enabled,
+            "breaker": self.breaker.state
+        }
+
+        return self.ssmActor.putValue(
+            name=RegionDiscovery._PARAMETER,
+            description="Security Hub regions found to be enabled, and " +
+                "failing regions",
+            value=json.dumps(document, separators=(",", ":"))
+        )
 ################################################################################
 # 
 ################################################################################
-class HubActor (Actor):
+class ExportWatermark:
     """
-    Perform Security Hub API actions. The following API actions are used 
-    by this concrete class:
-
-    securityhub:GetFindings
-    securityhub:BatchUpdateFindings
+    High-water marks for incremental exports: for each region, the UpdatedAt
+    time up to which its findings have been exported. The marks are kept as 
+    JSON in the _PARAMETER parameter.
+
+    An incremental export asks each region for the findings updated between
+    its mark and the time of the run (end); once the export is stored, the 
+    mark of every region that was read completely is moved to end. Windows
+    overlap by overlap, since findings may become visible some time after 
+    their UpdatedAt. A finding may therefore appear in more than one delta;
+    consumers merging deltas keep the row with the latest UpdatedAt for each
+    (Id, ProductArn).
+
+    The following APIs are used:
+    ssm:GetParameters
+    ssm:PutParameter
     """
+    _PARAMETER = "/csvManager/watermark"
+    _FIELD = "UpdatedAt"
+    _OVERLAP = timedelta(minutes=15)
     #---------------------------------------------------------------------------
-    def __init__ (self, region=None, role = None):
+    def __init__ (self, ssmActor=None, overlap=_OVERLAP, now=None):
         """
-        See class definition for details/
+        See class definition for details.
         """
-        super().__init__(
-            "securityhub",
-            region=region,
-            role=role
-        )
+        self.ssmActor = ssmActor
+        self.overlap = overlap
+        self.end = now if now else datetime.now(timezone.utc)
 
-        self.findings = []
-        self.count = 0
+        try:
+            document = json.loads(ssmActor.getValue(ExportWatermark._PARAMETER) 
+                or "{}")
+        except ValueError as thrown:
+            _LOGGER.warning(f'496930w ignoring malformed ' +
+                f'{ExportWatermark._PARAMETER}: {thrown}')
+            document = {}
+
+        self.marks = { region: FindingActions.parseTimestamp(value)
+            for region, value in document.items() }
     #---------------------------------------------------------------------------
-    def updateFindings (self, region=None, parameters=None):
+    def start (self, regions=[]):
         """
-        Update a finding. Parameters are generated by the MinimalUpdateList
-        parameterSets method. This method returns the untouched response
-        structure from the API call.
+        Return the start of the window covering every one of regions, which is
+        None if any of them has never been exported.
         """
-        client = self.getClient(region)
-
-        try:
-            response = client.batch_update_findings(**parameters)
-        except Exception as thrown:
-            response = None
+        marks = [ self.marks.get(region) for region in regions ]
 
-            _LOGGER.critical("496360t securityhub:batch_update_findings: %s" \
-                % str(thrown))
+        if (not marks) or (None in marks):
+            return None
 
-        return response
+        return min(marks) - self.overlap
     #---------------------------------------------------------------------------
-    def downloadFindings (self, regions=None, filters={}, limit=0):
+    def filters (self, regions=[]):
         """
-        Get findings from Security Hub using the securityhub:get_findings API,
-        applying filters as necessary, and limiting results as necessary.
+        Return the UpdatedAt filter selecting the findings of regions that 
+        changed since they were last exported (all of them, if never).
         """
-        regions = self.regions
-
-        self.findings = []
-        downloaded = 0
+        start = self.start(regions)
 
-        # Get findings for each region
+        return { ExportWatermark._FIELD: [ {
+            "Start": FindingActions.formatTimestamp(
+                start if start else TimeShard._MINIMUM),
+            "End": FindingActions.formatTimestamp(self.end)
+        } ] }
+    #---------------------------------------------------------------------------
+    def advance (self, regions=[]):
+        """
+        Move the marks of regions to the end of this run's window.
+        """
         for region in regions:
-            _LOGGER.info(f'496370i retrieving findings from region {region}')
-
-            # Get SecurityHub client for this region
-            client = self.client[region]
-
-            try:
-                token = None
-    
-                while True:
-                    if not token:
-                        answer = client.get_findings(
-                            Filters=filters, 
-                            MaxResults=100
-                        ) 
-                    else:
-                        answer = client.get_findings(
-                            Filters=filters, 
-                            MaxResults=100, 
-                            NextToken=token
-                        )
-    
-                    token = answer.get("NextToken", None)
-                    findings = answer.get("Findings", [])
-                    downloaded += len(findings)
-
-                    if (downloaded % 1000) == 0:
-                        _LOGGER.info("496380i ... %8d findings retrieved" \
-                            % downloaded)
-    
-                    self.findings += findings
-    
-                    # This is the last set of findings if there is no "nexttoken"
-                    if not token: 
-                        break
-
-                    # If we've exceeded the finding limit, we're done
-                    if (limit != 0) and (downloaded > limit):
-                        _LOGGER.info("496390i %d findings exceeds limit of %d" \
-                            % (downloaded, limit))
-                        break
-    
-                self.count = len(self.findings)
-
-                if (limit != 0) and (downloaded > limit):
-                    break
-    
-            except client.exceptions.InvalidAccessException as thrown:
-                _LOGGER.error('496400e cannot retrieve findings for ' 
-                    + f'region {region}: {thrown.response["Error"]["Message"]}')
-
-        _LOGGER.info("496410i retrieved %d total findings from all regions" \
-            % downloaded)
-
-        return self.findings
+            self.marks[region] = self.end
     #---------------------------------------------------------------------------
-    def getFinding (self):
+    @property
+    def document (self):
         """
-        Generator yields each successive finding from a previous 
-        downloadFindings operation.
+        Return the marks in their stored (JSON-serializable) form.
         """
-        for finding in self.findings:
-            yield finding
+        return { region: FindingActions.formatTimestamp(mark) 
+            for region, mark in sorted(self.marks.items()) if mark }
+    #---------------------------------------------------------------------------
+    def save (self):
+        """
+        Store the marks.
+        """
+        return self.ssmActor.putValue(
+            name=ExportWatermark._PARAMETER,
+            description="UpdatedAt up to which each region has been exported",
+            value=json.dumps(self.document, separators=(",", ":"))
+        )
 ################################################################################
 # 
 ################################################################################
@@ -1536,8 +4448,9 @@ class MinimumUpdateList:
                 self.regions[signature] = region
                 self.sets += 1
 
-            # Track all findings for a signature
-            self.findings[signature].append(finding)
+            # Track all findings for a signature; only their keys are needed
+            # later, so keep those rather than the whole finding
+            self.findings[signature].append(finding.keys)
             _LOGGER.debug("496530d added finding to '%s'" % signature)
     #---------------------------------------------------------------------------
     @staticmethod
@@ -1551,38 +4464,32 @@ class MinimumUpdateList:
         """
         Generator to yield each update as a set of parameters to the 
         securityhub:batch_update_findings API.
+
+        Every yielded update is a new dict with its own copy of the changes 
+        and its own list of (at most 100) FindingIdentifiers, so batches may
+        be held on to or submitted concurrently.
         """
         signatures = 0
 
         # Go through each update signature and findings
         for signature, findings in self.findings.items():
             region = self.regions[signature]
-            update = self.update.get(signature).update
-
-            update["FindingIdentifiers"] = []
+            changes = self.update.get(signature).update
 
-            _LOGGER.debug(f'496540d signature {signature} update {update}')
+            _LOGGER.debug(f'496540d signature {signature} update {changes}')
 
             signatures += 1
 
             _LOGGER.info(f'496550i processing update set {signatures}...')
 
-            # Now loop through findings to build an update set
-            for finding in findings:
-                update["FindingIdentifiers"].append(finding.keys)
-                _LOGGER.debug(f'496560d adding {len(finding.keys)} to update now {self.updateCount(update)}')
-
-                # The upate set can be contain no more than 100 finding IDs --
-                # yield the updaet set and then clear it out
-                if self.updateCount(update) >= 100:
-                    _LOGGER.debug(f'496570d batch has >=100 finding IDs, yielding to {region}')
-                    yield region, update
- 
-                    update["FindingIdentifiers"] = []
-
-            # We end up here whenever the number of findings is < 100
-            if self.updateCount(update) > 0:
+            # The update set can contain no more than 100 finding IDs
+            for first in range(0, len(findings), 100):
+                update = copy.deepcopy(changes)
+                update["FindingIdentifiers"] = [ dict(keys) 
+                    for keys in findings[first:first + 100] ]
+
                 _LOGGER.debug(f'496580d yielding {self.updateCount(update)} finding IDs to {region}')
+
                 yield region, update
     #----------------------------------------------------------------------------
     @staticmethod
@@ -1610,3 +4517,200 @@ class MinimumUpdateList:
             _LOGGER.critical("496610s bad things in MinimumUpdateList.apply")
 
         return response
+################################################################################
+# 
+################################################################################
+class UpdateDispatcher:
+    """
+    Apply the update sets yielded by MinimumUpdateList.parameterSets through
+    a bounded pool of worker threads. At most workers batches are in flight 
+    overall, and at most regionWorkers against any one region, so a large 
+    update doesn't trip a region's BatchUpdateFindings throttling.
+
+    Responses are merged by the calling thread in the order the batches were
+    submitted. A batch whose call fails outright is reported as unprocessed
+    in its entirety, with the error code BatchFailed.
+
+    Findings left unprocessed with a _RETRYABLE error code are retried in up
+    to rounds further rounds: they are grouped by region and changes, packed
+    into full batches again, and resubmitted after an exponential backoff 
+    with full jitter (a random wait of up to backoff * 2^n seconds). Only 
+    the findings that fail with another error code, or still fail after the
+    last round, are reported as unprocessed.
+    """
+    _WORKERS = 4                # Batches in flight overall
+    _REGION_WORKERS = 2         # Batches in flight against a single region
+    _FAILED = "BatchFailed"     # Error code for findings in a failed batch
+    _RETRYABLE = ("ConcurrentUpdateError", "InternalFailure", 
+        "InternalException", "LimitExceeded", "LimitExceededException",
+        "TooManyRequestsException", "ThrottlingException")
+                                # Error codes of findings worth resubmitting
+    _ROUNDS = 3                 # Rounds of resubmission
+    _BACKOFF = 1.0              # Seconds of the first backoff, at most
+    _BATCH = 100                # Most findings per batch
+    #---------------------------------------------------------------------------
+    def __init__ (self, actor=None, workers=_WORKERS, 
+        regionWorkers=_REGION_WORKERS, rounds=_ROUNDS, backoff=_BACKOFF):
+        """
+        See class definition for details.
+        """
+        if not isinstance(actor, HubActor):
+            raise MalformedUpdate("496780t UpdateDispatcher requires a " + \
+                "HubActor object")
+
+        self.actor = actor
+        self.workers = max(1, workers)
+        self.regionWorkers = max(1, min(regionWorkers, self.workers))
+        self.limits = {}
+        self.lock = threading.Lock()
+        self.processed = []
+        self.unprocessed = []
+        self.batches = 0
+        self.rounds = max(0, rounds)
+        self.backoff = backoff
+        self.retry = {}
+        self.retried = 0
+    #---------------------------------------------------------------------------
+    def limit (self, region=None):
+        """
+        Return the semaphore bounding concurrent calls to a region.
+        """
+        with self.lock:
+            if region not in self.limits:
+                self.limits[region] = threading.BoundedSemaphore(
+                    self.regionWorkers)
+
+            return self.limits[region]
+    #---------------------------------------------------------------------------
+    def send (self, region=None, update=None):
+        """
+        Apply one batch, waiting for a free slot in its region first. Runs in
+        a worker thread.
+        """
+        with self.limit(region):
+            return MinimumUpdateList.apply(
+                update=update,
+                region=region,
+                actor=self.actor
+            )
+    #---------------------------------------------------------------------------
+    def merge (self, update=None, response=None, region=None):
+        """
+        Fold one batch's response into the processed and unprocessed lists,
+        keeping the findings worth retrying (with the batch's region and 
+        changes) in retry instead.
+        """
+        self.batches += 1
+
+        if response is None:
+            _LOGGER.error(f'496790e batch of {MinimumUpdateList.updateCount(update)} ' +
+                'findings failed')
+
+            response = {
+                "ProcessedFindings": [],
+                "UnprocessedFindings": [ {
+                    "FindingIdentifier": identifier,
+                    "ErrorCode": UpdateDispatcher._FAILED,
+                    "ErrorMessage": "securityhub:batch_update_findings failed"
+                } for identifier in update.get("FindingIdentifiers", []) ]
+            }
+
+        self.processed += response.get("ProcessedFindings", [])
+
+        for failure in response.get("UnprocessedFindings", []):
+            if failure.get("ErrorCode") in UpdateDispatcher._RETRYABLE:
+                changes = { name: value for name, value in update.items()
+                    if name != "FindingIdentifiers" }
+                signature = f'{region}|' + json.dumps(changes, sort_keys=True,
+                    default=str)
+
+                self.retry.setdefault(signature, (region, changes, [])) \
+                    [2].append(failure)
+            else:
+                self.unprocessed.append(failure)
+
+        METRICS.count("batches")
+    #---------------------------------------------------------------------------
+    def repack (self):
+        """
+        Generator yields the findings kept for retry as (region, update) 
+        pairs, packing the findings with the same region and changes into 
+        batches of up to _BATCH findings, and forgets them.
+        """
+        retry, self.retry = self.retry, {}
+
+        for region, changes, failures in retry.values():
+            for first in range(0, len(failures), UpdateDispatcher._BATCH):
+                update = copy.deepcopy(changes)
+                update["FindingIdentifiers"] = [ failure["FindingIdentifier"]
+                    for failure in failures[first:first + UpdateDispatcher._BATCH] ]
+
+                yield region, update
+    #---------------------------------------------------------------------------
+    def run (self, pool=None, batches=[]):
+        """
+        Apply every (region, update) pair from batches through the pool, 
+        merging the responses; at most workers * 2 batches are held at a time.
+        """
+        pending = collections.deque()
+
+        for region, update in batches:
+            pending.append((region, update, 
+                pool.submit(self.send, region, update)))
+
+            # Keep a bounded look-ahead; merge the oldest batch when full
+            if len(pending) >= self.workers * 2:
+                region, update, future = pending.popleft()
+                self.merge(update, future.result(), region=region)
+
+        while pending:
+            region, update, future = pending.popleft()
+            self.merge(update, future.result(), region=region)
+    #---------------------------------------------------------------------------
+    def dispatch (self, batches=[]):
+        """
+        Apply every (region, update) pair from batches, which may be a 
+        generator, then retry the findings left unprocessed with retryable
+        error codes. Returns the merged securityhub:batch_update_findings 
+        response, with the number of findings resubmitted as 
+        RetriedFindings.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.workers, 
+            thread_name_prefix="updates")
+
+        _LOGGER.info(f'496800i applying updates with {self.workers} workers, ' +
+            f'{self.regionWorkers} per region')
+
+        try:
+            self.run(pool=pool, batches=batches)
+
+            for attempt in range(self.rounds):
+                if not self.retry:
+                    break
+
+                count = sum(len(failures) for region, changes, failures 
+                    in self.retry.values())
+                self.retried += count
+
+                METRICS.count("retriedFindings", count)
+
+                _LOGGER.warning(f'497020w resubmitting {count} unprocessed ' +
+                    f'findings, round {attempt + 1} of {self.rounds}')
+
+                time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+                self.run(pool=pool, batches=self.repack())
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        # Whatever is still failing after the last round has failed for good
+        for region, changes, failures in self.retry.values():
+            self.unprocessed += failures
+
+        self.retry = {}
+
+        return {
+            "ProcessedFindings": self.processed,
+            "UnprocessedFindings": self.unprocessed,
+            "RetriedFindings": self.retried
+        }
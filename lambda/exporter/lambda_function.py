@@ -11,17 +11,41 @@ python3 csvExporter.py
        --regions=[commaSeaparatedRegionList]
        --bucket=[s3BucketName]
        --filters=[cannedFilterName|jsonObject]
+       --no-stream
+       --workers=[concurrentRegionDownloads]
+       --prefetch=[pagesDownloadedAheadPerRegion]
+       --shards=[timeWindowShardsPerRegion]
+       --direct
+       --compression=[gzip|zstd]
+       --format=[csv|parquet]
+       --no-aggregation
+       --incremental
+       --regions=[commaSeparatedRegionList]
+       --partitioned
+
+As a Lambda function it can also export in parts, as run by the export state
+machine: the event's mode is "plan" (choose the region and account shards), 
+"part" (export one shard) or "merge" (assemble the parts into one export).
+
+Each Lambda response includes the invocation's performance metrics, which are
+also logged in CloudWatch embedded metric format (see MetricsCollector).
 """
 
 import json
 import argparse
 import csv
+import io
 import sys
 import os
 import csvObjects as csvo
 import logging
 import traceback
-import re
+
+# Prefix of incremental export objects
+_DELTA_PREFIX = "SecurityHub-delta"
+
+# Milliseconds before the Lambda deadline at which an export is checkpointed
+_CHECKPOINT_MARGIN = 120000
 
 # Default regions in list and string form
 _DEFAULT_REGION_STRING = ""
@@ -41,24 +65,6 @@ _LOGGER = logging.getLogger()
 _LOGGER.setLevel(_DEFAULT_LOGGING_LEVEL)
 """ Initialized logging RootLogger instance """
 
-################################################################################
-#### 
-################################################################################
-def choose (default=None, *choices):
-    """
-    Choose between an option and an environment variable (the option always
-    has priority, if specified)
-    """
-    answer = default
-
-    for choice in choices:
-        _LOGGER.debug(f'csvExport.493010i choice {choice}')
-
-        if choice:
-            answer = choice
-            break
-
-    return answer
 ################################################################################
 #### 
 ################################################################################
@@ -70,6 +76,8 @@ def getFilters ( candidate = None ):
     """
     if not candidate:
         filters = {}
+    elif isinstance(candidate, dict):
+        filters = candidate
     elif candidate != "HighActive":
         try:
             filters = json.loads(candidate)
@@ -94,25 +102,265 @@ def getFilters ( candidate = None ):
     return filters
 
 ################################################################################
+#### 
+################################################################################
+def getRegions ( candidate = None ):
+    """
+    Process a region list, which is specified as a list or as a comma-separated
+    string. Returns None if no regions are specified.
+    """
+    if isinstance(candidate, str):
+        candidate = candidate.split(",")
+
+    regions = [ region.strip() for region in (candidate or []) if region.strip() ]
+
+    return regions if regions else None
+################################################################################
+#### 
+################################################################################
+def deltaFilters (hubActor=None, regions=[], watermark=None):
+    """
+    Give each region to be queried an UpdatedAt range filter starting at the
+    watermark of the regions whose findings it returns (an aggregation region
+    returns those of every region in its Region filter). Returns a dict of 
+    each queried region to the list of regions it covers.
+    """
+    coverage = {}
+
+    for queried in regions:
+        regionFilters = hubActor.regionFilters.setdefault(queried, {})
+        covered = [ value["Value"] for value in regionFilters.get("Region", []) ]
+
+        coverage[queried] = covered if covered else [ queried ]
+        regionFilters.update(watermark.filters(coverage[queried]))
+
+        _LOGGER.info(f'493240i {queried} delta window ' +
+            f'{regionFilters[csvo.ExportWatermark._FIELD][0]}')
+
+    return coverage
+################################################################################
+#### 
+################################################################################
+def writeFindings (pages=None, target=None, actor=None, schema=csvo.FINDING_SCHEMA,
+    header=True, stop=None):
+    """
+    Convert each successive page of findings to CSV rows and write them to the
+    target as soon as the page arrives, so that only about one page of findings
+    is held in memory at any time. Pages are (region, findings) tuples as
+    yielded by HubActor.streamFindings, and rows are produced by the compiled
+    schema. Returns the number of rows written.
+
+    The column header is omitted if header is not set (e.g. when continuing an
+    export). If stop is supplied, it is called after each page, and writing 
+    ends early if it returns True.
+    """
+    writer = None
+    count = 0
+
+    for region, findings in pages:
+        if not findings:
+            continue
+
+        # Start the CSV file with a header
+        if not writer:
+            _LOGGER.debug("493080d columns %s" % (schema.columns,))
+
+            writer = csv.writer(target)
+
+            if header:
+                writer.writerow(schema.columns)
+
+        with csvo.METRICS.phase("transform"):
+            rows = list(schema.rows(findings, actor=actor))
+
+        with csvo.METRICS.phase("write"):
+            writer.writerows(rows)
+
+        count += len(findings)
+
+        if stop and stop():
+            break
+
+    return count
+################################################################################
+#### 
+################################################################################
+def writeParquet (pages=None, sink=None, actor=None, compression=None,
+    schema=csvo.FINDING_SCHEMA):
+    """
+    Convert each successive page of findings to rows of a Parquet file written
+    to a binary sink. Rows are buffered only until a row group is full, so
+    memory use is bounded as it is for CSV. Returns the number of rows written.
+    """
+    writer = None
+    count = 0
+
+    for region, findings in pages:
+        with csvo.METRICS.phase("transform"):
+            rows = list(schema.rows(findings, actor=actor))
+
+        with csvo.METRICS.phase("write"):
+            for row in rows:
+                if not writer:
+                    writer = csvo.ParquetFindingWriter(sink, 
+                        columns=schema.columns, 
+                        compression=compression if compression else "snappy")
+
+                writer.write(row)
+
+                count += 1
+
+    if writer:
+        with csvo.METRICS.phase("write"):
+            writer.close()
+
+    return count
+################################################################################
+#### 
+################################################################################
+def exportFindings (pages=None, sink=None, actor=None, s3Actor=None, 
+    header=True, stop=None):
+    """
+    Write pages of findings as UTF-8 CSV to a binary sink (a local file or an
+    S3StreamWriter), compressing on the fly if the S3Actor is configured to,
+    or as Parquet if that is the S3Actor's format. The sink is left open. 
+    Returns the number of rows written. Header and stop apply to CSV only (see
+    writeFindings); compressed data is always finished as a complete gzip 
+    member or zstd frame, so CSV written by successive calls can be 
+    concatenated.
+    """
+    if s3Actor.format == "parquet":
+        return writeParquet(pages=pages, sink=sink, actor=actor,
+            compression=s3Actor.compression)
+
+    stream = s3Actor.compressor(sink)
+    target = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    count = writeFindings(pages=pages, target=target, actor=actor, 
+        header=header, stop=stop)
+
+    target.flush()
+    target.detach()
+
+    # Finish the compressed data
+    if stream is not sink:
+        stream.close()
+
+    return count
+################################################################################
+#### 
+################################################################################
+def writePartitioned (pages=None, export=None, actor=None, 
+    schema=csvo.FINDING_SCHEMA):
+    """
+    Convert each successive page of findings to CSV rows and write each row to
+    the partition of the PartitionedExport its finding belongs in. The writers
+    are flushed whenever the pages move on to another region. Returns the
+    number of rows written.
+    """
+    count = 0
+    previous = None
+
+    for region, findings in pages:
+        if region != previous:
+            with csvo.METRICS.phase("write"):
+                export.flush()
+
+            previous = region
+
+        partitions = {}
+
+        for finding in findings:
+            partitions.setdefault(export.partition(finding, region=region), 
+                []).append(finding)
+
+        for partition, members in partitions.items():
+            with csvo.METRICS.phase("transform"):
+                rows = list(schema.rows(members, actor=actor))
+
+            with csvo.METRICS.phase("write"):
+                export.writerows(partition=partition, rows=rows)
+
+        count += len(findings)
+
+    return count
+################################################################################
+#### 
+################################################################################
+def exportHeader (s3Actor=None, schema=csvo.FINDING_SCHEMA):
+    """
+    Return the CSV column header as it begins an export, compressed if the 
+    S3Actor is configured to compress.
+    """
+    sink = io.BytesIO()
+    stream = s3Actor.compressor(sink)
+    target = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+
+    csv.writer(target).writerow(schema.columns)
+
+    target.flush()
+    target.detach()
+
+    if stream is not sink:
+        stream.close()
+
+    return sink.getvalue()
+################################################################################
 #### Invocation-independent process handler
 ################################################################################
 def executor (role=None, region=None, filters=None, bucket=None, limit=0, 
-    retain=False):
+    retain=False, stream=True, workers=1, shards=1, shardField="UpdatedAt",
+    direct=False, compression=None, format="csv", aggregation=True,
+    incremental=False, context=None, resume=None, regions=None, 
+    partitioned=False, prefetch=csvo.HubActor._PREFETCH):
     """
     Carry out the actions necessary to download and export SecurityHub findings,
     whether invoked as a Lambda or from the command line.
+
+    If stream is set, each page of findings is written as soon as it has been
+    retrieved; otherwise all findings are downloaded before any are written.
+    With more than one worker, regions are downloaded concurrently; rows are
+    still written in region order, and each region downloads no more than 
+    prefetch pages ahead. With more than one shard, each region's
+    query is split into concurrent time windows on shardField.
+
+    If direct is set, the CSV is uploaded to S3 in parts while it is being
+    written, instead of being written to a local file and uploaded afterwards.
+    If compression is "gzip" or "zstd" the CSV is compressed as it is written.
+    The format may be "csv" or "parquet".
+
+    If aggregation is set and Security Hub cross-region aggregation is 
+    configured, only the aggregation region and unlinked regions are queried.
+
+    If incremental is set, only findings updated since each region's last 
+    incremental export are exported (see ExportWatermark), and a JSON manifest
+    describing the delta is stored next to the export. The delta windows are
+    UpdatedAt filters, so an incremental export can't also be given one.
+
+    Given a Lambda context, a direct, streamed, serial CSV export stops before
+    the invocation's deadline: the upload is suspended, an ExportCheckpoint is
+    saved, and its key is returned as the continuation. Calling the executor 
+    again with the same arguments and resume set to the continuation carries
+    on where the export stopped.
+
+    If regions are given, only those regions are queried.
+
+    If partitioned is set, the CSV is written straight to S3 as one object per
+    date, region and severity (see PartitionedExport) instead of one export.
     """
     # Get the SSM parameters and a client for further SSM operations
     ssmActor = csvo.SsmActor(role=role, region=region)
 
-    # Get a list of Security Hub regions we wish to act on
-    regions = choose(
-        os.environ.get("CSV_SECURITYHUB_REGIONLIST"),
-        re.compile("\s*,\s*").split(getattr(ssmActor, "/csvManager/regionList", region)),
-        ssmActor.getSupportedRegions(service="securityhub")
-    )
+    # Get a list of Security Hub regions we wish to act on: those requested,
+    # those configured, or else the regions where Security Hub is enabled
+    discovery = csvo.RegionDiscovery(ssmActor=ssmActor, role=role)
+    if not (resume or regions):
+        regions = discovery.regions(
+            candidates=ssmActor.getSupportedRegions(service="securityhub")
+        )
     
-    _LOGGER.info("493040i selected SecurityHub regions %s" % regions)
+    if not resume:
+        _LOGGER.info("493040i selected SecurityHub regions %s" % regions)
 
     # Get information about the bucket
     folder = getattr(ssmActor, "/csvManager/folder/findings", None)
@@ -120,68 +368,211 @@ def executor (role=None, region=None, filters=None, bucket=None, limit=0,
 
     _LOGGER.debug(f'493050d writing to s3://{bucket}/{folder}/*') 
 
-    # A client to act on the bucket
+    # A client to act on the bucket; deltas are named apart from full exports
     s3Actor = csvo.S3Actor(
         bucket=bucket, 
         folder=folder, 
+        prefix=_DELTA_PREFIX if incremental else csvo.S3Actor._PREFIX,
         region=region, 
-        role=role
+        role=role,
+        compression=compression,
+        format=format
     )
 
+    if partitioned and (format != "csv"):
+        raise csvo.ActorException("493330t partitioned exports must be CSV")
+
+    # The watermarks only move to the end of the windows actually queried
+    if incremental and (filters or {}).get(csvo.ExportWatermark._FIELD):
+        raise csvo.ActorException("493350t incremental exports take no " +
+            f'{csvo.ExportWatermark._FIELD} filter')
+
+    # Only direct, streamed, serial CSV exports can stop and resume
+    resumable = bool(context) and direct and stream and (format == "csv") \
+        and (workers <= 1) and (shards <= 1) and not partitioned
+
+    if context and not resumable:
+        _LOGGER.info("493250i export is not resumable; that needs a direct, " +
+            "streamed CSV export with one worker and one shard")
+
+    #---------------------------------------------------------------------------
+    def deadline ():
+        """
+        Has the time come to checkpoint?
+        """
+        return resumable and \
+            (context.get_remaining_time_in_millis() < _CHECKPOINT_MARGIN)
+
+    # Pick up the state of a stopped export
+    state = {}
+    tail = b""
+
+    if resume:
+        checkpoint = csvo.ExportCheckpoint(s3Actor=s3Actor, key=resume)
+        state, tail = checkpoint.load()
+        s3Actor.filename = state["filename"]
+        regions = state["regions"]
+
+        _LOGGER.info(f'493260i resuming {s3Actor.objectKey} after ' +
+            f'{state["count"]} findings, regions {regions}')
+
     # Filename where file can be stored locally
     localFile = s3Actor.filePath()
 
     # Now obtain a client for SecurityHub regions
+    # Shards of a region share that region's client, so size its pool to suit
     hubActor = csvo.HubActor(
         role=role,
-        region=regions
+        region=regions,
+        connections=shards,
+        breaker=discovery.breaker
     )
 
-    # Obtain the findings for all applicable regions
-    hubActor.downloadFindings(filters=filters,limit=limit)
+    # Carry on paging where the stopped export left off
+    if state:
+        hubActor.regionFilters = state["regionFilters"]
+        hubActor.tokens = state["tokens"]
+        hubActor.completed = set(state["completed"])
 
-    if hubActor.count <= 0:
-        _LOGGER.war("493060w no findings downloaded")
-    else:
-        _LOGGER.info(f'493070i preparing to write {hubActor.count} findings')
+    # Avoid downloading the same findings from linked regions
+    elif aggregation:
+        regions = hubActor.aggregatedRegions(regions=regions)
+
+    # Only ask each region for the findings changed since its last export
+    if incremental:
+        if state:
+            watermark = csvo.ExportWatermark(ssmActor=ssmActor,
+                now=csvo.FindingActions.parseTimestamp(state["end"]))
+            coverage = state["coverage"]
+        else:
+            watermark = csvo.ExportWatermark(ssmActor=ssmActor)
+            coverage = deltaFilters(hubActor=hubActor, regions=regions, 
+                watermark=watermark)
 
-        first = True
+    # Build the regional clients in the background while paging starts
+    hubActor.warmClients(regions=[ candidate for candidate in regions 
+        if discovery.breaker.allow(candidate) ])
 
-        with open(localFile, 'w') as target:
-            for finding in hubActor.getFinding():
-                findingObject = csvo.Finding(finding, actor=hubActor)
+    try:
+        # Obtain the findings for all applicable regions, either page by page or
+        # all at once
+        if stream:
+            _LOGGER.info("493180i streaming findings page by page")
+
+            pages = hubActor.streamFindings(regions=regions, filters=filters, 
+                limit=limit, workers=workers, prefetch=prefetch, shards=shards,
+                shardField=shardField)
+        else:
+            pages = [ (None, hubActor.downloadFindings(regions=regions, 
+                filters=filters, limit=limit, workers=workers, shards=shards, 
+                shardField=shardField)) ]
 
-                # Start the CSV file with a header
-                if first:
-                    _LOGGER.debug("493080d finding object %s keys %s" \
-                        % (findingObject, findingObject.columns))
+        if partitioned:
+            with csvo.PartitionedExport(s3Actor=s3Actor, 
+                columns=csvo.FINDING_SCHEMA.columns) as export:
+                count = writePartitioned(pages=pages, export=export, 
+                    actor=hubActor)
 
-                    writer = csv.DictWriter(target, 
-                        fieldnames=findingObject.columns)
+        elif direct:
+            if retain:
+                _LOGGER.warning("493190w no local file to retain in direct mode")
 
-                    writer.writeheader()
+            # Upload parts as they fill; the upload is aborted if anything fails
+            with s3Actor.writer(state=state.get("upload")) as sink:
+                sink.write(tail)
 
-                # Write the finding
-                writer.writerow(findingObject.rowMap)
+                count = state.get("count", 0) + exportFindings(pages=pages, 
+                    sink=sink, actor=hubActor, s3Actor=s3Actor, 
+                    header=not state.get("count"), stop=deadline)
 
-                first = False
+                # Out of time with regions still to go: save the progress
+                if deadline() and hubActor.remainingRegions(regions) and \
+                    not (limit and (hubActor.count > limit)):
+                    upload, tail = sink.suspend()
 
-        # Announce completion of write
-        _LOGGER.info("493090i findings written to %s" % localFile)
+                    continuation = csvo.ExportCheckpoint(s3Actor=s3Actor).save(
+                        state={
+                            "filename": s3Actor.filename,
+                            "upload": upload,
+                            "count": count,
+                            "regions": hubActor.remainingRegions(regions),
+                            "tokens": { name: token for name, token 
+                                in hubActor.tokens.items() if token },
+                            "regionFilters": hubActor.regionFilters,
+                            "completed": sorted(hubActor.completed),
+                            "coverage": coverage if incremental else None,
+                            "end": csvo.FindingActions.formatTimestamp(
+                                watermark.end) if incremental else None
+                        },
+                        tail=tail
+                    )
 
-        # Place the object in the S3 bucket
-        s3Actor.put()
+                    _LOGGER.warning(f'493270w stopped after {count} findings ' +
+                        'to beat the deadline')
 
-        _LOGGER.info('493100i uploaded to ' + 
-            f's3://{s3Actor.bucket}/{s3Actor.objectKey}')
+                    return {
+                        "success" : True ,
+                        "message" : "Export checkpointed" ,
+                        "bucket" : s3Actor.bucket ,
+                        "exportKey" : None ,
+                        "continuation" : continuation
+                    }
 
-        # Determine whether to retain the local file or not
-        if retain:
-            _LOGGER.warning("493110w local file %s retained" % localFile)
+                if count <= 0:
+                    sink.abort()
         else:
+            with open(localFile, 'wb') as sink:
+                count = exportFindings(pages=pages, sink=sink, actor=hubActor, 
+                    s3Actor=s3Actor)
+
+    # Remember the regions that failed (or recovered) for the next run
+    finally:
+        discovery.save()
+
+    if count <= 0:
+        _LOGGER.warning("493060w no findings downloaded")
+
+        if not (direct or partitioned):
             os.unlink(localFile)
 
-            _LOGGER.info("493120i local file deleted")
+        answer = {
+            "success" : True ,
+            "message" : "No findings to export" ,
+            "bucket" : None ,
+            "exportKey" : None
+        }
+    elif partitioned:
+        _LOGGER.info(f'493340i {count} findings streamed to ' +
+            f'{len(export.keys)} partitions of s3://{s3Actor.bucket}/{s3Actor.folder}')
+
+        answer = {
+            "success" : True ,
+            "message" : "Export succeeded" ,
+            "bucket" : s3Actor.bucket ,
+            "exportKey" : None ,
+            "exportKeys" : export.keys
+        }
+    else:
+        if direct:
+            _LOGGER.info('493200i %d findings streamed to ' % count +
+                f's3://{s3Actor.bucket}/{s3Actor.objectKey}')
+        else:
+            # Announce completion of write
+            _LOGGER.info("493090i %d findings written to %s" % (count, localFile))
+
+            # Place the object in the S3 bucket
+            s3Actor.put()
+
+            _LOGGER.info('493100i uploaded to ' + 
+                f's3://{s3Actor.bucket}/{s3Actor.objectKey}')
+
+            # Determine whether to retain the local file or not
+            if retain:
+                _LOGGER.warning("493110w local file %s retained" % localFile)
+            else:
+                os.unlink(localFile)
+
+                _LOGGER.info("493120i local file deleted")
 
         # Return details to caller
         answer = {
@@ -191,8 +582,242 @@ def executor (role=None, region=None, filters=None, bucket=None, limit=0,
             "exportKey" : s3Actor.objectKey
         }
 
+    # The checkpoint of a resumed export is no longer needed
+    if resume:
+        checkpoint.delete()
+
+    # Describe the delta, then move the watermarks past it
+    if incremental:
+        complete = (limit == 0) or (hubActor.count <= limit)
+        previous = watermark.document
+
+        if complete:
+            watermark.advance([ covered for queried in coverage 
+                if queried in hubActor.completed 
+                for covered in coverage[queried] ])
+        else:
+            _LOGGER.warning("493220w export was limited, watermarks not moved")
+
+        if count > 0:
+            s3Actor.putManifest({
+                "mode": "incremental",
+                "bucket": s3Actor.bucket,
+                "exportKey": answer["exportKey"],
+                "exportKeys": answer.get("exportKeys"),
+                "format": s3Actor.format,
+                "compression": s3Actor.compression,
+                "count": count,
+                "field": csvo.ExportWatermark._FIELD,
+                "regions": { queried: {
+                    "covers": coverage[queried],
+                    "window": hubActor.regionFilters[queried] \
+                        [csvo.ExportWatermark._FIELD][0],
+                    "complete": complete and (queried in hubActor.completed)
+                } for queried in coverage },
+                "previousWatermark": previous,
+                "watermark": watermark.document
+            })
+
+            answer["manifestKey"] = s3Actor.manifestKey
+
+        watermark.save()
+
+        _LOGGER.info(f'493230i watermarks now {watermark.document}')
+
     return answer
 ################################################################################
+#### Exports in parts, as run by the export state machine
+################################################################################
+def planExport (role=None, region=None, bucket=None, compression=None,
+    aggregation=True, regions=None, accounts=None):
+    """
+    Choose the shards of an export in parts: one for each region to be queried
+    or, if accounts (a list of lists of account IDs) is given, one for each
+    region and list of accounts. Each shard names the region, the filters that
+    region needs (e.g. the Region filter of an aggregation region), its 
+    accounts, and the key of the part object it is to write. Returns the name
+    of the export and the list of shards.
+    """
+    ssmActor = csvo.SsmActor(role=role, region=region)
+    discovery = csvo.RegionDiscovery(ssmActor=ssmActor, role=role)
+
+    if not regions:
+        regions = discovery.regions(
+            candidates=ssmActor.getSupportedRegions(service="securityhub")
+        )
+
+    hubActor = csvo.HubActor(
+        role=role,
+        region=regions,
+        breaker=discovery.breaker
+    )
+
+    # Avoid downloading the same findings from linked regions
+    if aggregation:
+        regions = hubActor.aggregatedRegions(regions=regions)
+
+    discovery.save()
+
+    s3Actor = csvo.S3Actor(
+        bucket=bucket if bucket else getattr(ssmActor, "/csvManager/bucket", None),
+        folder=getattr(ssmActor, "/csvManager/folder/findings", None),
+        region=region,
+        role=role,
+        compression=compression
+    )
+
+    shards = []
+
+    for queried in regions:
+        if not discovery.breaker.allow(queried):
+            continue
+
+        for group in (accounts if accounts else [ None ]):
+            shards.append({
+                "region": queried,
+                "regionFilters": hubActor.regionFilters.get(queried, {}),
+                "accounts": group,
+                "partKey": s3Actor.partKey(index=len(shards))
+            })
+
+    _LOGGER.info(f'493290i planned {s3Actor.objectKey} in {len(shards)} parts')
+
+    return {
+        "success" : True ,
+        "message" : "Export planned" ,
+        "bucket" : s3Actor.bucket ,
+        "run" : s3Actor.filename ,
+        "shards" : shards
+    }
+################################################################################
+#### 
+################################################################################
+def exportPart (role=None, region=None, filters=None, bucket=None, limit=0,
+    compression=None, shard={}):
+    """
+    Export the findings of one shard chosen by planExport, without a column
+    header, straight to its part object. Returns the part key (None if there
+    were no findings) and the number of findings.
+    """
+    ssmActor = csvo.SsmActor(role=role, region=region)
+
+    s3Actor = csvo.S3Actor(
+        bucket=bucket if bucket else getattr(ssmActor, "/csvManager/bucket", None),
+        folder=getattr(ssmActor, "/csvManager/folder/findings", None),
+        region=region,
+        role=role,
+        compression=compression
+    )
+
+    hubActor = csvo.HubActor(role=role, region=[ shard["region"] ])
+    hubActor.regionFilters = { shard["region"]: shard.get("regionFilters", {}) }
+
+    filters = dict(filters or {})
+
+    if shard.get("accounts"):
+        filters["AwsAccountId"] = [ { "Value": account, "Comparison": "EQUALS" }
+            for account in shard["accounts"] ]
+
+    pages = hubActor.streamFindings(regions=[ shard["region"] ], 
+        filters=filters, limit=limit)
+
+    with s3Actor.writer(outputObject=shard["partKey"]) as sink:
+        count = exportFindings(pages=pages, sink=sink, actor=hubActor, 
+            s3Actor=s3Actor, header=False)
+
+        if count <= 0:
+            sink.abort()
+
+    _LOGGER.info(f'493300i {count} findings from {shard["region"]} ' +
+        f'written to s3://{s3Actor.bucket}/{shard["partKey"]}')
+
+    return {
+        "success" : True ,
+        "message" : "Part exported" ,
+        "bucket" : s3Actor.bucket ,
+        "partKey" : shard["partKey"] if count > 0 else None ,
+        "count" : count
+    }
+################################################################################
+#### 
+################################################################################
+def mergeExport (role=None, region=None, bucket=None, compression=None,
+    run=None, parts=[]):
+    """
+    Assemble the part objects written by exportPart into the export named run,
+    beginning with a column header. Parts are the results of exportPart, in 
+    shard order; if any shard failed nothing is assembled, and the parts are 
+    left for inspection.
+    """
+    ssmActor = csvo.SsmActor(role=role, region=region)
+
+    s3Actor = csvo.S3Actor(
+        bucket=bucket if bucket else getattr(ssmActor, "/csvManager/bucket", None),
+        folder=getattr(ssmActor, "/csvManager/folder/findings", None),
+        region=region,
+        role=role,
+        compression=compression
+    )
+    s3Actor.filename = run
+
+    failed = [ part for part in parts if part.get("resultCode", 200) != 200 ]
+    keys = [ part["partKey"] for part in parts if part.get("partKey") ]
+    count = sum([ part.get("count", 0) for part in parts ])
+
+    if failed:
+        _LOGGER.error(f'493310e {len(failed)} of {len(parts)} parts failed, ' +
+            f'{s3Actor.objectKey} not assembled')
+
+        answer = {
+            "success" : False ,
+            "message" : "Export incomplete" ,
+            "bucket" : s3Actor.bucket ,
+            "exportKey" : None
+        }
+    elif not keys:
+        _LOGGER.warning("493060w no findings downloaded")
+
+        answer = {
+            "success" : True ,
+            "message" : "No findings to export" ,
+            "bucket" : None ,
+            "exportKey" : None
+        }
+    else:
+        # The header is a compressed member (or frame) of its own
+        s3Actor.concatenate(keys=keys, header=exportHeader(s3Actor))
+
+        _LOGGER.info(f'493320i {count} findings assembled in ' +
+            f's3://{s3Actor.bucket}/{s3Actor.objectKey}')
+
+        answer = {
+            "success" : True ,
+            "message" : "Export succeeded" ,
+            "bucket" : s3Actor.bucket ,
+            "exportKey" : s3Actor.objectKey ,
+            "count" : count
+        }
+
+    return answer
+################################################################################
+#### 
+################################################################################
+def continueExport (event=None, context=None, continuation=None):
+    """
+    Invoke this Lambda function again (asynchronously) with the same event, 
+    and a continuation token from which to resume the export.
+    """
+    arn = context.invoked_function_arn
+    client = csvo.CLIENTS.get(service="lambda", region=arn.split(":")[3])
+
+    client.invoke(
+        FunctionName=arn,
+        InvocationType="Event",
+        Payload=json.dumps(dict(event, resume=continuation)).encode("utf-8")
+    )
+
+    _LOGGER.info(f'493280i invoked {arn} to resume from {continuation}')
+################################################################################
 #### Lambda handler
 ################################################################################
 def lambdaHandler ( event = None, context = None ):
@@ -200,13 +825,33 @@ def lambdaHandler ( event = None, context = None ):
     Perform the operations necessary if CsvExporter is invoked as a Lambda
     function. 
     """
+    # Steps of an export in parts carry the options of the whole export
+    event = dict(event.get("options") or {}, **event)
+
+    # Measure this invocation alone (see MetricsCollector)
+    csvo.METRICS.reset()
+
     # The event keys we care about are processed below
+    mode = event.get("mode", "export")
     role = event.get("role")
     region = event.get("region")
     filters = getFilters(event.get("filters", {}))
     bucket = event.get("bucket")
     retain = event.get("retainLocal", False)
     limit = event.get("limit", 0)
+    stream = event.get("stream", True)
+    workers = int(event.get("workers", 1))
+    prefetch = int(event.get("prefetch", csvo.HubActor._PREFETCH))
+    shards = int(event.get("shards", 1))
+    shardField = event.get("shardField", "UpdatedAt")
+    direct = event.get("direct", False)
+    compression = event.get("compression")
+    format = event.get("format", "csv")
+    aggregation = event.get("aggregation", True)
+    incremental = event.get("incremental", False)
+    resume = event.get("resume")
+    regions = getRegions(event.get("regions"))
+    partitioned = event.get("partitioned", False)
     eventData = event.get("event")
 
     # If no region is specified it must be obtains from the environments
@@ -226,21 +871,80 @@ def lambdaHandler ( event = None, context = None ):
 
     # Perform the real work
     try:
-        result = executor(
-            role=role,
-            region=region,
-            filters=filters,
-            bucket=bucket,
-            retain=retain,
-            limit=limit
-        )
+        if mode == "plan":
+            result = planExport(role=role, region=region, bucket=bucket,
+                compression=compression, aggregation=aggregation,
+                regions=regions, accounts=event.get("accounts"))
 
-        answer = {
-            "message": result.get("message"),
-            "bucket": result.get("bucket"),
-            "exportKey": result.get("exportKey"),
-            "resultCode": 200 if result.get("success") else 400
-        }
+            # Each step of the export needs the same options
+            answer = {
+                "message": result.get("message"),
+                "bucket": result.get("bucket"),
+                "run": result.get("run"),
+                "shards": result.get("shards"),
+                "options": { "role": role, "region": region, 
+                    "filters": filters, "bucket": result.get("bucket"),
+                    "limit": limit, "compression": compression },
+                "resultCode": 200
+            }
+
+        elif mode == "part":
+            result = exportPart(role=role, region=region, filters=filters,
+                bucket=bucket, limit=limit, compression=compression,
+                shard=event.get("shard"))
+
+            answer = {
+                "message": result.get("message"),
+                "bucket": result.get("bucket"),
+                "partKey": result.get("partKey"),
+                "count": result.get("count"),
+                "resultCode": 200
+            }
+
+        else:
+            if mode == "merge":
+                result = mergeExport(role=role, region=region, bucket=bucket,
+                    compression=compression, run=event.get("run"),
+                    parts=event.get("parts", []))
+            else:
+                result = executor(
+                    role=role,
+                    region=region,
+                    filters=filters,
+                    bucket=bucket,
+                    retain=retain,
+                    limit=limit,
+                    stream=stream,
+                    workers=workers,
+                    prefetch=prefetch,
+                    shards=shards,
+                    shardField=shardField,
+                    direct=direct,
+                    compression=compression,
+                    format=format,
+                    aggregation=aggregation,
+                    incremental=incremental,
+                    context=context,
+                    resume=resume,
+                    regions=regions,
+                    partitioned=partitioned
+                )
+
+            answer = {
+                "message": result.get("message"),
+                "bucket": result.get("bucket"),
+                "exportKey": result.get("exportKey"),
+                "exportKeys": result.get("exportKeys"),
+                "manifestKey": result.get("manifestKey"),
+                "continuation": result.get("continuation"),
+                "resultCode": 200 if result.get("success") else 400
+            }
+
+            # Unless the caller will resume the export itself, carry on in a 
+            # new invocation of this function
+            if result.get("continuation") and event.get("reinvoke", True):
+                continueExport(event=event, context=context, 
+                    continuation=result["continuation"])
 
     # Catnch any errors
     except Exception as thrown:
@@ -250,14 +954,22 @@ def lambdaHandler ( event = None, context = None ):
         _LOGGER.error("493160e Lambda failed (%s): %s\n%s" \
             % (errorType, thrown, errorTrace))
         
+        # Carries the keys of every mode's answer, e.g. for a failed part
         answer = { 
-            "message" : thrown ,
+            "message" : str(thrown) ,
             "traceback" : traceback.format_tb(thrown.__traceback__, limit=5),
             "bucket" : None ,
             "exportKey" : None ,
+            "partKey" : None ,
+            "count" : 0 ,
             "resultCode" : 500
         }
 
+    # Report the performance of the invocation, also as EMF log lines
+    answer["metrics"] = csvo.METRICS.summary()
+    csvo.METRICS.emit(function="exporter", mode=mode, 
+        resultCode=answer["resultCode"])
+
     return answer
 
 ################################################################################
@@ -281,6 +993,32 @@ if __name__ == "__main__":
             dest="retainLocal", default=False, help="Retain local file")
         parser.add_argument("--primary-region", dest="region", required=True,
             help="Primary region for operations")
+        parser.add_argument("--no-stream", action="store_false", dest="stream",
+            default=True, help="Download all findings before writing any")
+        parser.add_argument("--workers", required=False, type=int, default=1,
+            help="Number of regions to download concurrently")
+        parser.add_argument("--prefetch", required=False, type=int, 
+            default=csvo.HubActor._PREFETCH,
+            help="Pages each region may download ahead when concurrent")
+        parser.add_argument("--shards", required=False, type=int, default=1,
+            help="Number of concurrent time windows per region")
+        parser.add_argument("--shard-field", dest="shardField", default="UpdatedAt",
+            choices=["UpdatedAt", "CreatedAt"], help="Date field to shard on")
+        parser.add_argument("--direct", action="store_true", default=False,
+            help="Upload to S3 while writing, without a local file")
+        parser.add_argument("--compression", required=False, default=None,
+            choices=["gzip", "zstd"], help="Compress the export")
+        parser.add_argument("--format", required=False, default="csv",
+            choices=["csv", "parquet"], help="Export file format")
+        parser.add_argument("--no-aggregation", action="store_false", 
+            dest="aggregation", default=True, 
+            help="Query every region even if findings are aggregated")
+        parser.add_argument("--incremental", action="store_true", default=False,
+            help="Export only findings updated since the last incremental export")
+        parser.add_argument("--regions", required=False, default=None,
+            help="Comma-separated list of regions to query")
+        parser.add_argument("--partitioned", action="store_true", default=False,
+            help="Write one object per date, region and severity partition")
 
         arguments = parser.parse_args()
 
@@ -290,7 +1028,19 @@ if __name__ == "__main__":
             bucket=arguments.bucket, 
             limit=arguments.limit, 
             retain=arguments.retainLocal,
-            region=arguments.region
+            region=arguments.region,
+            stream=arguments.stream,
+            workers=arguments.workers,
+            prefetch=arguments.prefetch,
+            shards=arguments.shards,
+            shardField=arguments.shardField,
+            direct=arguments.direct,
+            compression=arguments.compression,
+            format=arguments.format,
+            aggregation=arguments.aggregation,
+            incremental=arguments.incremental,
+            regions=getRegions(arguments.regions),
+            partitioned=arguments.partitioned
         )
 
     except Exception as thrown:
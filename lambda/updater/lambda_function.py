@@ -4,19 +4,21 @@ Update Security Hub findings en bloc/en masse from a CSV file
 
 This program can be invoked as an AWS Lambda function or from the command line.
 
+Each Lambda response includes the invocation's performance metrics, which are
+also logged in CloudWatch embedded metric format (see MetricsCollector).
+
 REVISION 20210225 Make work in GovCloud
 REVISION 20210930 Actually make work in GovCloud
 """
 
 import argparse
+import collections
 import csv
 import sys
-import os
 import re
 import logging
 import csvObjects as csvo
 import traceback
-import re
 
 # Retrieves the name of the current function (for logging purposes)
 this = lambda frame=0 : sys._getframe(frame+1).f_code.co_name
@@ -60,42 +62,33 @@ class InputDiscriminator:
             self.key = None
             self.path = input
 ################################################################################
-#### 
-################################################################################
-def choose (default=None, *choices):
-    """
-    Choose between an option and an environment variable (the option always
-    has priority, if specified)
-    """
-    answer = default
-
-    for choice in choices:
-        if choice:
-            answer = choice
-            break
-
-    return answer
-################################################################################
 #### Invocation-independent process handler
 ################################################################################
-def executor (role=None, region=None, debug=False, input=None):
+def executor (role=None, region=None, debug=False, input=None, 
+    workers=csvo.UpdateDispatcher._WORKERS, 
+    rounds=csvo.UpdateDispatcher._ROUNDS):
     """
     Called from either the command or Lambda invocations. Obtains the necessary
     API clients, gathers updates from the input CSV file, and then applies 
-    updates using the securityhub:batch_update_findings API.
+    updates using the securityhub:batch_update_findings API, with up to 
+    workers update sets in flight at once. Findings left unprocessed with a
+    retryable error code are resubmitted in up to rounds further rounds (see
+    UpdateDispatcher).
     """
     processed = []
     unprocessed = []
+    retried = 0
 
     # Get the SSM parameters and a client for further SSM operations
     ssmActor = csvo.SsmActor(role=role, region=region)
 
-    # Get a list of Security Hub regions we wish to act on
-    regions = choose(
-        os.environ.get("CSV_SECURITYHUB_REGIONLIST"),
-        re.compile("\s*,\s*").split(getattr(ssmActor, "/csvManager/regionList")),
-        ssmActor.getSupportedRegions(service="securityhub")
+    # Get a list of Security Hub regions we wish to act on: those configured,
+    # or else the regions where Security Hub is enabled
+    discovery = csvo.RegionDiscovery(ssmActor=ssmActor, role=role)
+    regions = discovery.regions(
+        candidates=ssmActor.getSupportedRegions(service="securityhub")
     )
+    discovery.save()
     
     _LOGGER.info("494010i selected SecurityHub regions %s" % regions)
 
@@ -110,52 +103,60 @@ def executor (role=None, region=None, debug=False, input=None):
             role=role
         )
 
-        # Use SecurityHub to update findings
+        # Use SecurityHub to update findings, with a client connection for
+        # every update set that may be in flight
         hubActor = csvo.HubActor(
             role=role,
-            region=regions
+            region=regions,
+            connections=workers
         )
 
-        # Determine whether the input is coming from local file or S3
+        # Build the regional clients in the background while the CSV is read
+        hubActor.warmClients()
+
+        # Determine whether the input is coming from local file or S3; either
+        # way the CSV is read as a stream rather than all at once
         if source.isLocal:
-            raw = s3Actor.get(file=source.path, split=True)
+            stream = s3Actor.open(file=source.path)
         else:
-            raw = s3Actor.get(bucket=source.bucket, key=source.key, split=True)
-
-        # Reader for CSV input
-        reader = csv.reader(raw, delimiter=',')
+            stream = s3Actor.open(bucket=source.bucket, key=source.key)
 
         # This object creates a minimum set of updates 
         updates = csvo.MinimumUpdateList()
         count = 0
 
         # Report start of export
-        _LOGGER.info("494020i processing %d records from CSV" % len(raw))
-        
-        for rowNumber, row in enumerate(reader):
-            # Skip the column header row
-            if row[0] == "Id":
-                continue
+        _LOGGER.info("494020i processing records from CSV")
+
+        with stream, csvo.METRICS.phase("parse"):
+            # Reader for CSV input
+            reader = csv.reader(stream, delimiter=',')
+
+            for rowNumber, row in enumerate(reader):
+                # Skip blank lines and the column header row
+                if (not row) or (row[0] == "Id"):
+                    continue
 
-            # Process each finding
-            try:
-                finding = csvo.Finding(row, actor=hubActor)
+                # Process each finding
+                try:
+                    finding = csvo.Finding(row, actor=hubActor)
 
-            # If there is a problem with the finding, just skip it--user
-            # can re-run later after corrections
-            except csvo.FindingValueError as thrown:
-                _LOGGER.error("494030e row %d error: %s" \
-                    % (rowNumber + 1, str(thrown)))
+                # If there is a problem with the finding, just skip it--user
+                # can re-run later after corrections
+                except csvo.FindingValueError as thrown:
+                    _LOGGER.error("494030e row %d error: %s" \
+                        % (rowNumber + 1, str(thrown)))
 
-                continue
+                    continue
 
-            count += 1
+                count += 1
 
-            updates.add(finding)
+                with csvo.METRICS.phase("grouping"):
+                    updates.add(finding)
 
-            # Report progress
-            if (count % 1000) == 0:
-                _LOGGER.info("494040i ... %8d findings processed" % count)
+                # Report progress
+                if (count % 1000) == 0:
+                    _LOGGER.info("494040i ... %8d findings processed" % count)
 
         # Report the results of the preprocessing
         _LOGGER.info("494050i processed %d findings and identified %d update sets" \
@@ -165,17 +166,19 @@ def executor (role=None, region=None, debug=False, input=None):
         if (updates.sets > 0):
             _LOGGER.info("494060i processing update sets")
 
-            for region, update in updates.parameterSets():
-                # Actually apply the update set -- this is a per-region operation
-                response = csvo.MinimumUpdateList.apply(
-                    update=update,
-                    region=region,
-                    actor=hubActor
-                )
+            # Apply the update sets concurrently, a bounded number at a time
+            dispatcher = csvo.UpdateDispatcher(
+                actor=hubActor,
+                workers=workers,
+                rounds=rounds
+            )
+            with csvo.METRICS.phase("apply"):
+                response = dispatcher.dispatch(updates.parameterSets())
 
-                # Keep track of successes and failures
-                processed += response.get("ProcessedFindings")
-                unprocessed += response.get("UnprocessedFindings")
+            # Keep track of successes and failures
+            processed += response.get("ProcessedFindings")
+            unprocessed += response.get("UnprocessedFindings")
+            retried = response.get("RetriedFindings", 0)
 
             # Report the results of the update
             _LOGGER.info(
@@ -183,10 +186,18 @@ def executor (role=None, region=None, debug=False, input=None):
                 % (len(processed), len(unprocessed))
             )
 
+            if retried > 0:
+                _LOGGER.info(f'494140i {retried} unprocessed findings were ' +
+                    'resubmitted')
+
             # If some findings were not processed, report those findings
             if len(unprocessed) > 0:
+                codes = collections.Counter(failed.get("ErrorCode") 
+                    for failed in unprocessed)
+
                 _LOGGER.error(
-                    "494080e the following findings were not processed"
+                    "494080e the following findings were not processed " +
+                    f'(error codes {dict(codes)})'
                 )
 
                 for failed in unprocessed:
@@ -201,7 +212,7 @@ def executor (role=None, region=None, debug=False, input=None):
     except Exception as thrown:
         message = "(s) Unexpected executor error %s" % str(thrown)
 
-        if arguments.debug:
+        if debug:
             _LOGGER.exception("494100t %s" % message)
         else:
             _LOGGER.critical("494110t %s" % message)
@@ -216,7 +227,8 @@ def executor (role=None, region=None, debug=False, input=None):
     else:
         answer = {
             "processed": processed,
-            "unprocessed": unprocessed
+            "unprocessed": unprocessed,
+            "retried": retried
         }
 
         if len(unprocessed) == 0:
@@ -239,19 +251,26 @@ def lambdaHandler ( event = None, context = None ):
     """
     Stub for Lambda handler.
     """
+    # Measure this invocation alone (see MetricsCollector)
+    csvo.METRICS.reset()
+
     try:
         # These data come from the event
         roleArn = event.get("roleArn")
         input = event.get("input")
         debug = event.get("debug")
         region = event.get("primaryRegion")
+        workers = int(event.get("workers", csvo.UpdateDispatcher._WORKERS))
+        rounds = int(event.get("retryRounds", csvo.UpdateDispatcher._ROUNDS))
 
         # Do the work
         answer = executor(
             role=roleArn,
             input=input,
             debug=debug,
-            region=region
+            region=region,
+            workers=workers,
+            rounds=rounds
         )
 
     # Handle trouble if it arises
@@ -277,6 +296,10 @@ def lambdaHandler ( event = None, context = None ):
             "resultCode": 200
         }
 
+    # Report the performance of the invocation, also as EMF log lines
+    response["metrics"] = csvo.METRICS.summary()
+    csvo.METRICS.emit(function="updater", resultCode=response["resultCode"])
+
     return response
 ################################################################################
 #
@@ -296,6 +319,12 @@ if __name__ == "__main__":
             help="Provide more debugging details")
         parser.add_argument("--primary-region", dest="region", required=True,
             help="Primary region for operations")
+        parser.add_argument("--workers", type=int, 
+            default=csvo.UpdateDispatcher._WORKERS,
+            help="Number of update sets to apply concurrently")
+        parser.add_argument("--retry-rounds", dest="rounds", type=int,
+            default=csvo.UpdateDispatcher._ROUNDS,
+            help="Rounds of resubmitting findings that were not processed")
 
         arguments = parser.parse_args()
 
@@ -304,7 +333,9 @@ if __name__ == "__main__":
             role=arguments.roleArn, 
             input=arguments.input,
             region=arguments.region , 
-            debug=arguments.debug 
+            debug=arguments.debug ,
+            workers=arguments.workers,
+            rounds=arguments.rounds
         )
 
     # Catch trouble
@@ -0,0 +1,267 @@
+import importlib.util
+import io
+import os
+import sys
+
+import pytest
+from botocore.exceptions import ClientError
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The Lambda sources are not a package ("lambda" is a keyword), so the shared
+# csvObjects module is imported from the exporter asset directory
+sys.path.insert(0, os.path.join(_ROOT, "lambda", "exporter"))
+
+import csvObjects as csvo
+
+
+def _load(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+exporter = _load("exporter_lambda", "lambda/exporter/lambda_function.py")
+updater = _load("updater_lambda", "lambda/updater/lambda_function.py")
+
+
+def makeFinding(number=0, region="us-east-1", account="111111111111"):
+    """
+    Build a small but representative securityhub:get_findings finding dict.
+    """
+    return {
+        "Id": f"arn:aws:securityhub:{region}:{account}:subscription/" +
+            f"aws-foundational-security-best-practices/v/1.0.0/S3.1/finding/{number:08d}",
+        "ProductArn": f"arn:aws:securityhub:{region}::product/aws/securityhub",
+        "GeneratorId": "aws-foundational-security-best-practices/v/1.0.0/S3.1",
+        "AwsAccountId": account,
+        "Region": region,
+        "Types": ["Software and Configuration Checks/Industry and Regulatory Standards"],
+        "FirstObservedAt": "2022-11-01T10:00:00.000Z",
+        "LastObservedAt": "2022-11-20T10:00:00.000Z",
+        "CreatedAt": "2022-11-01T10:00:00.000Z",
+        "UpdatedAt": "2022-11-20T10:00:00.000Z",
+        "Severity": {"Product": 70, "Normalized": 70, "Label": "HIGH"},
+        "Title": "S3.1 S3 Block Public Access setting should be enabled",
+        "Description": "This control checks whether S3 Block Public Access is enabled.",
+        "ProductFields": {
+            "StandardsArn": "arn:aws:securityhub:::standards/aws-foundational-security-best-practices/v/1.0.0",
+            "ControlId": "S3.1",
+            "RecommendationUrl": "https://docs.aws.amazon.com/console/securityhub/S3.1/remediation",
+            "aws/securityhub/ProductName": "Security Hub",
+            "aws/securityhub/CompanyName": "AWS",
+        },
+        "Resources": [{"Type": "AwsAccount", "Id": f"AWS::::Account:{account}",
+            "Partition": "aws", "Region": region}],
+        "Compliance": {"Status": "FAILED"},
+        "Workflow": {"Status": "NEW"},
+        "WorkflowState": "NEW",
+        "RecordState": "ACTIVE",
+    }
+
+
+class FakeHubClient:
+    """
+    Stand-in for a securityhub client that generates pages of findings lazily.
+    """
+    class exceptions:
+        class InvalidAccessException(Exception):
+            pass
+
+    def __init__(self, region="us-east-1", pages=1, size=100):
+        self.region = region
+        self.pages = pages
+        self.size = size
+        self.calls = []
+
+    def get_findings(self, Filters=None, MaxResults=100, NextToken=None):
+        self.calls.append({"Filters": Filters, "NextToken": NextToken})
+        page = int(NextToken) if NextToken else 0
+        answer = {"Findings": [makeFinding(page * self.size + number, region=self.region)
+            for number in range(self.size)]}
+
+        if page + 1 < self.pages:
+            answer["NextToken"] = str(page + 1)
+
+        return answer
+
+    def describe_hub(self):
+        self.calls.append("DescribeHub")
+
+        if not getattr(self, "enabled", True):
+            raise ClientError({"Error": {"Code": "InvalidAccessException",
+                "Message": "not subscribed"}}, "DescribeHub")
+
+        return {"HubArn": f"arn:aws:securityhub:{self.region}:111111111111:hub/default"}
+
+    def list_finding_aggregators(self):
+        self.calls.append("ListFindingAggregators")
+        aggregator = getattr(self, "aggregator", None)
+
+        return {"FindingAggregators": [{"FindingAggregatorArn":
+            aggregator["FindingAggregatorArn"]}] if aggregator else []}
+
+    def get_finding_aggregator(self, FindingAggregatorArn=None):
+        self.calls.append("GetFindingAggregator")
+        return dict(self.aggregator)
+
+    def batch_update_findings(self, **parameters):
+        self.updates = getattr(self, "updates", [])
+        self.updates.append(parameters)
+        return {"ProcessedFindings": list(parameters["FindingIdentifiers"]),
+            "UnprocessedFindings": []}
+
+
+class FakeSsmClient:
+    """
+    Stand-in for an ssm client holding a dict of parameters.
+    """
+    def __init__(self, parameters=None):
+        self.parameters = dict(parameters or {})
+
+    def get_parameters(self, Names=None):
+        return {
+            "Parameters": [{"Name": name, "Value": self.parameters[name]}
+                for name in Names if name in self.parameters],
+            "InvalidParameters": [name for name in Names
+                if name not in self.parameters],
+        }
+
+    def put_parameter(self, Name=None, Description=None, Type=None, Value=None,
+        Overwrite=False):
+        self.parameters[Name] = Value
+        return {"Version": 1}
+
+
+@pytest.fixture(autouse=True)
+def unpaced(monkeypatch):
+    """
+    Leave Security Hub calls unpaced, so that the fakes answer at full speed;
+    throttled calls are still retried, without waiting. Returns the 
+    registry, whose quotas a test may set.
+    """
+    registry = csvo.RateLimiterRegistry(quotas={None: None}, backoff=0)
+    monkeypatch.setattr(csvo, "LIMITERS", registry)
+
+    return registry
+
+
+@pytest.fixture
+def fakeAws(monkeypatch):
+    """
+    Route every Actor client to in-memory fakes, keyed by service and region.
+    Returns the dict of fakes, which tests may add to before creating actors.
+    """
+    clients = {
+        "ssm": FakeSsmClient({
+            "/csvManager/bucket": "bucket",
+            "/csvManager/folder/findings": "SecurityHub",
+            "/csvManager/regionList": "us-east-1",
+        }),
+        "s3": FakeS3Client(),
+        "securityhub": {"us-east-1": FakeHubClient(pages=2, size=10)},
+    }
+
+    def getClient(self, region):
+        candidate = clients[self.service]
+        return candidate.get(region) if isinstance(candidate, dict) else candidate
+
+    monkeypatch.setattr(csvo.Actor, "authorize",
+        lambda self, regions=None: setattr(self, "principal", {"UserId": "tester"}) or self)
+    monkeypatch.setattr(csvo.Actor, "getClient", getClient)
+
+    return clients
+
+
+@pytest.fixture
+def hubActor(monkeypatch):
+    """
+    Factory for a HubActor whose regional clients are the supplied fakes.
+    """
+    def factory(clients):
+        monkeypatch.setattr(csvo.Actor, "authorize",
+            lambda self, regions=None: setattr(self, "principal", {"UserId": "tester"}) or self)
+        monkeypatch.setattr(csvo.Actor, "getClient",
+            lambda self, region: clients.get(region))
+
+        return csvo.HubActor(region=list(clients.keys()))
+
+    return factory
+
+
+class FakeS3Client:
+    """
+    In-memory stand-in for an s3 client, including multipart uploads.
+    """
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.calls = []
+        self.partSizes = {}
+
+    def put_object(self, Bucket=None, Key=None, Body=b"", **extra):
+        self.calls.append("PutObject")
+        body = Body.read() if hasattr(Body, "read") else Body
+        self.objects[(Bucket, Key)] = {"Body": bytes(body), **extra}
+        return {"ETag": '"%d"' % len(self.objects)}
+
+    def get_object(self, Bucket=None, Key=None, Range=None):
+        self.calls.append("GetObject")
+        return {"Body": io.BytesIO(self._range(self.objects[(Bucket, Key)]["Body"],
+            Range))}
+
+    def head_object(self, Bucket=None, Key=None):
+        self.calls.append("HeadObject")
+        return {"ContentLength": len(self.objects[(Bucket, Key)]["Body"])}
+
+    @staticmethod
+    def _range(body, Range=None):
+        if not Range:
+            return body
+
+        start, end = Range[len("bytes="):].split("-")
+        return body[int(start):int(end) + 1]
+
+    def delete_object(self, Bucket=None, Key=None):
+        self.calls.append("DeleteObject")
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket=None, Key=None, **extra):
+        self.calls.append("CreateMultipartUpload")
+        uploadId = "upload-%d" % (len(self.uploads) + 1)
+        self.uploads[uploadId] = {"Key": (Bucket, Key), "Parts": {}, "Extra": extra}
+        return {"UploadId": uploadId}
+
+    def upload_part(self, Bucket=None, Key=None, UploadId=None, PartNumber=0, Body=b""):
+        self.calls.append("UploadPart")
+        self.uploads[UploadId]["Parts"][PartNumber] = bytes(Body)
+        return {"ETag": '"%s-%d"' % (UploadId, PartNumber)}
+
+    def upload_part_copy(self, Bucket=None, Key=None, UploadId=None, PartNumber=0,
+        CopySource=None, CopySourceRange=None):
+        self.calls.append("UploadPartCopy")
+        source = self.objects[(CopySource["Bucket"], CopySource["Key"])]["Body"]
+        self.uploads[UploadId]["Parts"][PartNumber] = self._range(source,
+            CopySourceRange)
+        return {"CopyPartResult": {"ETag": '"%s-%d"' % (UploadId, PartNumber)}}
+
+    def complete_multipart_upload(self, Bucket=None, Key=None, UploadId=None,
+        MultipartUpload=None):
+        self.calls.append("CompleteMultipartUpload")
+        upload = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        assert numbers == sorted(upload["Parts"])
+        self.partSizes[(Bucket, Key)] = [len(upload["Parts"][number])
+            for number in numbers]
+        self.objects[(Bucket, Key)] = {"Body": b"".join(upload["Parts"][number]
+            for number in numbers), **upload["Extra"]}
+        return {}
+
+    def abort_multipart_upload(self, Bucket=None, Key=None, UploadId=None):
+        self.calls.append("AbortMultipartUpload")
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(UploadId)
+        return {}
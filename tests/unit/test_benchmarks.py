@@ -0,0 +1,111 @@
+import pytest
+
+from benchmarks import fakehub, run
+from benchmarks.generator import FindingGenerator
+from benchmarks.harness import csvo
+
+
+@pytest.fixture
+def fakeHub(monkeypatch):
+    """
+    Serve a fake Security Hub, and point securityhub clients at it; the
+    test configures it through the returned server's hub.
+    """
+    server = fakehub.serve(findings=250)
+    monkeypatch.setenv("CSV_ENDPOINT_SECURITYHUB", server.endpoint)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "fakehub")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "fakehub")
+    monkeypatch.setattr(csvo.Actor, "authorize",
+        lambda self, regions=None: self)
+    yield server
+    server.shutdown()
+
+
+def test_generator_is_deterministic_and_configurable():
+    generator = FindingGenerator(regions=["eu-west-1"], accounts=3,
+        resources=(2, 3), descriptionLength=1000, productFields=10)
+    findings = list(generator.findings(20))
+
+    assert findings == list(FindingGenerator(regions=["eu-west-1"], accounts=3,
+        resources=(2, 3), descriptionLength=1000, productFields=10).findings(20))
+    assert {finding["Region"] for finding in findings} == {"eu-west-1"}
+    assert len({finding["AwsAccountId"] for finding in findings}) == 3
+    assert all(2 <= len(finding["Resources"]) <= 3 for finding in findings)
+    assert all(len(finding["Description"]) >= 1000 for finding in findings)
+    assert all(len(finding["ProductFields"]) >= 10 for finding in findings)
+    assert [len(page) for page in generator.pages(250)] == [100, 100, 50]
+
+
+def test_fake_hub_pages_and_filters_findings_by_region(fakeHub):
+    actor = csvo.HubActor(region=["us-east-1", "eu-west-1"])
+    filters = {"SeverityLabel": [{"Value": "HIGH", "Comparison": "EQUALS"}]}
+    expected = [finding["Id"] for finding in fakeHub.hub.generator.findings(250,
+        region="eu-west-1") if finding["Severity"]["Label"] == "HIGH"]
+
+    pages = list(actor.streamFindings(filters=filters))
+    found = [finding["Id"] for region, findings in pages for finding in findings
+        if region == "eu-west-1"]
+
+    assert actor.endpoint == fakeHub.endpoint
+    assert found == expected and 0 < len(expected) < 250
+    assert all(finding["Region"] == region for region, findings in pages
+        for finding in findings)
+    assert fakeHub.hub.stats["pages"] == 2
+
+
+def test_fake_hub_throttling_is_retried_by_the_client(fakeHub):
+    fakeHub.hub.findings = 1000
+    fakeHub.hub.throttle = 0.3
+    csvo.METRICS.reset()
+
+    findings = csvo.HubActor(region="us-east-1").downloadFindings()
+    counters = csvo.METRICS.summary()["counters"]
+
+    assert len(findings) == 1000
+    assert fakeHub.hub.stats["pages"] == 10
+    assert fakeHub.hub.stats["throttled"] > 0
+    assert counters["apiCalls"] == 10 + fakeHub.hub.stats["throttled"]
+    assert counters["bytesReceived"] > 0
+    assert counters["throttles"] == counters["retries"] == \
+        fakeHub.hub.stats["throttled"]
+
+
+def test_fake_hub_sorts_findings_for_sharded_downloads(fakeHub, monkeypatch):
+    fakeHub.hub.findings = 3000
+    monkeypatch.setattr(csvo.HubActor, "_SHARD_PAGES", 3)
+
+    sharded = [finding["Id"] for region, findings in csvo.HubActor(
+        region="us-east-1").streamFindings(filters={}, shards=4)
+        for finding in findings]
+    serial = [finding["Id"] for region, findings in csvo.HubActor(
+        region="us-east-1").streamFindings(filters={}) for finding in findings]
+
+    assert len(sharded) == len(serial) == 3000
+    assert sorted(sharded) == sorted(serial)
+
+
+def test_fake_hub_fails_some_updates_and_keeps_the_rest(fakeHub):
+    fakeHub.hub.failures = 0.5
+    actor = csvo.HubActor(region="us-east-1")
+    identifiers = [{"Id": finding["Id"], "ProductArn": finding["ProductArn"]}
+        for finding in fakeHub.hub.generator.findings(20, region="us-east-1")]
+
+    answer = actor.updateFindings(region="us-east-1", parameters={
+        "FindingIdentifiers": identifiers, "Workflow": {"Status": "RESOLVED"}})
+    resolved = [finding["Id"] for finding in actor.downloadFindings(filters={
+        "WorkflowStatus": [{"Value": "RESOLVED", "Comparison": "EQUALS"}]})]
+
+    assert answer["UnprocessedFindings"] and answer["ProcessedFindings"]
+    assert {failure["ErrorCode"] for failure in answer["UnprocessedFindings"]} \
+        <= set(fakehub._FAILURES)
+    assert resolved == [identifier["Id"] for identifier
+        in answer["ProcessedFindings"]]
+
+
+@pytest.mark.parametrize("case", ["generate", "finding", "export", "parse",
+    "endtoend"])
+def test_benchmark_cases_run_and_report(case):
+    result = run.measure(case=case, count=30)
+
+    assert result["findings"] == 30
+    assert result["rowsPerSecond"] > 0 and result["peakRssMb"] > 0
@@ -0,0 +1,407 @@
+import io
+import json
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.conftest import FakeHubClient, FakeS3Client, csvo, makeFinding
+
+
+def test_small_stream_is_stored_with_a_single_put():
+    client = FakeS3Client()
+
+    with csvo.S3StreamWriter(client=client, bucket="b", key="k") as writer:
+        writer.write(b"Id,ProductArn\r\n")
+
+    assert client.calls == ["PutObject"]
+    assert client.objects[("b", "k")]["Body"] == b"Id,ProductArn\r\n"
+
+
+def test_large_stream_is_uploaded_in_parts():
+    client = FakeS3Client()
+    partSize = csvo.S3StreamWriter._MINIMUM_PART_SIZE
+    chunk = b"x" * 65536 + b"\n"
+    written = 0
+
+    with csvo.S3StreamWriter(client=client, bucket="b", key="k",
+        partSize=partSize) as writer:
+        while written < partSize * 2.5:
+            written += writer.write(chunk)
+
+        # Full parts are uploaded while writing continues
+        assert len(writer.parts) == 2
+
+    body = client.objects[("b", "k")]["Body"]
+
+    assert client.calls.count("UploadPart") == 3
+    assert client.calls[-1] == "CompleteMultipartUpload"
+    assert len(body) == written and body == chunk * (written // len(chunk))
+
+
+def test_failed_stream_is_aborted():
+    client = FakeS3Client()
+    partSize = csvo.S3StreamWriter._MINIMUM_PART_SIZE
+
+    with pytest.raises(RuntimeError):
+        with csvo.S3StreamWriter(client=client, bucket="b", key="k",
+            partSize=partSize) as writer:
+            writer.write(b"x" * (partSize + 1))
+            raise RuntimeError("download failed")
+
+    assert client.aborted == ["upload-1"]
+    assert client.objects == {}
+
+
+def test_parts_are_concatenated_within_s3(fakeAws):
+    client = fakeAws["s3"]
+    mb = 1024 * 1024
+    sizes = [100, 12 * mb, 3 * mb, 7 * mb, 50]
+    keys = ["SecurityHub/parts/x/%05d.csv" % index for index in range(len(sizes))]
+
+    for index, (key, size) in enumerate(zip(keys, sizes)):
+        client.objects[("bucket", key)] = {"Body": bytes([65 + index]) * size}
+
+    expected = b"Id\r\n" + b"".join(client.objects[("bucket", key)]["Body"]
+        for key in keys)
+
+    s3Actor = csvo.S3Actor(bucket="bucket", region="us-east-1")
+    written = s3Actor.concatenate(keys=keys, header=b"Id\r\n",
+        outputObject="SecurityHub/x.csv")
+
+    body = client.objects[("bucket", "SecurityHub/x.csv")]["Body"]
+    parts = client.partSizes[("bucket", "SecurityHub/x.csv")]
+
+    assert body == expected
+    assert written == len(body)
+    assert min(parts[:-1]) >= csvo.S3StreamWriter._MINIMUM_PART_SIZE
+    assert client.calls.count("UploadPartCopy") == 2
+    assert not [key for bucket, key in client.objects if "/parts/" in key]
+
+
+def test_small_parts_are_concatenated_with_a_single_put(fakeAws):
+    client = fakeAws["s3"]
+
+    for index in range(3):
+        client.objects[("bucket", "p%d" % index)] = {"Body": b"row%d\r\n" % index}
+
+    s3Actor = csvo.S3Actor(bucket="bucket", region="us-east-1")
+    s3Actor.concatenate(keys=["p0", "p1", "p2"], header=b"Id\r\n",
+        outputObject="out.csv")
+
+    assert client.objects[("bucket", "out.csv")]["Body"] == \
+        b"Id\r\nrow0\r\nrow1\r\nrow2\r\n"
+    assert "CreateMultipartUpload" not in client.calls
+
+
+def test_zstd_falls_back_to_gzip_without_zstandard(fakeAws, monkeypatch):
+    monkeypatch.setattr(csvo, "zstandard", None)
+
+    actor = csvo.S3Actor(bucket="b", region="us-east-1", compression="zstd")
+
+    assert actor.compression == "gzip"
+    assert actor.objectKey.endswith(".csv.gz")
+    assert actor.objectParameters["ContentEncoding"] == "gzip"
+
+
+def _variants():
+    plain = makeFinding(1)
+    noted = makeFinding(2)
+    noted["Note"] = {"Text": "tracked in JIRA-1", "UpdatedBy": "someone"}
+    noted["Criticality"] = 0
+    noted["Confidence"] = "75"
+    noted["UserDefinedFields"] = {"Owner": "team", "Ticket": ""}
+    sparse = {"Id": "arn:aws:securityhub:us-east-1:1:finding/x", "Types": [],
+        "ProductFields": {}, "Resources": []}
+    return [plain, noted, sparse]
+
+
+def test_compiled_schema_matches_finding_rows():
+    actor = type("PrincipalOnly", (csvo.Actor,), {"__init__": lambda self: None})()
+    actor.principal = {"UserId": "AIDATESTER"}
+
+    for finding in _variants():
+        row = csvo.FINDING_SCHEMA.row(finding, actor=actor)
+        findingObject = csvo.Finding(finding, actor=actor)
+
+        assert list(row) == findingObject.rowList
+        assert csvo.FINDING_SCHEMA.rowMap(row) == findingObject.rowMap
+
+    assert csvo.FINDING_SCHEMA.columns == tuple(findingObject.columns)
+    assert csvo.FINDING_SCHEMA.keys == ("Id", "ProductArn")
+
+
+def test_finding_record_resolves_names_through_schema():
+    finding = makeFinding(7)
+    record = csvo.FindingRecord.fromFinding(finding)
+    findingObject = csvo.Finding(finding)
+
+    assert record.Id == finding["Id"] and record.SeverityLabel == "HIGH"
+    assert record.keys == findingObject.keys
+    assert record.rowMap == findingObject.rowMap
+    assert csvo.FindingRecord.fromObject(findingObject).values == record.values
+    assert not hasattr(record, "__dict__")
+    with pytest.raises(AttributeError):
+        record.NotAColumn
+
+
+def test_finding_records_share_repeated_strings_and_use_less_memory():
+    findings = [makeFinding(number) for number in range(500)]
+
+    # Values decoded separately are equal but distinct until interned
+    first, second = (csvo.FindingRecord.fromFinding(json.loads(json.dumps(finding)))
+        for finding in findings[:2])
+    assert first.ProductArn is second.ProductArn
+
+    def allocated(build):
+        tracemalloc.start()
+        try:
+            kept = [build(finding) for finding in findings]
+            return tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+
+    objects = allocated(lambda finding: csvo.Finding(finding))
+    records = allocated(csvo.FindingRecord.fromFinding)
+
+    assert records * 10 < objects
+
+
+class FakeStsClient:
+    """
+    Stand-in for an sts client whose credentials last for lifetime.
+    """
+    def __init__(self, lifetime=timedelta(hours=1)):
+        self.lifetime = lifetime
+        self.calls = []
+        self.sessionNames = []
+
+    def assume_role(self, RoleArn=None, RoleSessionName=None):
+        self.calls.append("AssumeRole")
+        self.sessionNames.append(RoleSessionName)
+        number = self.calls.count("AssumeRole")
+        return {"Credentials": {"AccessKeyId": "AKIA%d" % number,
+            "SecretAccessKey": "secret", "SessionToken": "token",
+            "Expiration": datetime.now(timezone.utc) + self.lifetime}}
+
+    def get_caller_identity(self):
+        self.calls.append("GetCallerIdentity")
+        return {"UserId": "tester", "Arn": "arn:aws:iam::111111111111:user/tester"}
+
+
+@pytest.fixture
+def sharedCredentials(monkeypatch):
+    """
+    Fresh credential and client caches over a fake STS.
+    """
+    sts = FakeStsClient()
+    monkeypatch.setattr(csvo, "CREDENTIALS", csvo.CredentialProvider())
+    monkeypatch.setattr(csvo, "CLIENTS", csvo.ClientRegistry())
+    monkeypatch.setattr(csvo.boto3, "client",
+        lambda service, region_name=None: sts)
+
+    return sts
+
+
+def test_client_registry_reuses_clients_per_role_and_pool(sharedCredentials):
+    registry = csvo.ClientRegistry()
+    role = "arn:aws:iam::111111111111:role/reader"
+
+    client = registry.get("securityhub", "us-east-1", role, connections=4)
+
+    assert registry.get("securityhub", "us-east-1", role, 8) is client
+    assert registry.get("securityhub", "us-east-1", None) is not client
+    assert registry.get("securityhub", "us-west-2", role) is not client
+    assert registry.get("securityhub", "us-east-1", role,
+        connections=32)._client_config.max_pool_connections == 32
+    assert client._client_config.max_pool_connections == 10
+    assert registry.created == 4
+    assert client._request_signer._credentials.access_key == "AKIA1"
+
+
+def test_actors_share_one_role_assumption_per_service(sharedCredentials):
+    role = "arn:aws:iam::111111111111:role/reader"
+
+    hub = csvo.HubActor(region=["us-east-1", "us-west-2"], role=role)
+    again = csvo.HubActor(region="us-east-1", role=role)
+    s3 = csvo.S3Actor(bucket="bucket", region="us-east-1", role=role)
+
+    assert sharedCredentials.calls == ["AssumeRole", "GetCallerIdentity",
+        "AssumeRole"]
+    assert sharedCredentials.sessionNames == ["securityhub-access", "s3-access"]
+    assert hub.principal["UserId"] == s3.principal["UserId"] == "tester"
+    assert hub.client["us-west-2"]._request_signer._credentials is \
+        again.client["us-east-1"]._request_signer._credentials
+    assert hub.client["us-east-1"]._request_signer._credentials is not \
+        s3.client["us-east-1"]._request_signer._credentials
+
+
+def test_assumed_role_credentials_refresh_before_expiry(sharedCredentials):
+    sharedCredentials.lifetime = timedelta(minutes=5)
+    actor = csvo.HubActor(region="us-east-1",
+        role="arn:aws:iam::111111111111:role/reader")
+
+    credentials = actor.client["us-east-1"]._request_signer._credentials
+
+    # Credentials this close to expiry are replaced when next used
+    assert credentials.get_frozen_credentials().access_key == "AKIA2"
+    assert csvo.CREDENTIALS.assumed == 2
+
+
+def test_hub_actor_updates_reuse_its_regional_client(monkeypatch):
+    built = []
+
+    class FakeSession:
+        def client(self, service, **kwargs):
+            built.append(kwargs)
+            return FakeHubClient()
+
+    monkeypatch.setattr(csvo, "CLIENTS", csvo.ClientRegistry())
+    monkeypatch.setattr(csvo.Actor, "authorize", lambda self, regions=None: self)
+    monkeypatch.setattr(csvo.CredentialProvider, "session",
+        lambda self, role=None, region=None, service=None: FakeSession())
+
+    actor = csvo.HubActor(region=["us-east-1", "us-west-2"], connections=16)
+    again = csvo.HubActor(region="us-east-1", connections=16)
+
+    for number in range(5):
+        actor.updateFindings(region="us-east-1",
+            parameters={"FindingIdentifiers": [{"Id": str(number)}]})
+
+    assert len(built) == 1 and again.client["us-east-1"] is actor.client["us-east-1"]
+    assert len(actor.client["us-east-1"].updates) == 5
+    assert built[0]["config"].max_pool_connections == 16
+
+
+def test_actor_clients_are_created_on_first_use(monkeypatch):
+    created = []
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2"]
+    monkeypatch.setattr(csvo.Actor, "authorize", lambda self, regions=None: self)
+    monkeypatch.setattr(csvo.Actor, "getClient",
+        lambda self, region: created.append(region) or FakeHubClient(region))
+
+    actor = csvo.HubActor(region=regions)
+
+    assert created == []
+    assert actor.client["us-west-2"] is actor.client["us-west-2"]
+    assert created == ["us-west-2"]
+
+    actor.warmClients().join(timeout=5)
+
+    assert sorted(created) == sorted(regions)
+    assert sorted(actor.client) == sorted(regions)
+
+
+def test_metrics_phases_are_exclusive_and_emitted_as_emf(monkeypatch):
+    clock = iter([0.0, 1.0, 1.5, 2.0, 4.5])
+    monkeypatch.setattr(csvo.time, "perf_counter", lambda: next(clock))
+    metrics = csvo.MetricsCollector()
+
+    with metrics.phase("parse"):
+        with metrics.phase("grouping", region="us-east-1"):
+            pass
+
+    metrics.count("pages", 3, region="us-east-1")
+    metrics.count("bytesUploaded", 2048)
+    stream = io.StringIO()
+    monkeypatch.setattr(csvo.time, "perf_counter", lambda: 10.0)
+
+    lines = metrics.emit(function="updater", stream=stream, mode="test")
+    emitted = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    assert metrics.summary()["phases"] == {"parse": 3.0, "grouping": 0.5}
+    assert emitted == lines and len(lines) == 2
+    assert lines[0]["parseTime"] == 3.0 and lines[0]["mode"] == "test"
+    assert lines[1]["Region"] == "us-east-1" and lines[1]["pages"] == 3
+    assert lines[1]["groupingTime"] == 0.5
+    for line in lines:
+        directive = line["_aws"]["CloudWatchMetrics"][0]
+        assert directive["Namespace"] == "HubAccel"
+        assert all(name in line for name in directive["Dimensions"][0])
+        assert all(metric["Name"] in line for metric in directive["Metrics"])
+    assert {metric["Name"]: metric["Unit"] for metric in
+        lines[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"]}["bytesUploaded"] == "Bytes"
+
+
+def test_rate_limiter_paces_calls_and_backs_off_when_throttled():
+    limiter = csvo.RateLimiter(rate=20, burst=1, concurrency=4)
+    started = time.monotonic()
+
+    for number in range(5):
+        limiter.acquire()
+        limiter.release()
+
+    assert time.monotonic() - started >= 0.18
+    assert limiter.rate == 20 and limiter.limit == 4
+
+    limiter.acquire()
+    limiter.release(throttled=True)
+
+    assert limiter.rate == 10 and limiter.limit == 2
+
+    for number in range(3):
+        limiter.acquire()
+        limiter.release()
+
+    assert limiter.rate == 13 and 2 < limiter.limit < 4
+
+
+def test_rate_limiter_registry_retries_throttled_and_transient_calls(unpaced):
+    def throttle(code):
+        return ClientError({"Error": {"Code": code, "Message": code}}, "GetFindings")
+
+    outcomes = [throttle("TooManyRequestsException"), throttle("InternalException"),
+        {"Findings": []}]
+    calls = []
+
+    def call(**parameters):
+        calls.append(parameters)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    unpaced.quotas = {None: (1000, 1000)}
+    csvo.METRICS.reset()
+
+    assert unpaced.call("us-east-1", "GetFindings", call, MaxResults=100) == {"Findings": []}
+    assert len(calls) == 3 and calls[0] == {"MaxResults": 100}
+    assert unpaced.get("us-east-1", "GetFindings").rate == 500 + 2 * 50
+    assert csvo.METRICS.summary()["regions"]["us-east-1"]["retries"] == 2
+
+    outcomes[:] = [throttle("AccessDeniedException")]
+
+    with pytest.raises(ClientError):
+        unpaced.call("us-east-1", "GetFindings", call)
+
+    outcomes[:] = [throttle("ThrottlingException")] * unpaced.attempts
+
+    with pytest.raises(ClientError):
+        unpaced.call("us-east-1", "GetFindings", call)
+
+    assert not outcomes
+
+
+def test_page_download_time_excludes_throttle_waits(hubActor, unpaced, monkeypatch):
+    class ThrottledOnceClient(FakeHubClient):
+        throttled = False
+
+        def get_findings(self, **kwargs):
+            if not self.throttled:
+                self.throttled = True
+                raise ClientError({"Error": {"Code": "TooManyRequestsException",
+                    "Message": "Rate exceeded"}}, "GetFindings")
+            return super().get_findings(**kwargs)
+
+    monkeypatch.setattr(unpaced, "wait", lambda attempt=0: time.sleep(0.2))
+    actor = hubActor({"us-east-1": ThrottledOnceClient("us-east-1")})
+    csvo.METRICS.reset()
+
+    actor.getPage(region="us-east-1", parameters={"MaxResults": 100})
+    region = csvo.METRICS.summary()["regions"]["us-east-1"]
+
+    assert region["throttleWait"] >= 0.2
+    assert region["download"] < 0.1
+    assert region["retries"] == 1 and region["pages"] == 1
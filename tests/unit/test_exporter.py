@@ -0,0 +1,786 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.conftest import FakeHubClient, csvo, exporter, makeFinding
+
+
+class NullSink:
+    """
+    A text target that discards everything but the number of rows written.
+    """
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        return len(text)
+
+
+def test_stream_findings_yields_pages_in_region_order(hubActor):
+    actor = hubActor({
+        "us-east-1": FakeHubClient("us-east-1", pages=3, size=10),
+        "us-west-2": FakeHubClient("us-west-2", pages=2, size=10),
+    })
+
+    pages = list(actor.streamFindings(filters={}))
+
+    assert [region for region, findings in pages] == \
+        ["us-east-1"] * 3 + ["us-west-2"] * 2
+    assert actor.count == 50
+
+
+def test_stream_findings_honours_limit_across_regions(hubActor):
+    actor = hubActor({
+        "us-east-1": FakeHubClient("us-east-1", pages=2, size=10),
+        "us-west-2": FakeHubClient("us-west-2", pages=5, size=10),
+    })
+
+    pages = list(actor.streamFindings(filters={}, limit=25))
+
+    # The page that crosses the limit is the last one returned
+    assert sum(len(findings) for region, findings in pages) == 30
+    assert actor.count == 30
+    assert len(actor.client["us-west-2"].calls) == 1
+
+
+def test_download_findings_matches_stream(hubActor):
+    actor = hubActor({"us-east-1": FakeHubClient(pages=3, size=10)})
+
+    assert [finding["Id"] for finding in actor.downloadFindings(filters={})] == \
+        [makeFinding(number)["Id"] for number in range(30)]
+
+
+def test_write_findings_produces_header_and_rows(hubActor):
+    actor = hubActor({"us-east-1": FakeHubClient(pages=2, size=5)})
+    target = io.StringIO()
+
+    count = exporter.writeFindings(pages=actor.streamFindings(filters={}),
+        target=target, actor=actor)
+
+    rows = list(csv.reader(io.StringIO(target.getvalue())))
+
+    assert count == 10
+    assert rows[0] == csvo.Finding(makeFinding(), actor=actor).columns
+    assert len(rows) == 11
+
+
+def _peakWrite(actor, pages):
+    actor.client["us-east-1"].pages = pages
+    sink = NullSink()
+
+    tracemalloc.start()
+    try:
+        count = exporter.writeFindings(pages=actor.streamFindings(filters={}),
+            target=sink, actor=actor)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert count == pages * 100
+    assert sink.lines == count + 1
+
+    return peak
+
+
+def test_streaming_memory_is_bounded_by_page_size(hubActor):
+    actor = hubActor({"us-east-1": FakeHubClient(pages=1, size=100)})
+
+    small = _peakWrite(actor, pages=2)
+    large = _peakWrite(actor, pages=30)
+
+    # Fifteen times the findings must not need materially more memory
+    assert large < small * 1.5 + 256 * 1024
+
+
+class SlowHubClient(FakeHubClient):
+    """
+    A fake client whose pages take a while to arrive.
+    """
+    def __init__(self, *args, delay=0.05, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+
+    def get_findings(self, **kwargs):
+        time.sleep(self.delay)
+        return super().get_findings(**kwargs)
+
+
+def test_concurrent_download_matches_serial_order(hubActor):
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2"]
+    actor = hubActor({region: SlowHubClient(region, pages=3, size=5)
+        for region in regions})
+
+    started = time.monotonic()
+    concurrent = [(region, [finding["Id"] for finding in findings])
+        for region, findings in actor.streamFindings(filters={}, workers=4)]
+    elapsed = time.monotonic() - started
+
+    serial = [(region, [finding["Id"] for finding in findings])
+        for region, findings in actor.streamFindings(filters={}, workers=1)]
+
+    assert concurrent == serial
+    assert elapsed < 4 * 3 * 0.05
+
+
+def test_concurrent_download_holds_at_most_prefetch_pages_per_region(hubActor):
+    later = FakeHubClient("us-west-2", pages=20, size=5)
+    actor = hubActor({"us-east-1": SlowHubClient("us-east-1", pages=2, size=5,
+        delay=0.2), "us-west-2": later})
+
+    pages = actor.streamFindings(filters={}, workers=2, prefetch=2)
+    next(pages)
+    time.sleep(0.2)
+
+    # Two pages queued, and the producer blocked delivering a third
+    assert len(later.calls) == 3
+
+    assert len(list(pages)) == 1 + 20
+    assert len(later.calls) == 20
+
+
+def test_concurrent_download_honours_limit(hubActor):
+    regions = ["us-east-1", "us-east-2", "us-west-1"]
+    actor = hubActor({region: SlowHubClient(region, pages=4, size=10, delay=0.01)
+        for region in regions})
+
+    pages = list(actor.streamFindings(filters={}, limit=55, workers=3))
+
+    assert [region for region, findings in pages] == \
+        ["us-east-1"] * 4 + ["us-east-2"] * 2
+    assert actor.count == 60
+
+
+def test_concurrent_download_raises_region_errors_in_order(hubActor):
+    class BrokenHubClient(FakeHubClient):
+        def get_findings(self, **kwargs):
+            raise RuntimeError("broken")
+
+    actor = hubActor({
+        "us-east-1": FakeHubClient("us-east-1", pages=2, size=5),
+        "us-west-2": BrokenHubClient("us-west-2"),
+    })
+    pages = actor.streamFindings(filters={}, workers=2)
+
+    assert next(pages)[0] == "us-east-1"
+    assert next(pages)[0] == "us-east-1"
+    with pytest.raises(RuntimeError):
+        next(pages)
+
+
+class DatedHubClient(FakeHubClient):
+    """
+    A fake client holding findings spread over time, which honours UpdatedAt
+    date filters, sorting, and NextToken pagination.
+    """
+    def __init__(self, count=1000, size=100, step=timedelta(hours=7)):
+        super().__init__(size=size)
+        origin = datetime(2022, 1, 1, tzinfo=timezone.utc)
+        self.findings = []
+
+        for number in range(count):
+            finding = makeFinding(number)
+            # Several findings share each timestamp, so splits land on ties
+            finding["UpdatedAt"] = csvo.FindingActions.formatTimestamp(
+                origin + step * (number // 3))
+            self.findings.append(finding)
+
+    def get_findings(self, Filters=None, MaxResults=100, NextToken=None,
+        SortCriteria=None):
+        self.calls.append({"Filters": Filters, "NextToken": NextToken})
+        parse = csvo.FindingActions.parseTimestamp
+        candidates = self.findings
+
+        for window in Filters.get("UpdatedAt", []):
+            start, end = parse(window["Start"]), parse(window["End"])
+            candidates = [finding for finding in candidates
+                if start <= parse(finding["UpdatedAt"]) <= end]
+
+        if SortCriteria:
+            candidates = sorted(candidates, key=lambda finding: finding["UpdatedAt"])
+
+        offset = int(NextToken) if NextToken else 0
+        answer = {"Findings": candidates[offset:offset + MaxResults]}
+
+        if offset + MaxResults < len(candidates):
+            answer["NextToken"] = str(offset + MaxResults)
+
+        return answer
+
+
+def test_sharded_download_returns_every_finding_once(hubActor, monkeypatch):
+    monkeypatch.setattr(csvo.HubActor, "_SHARD_PAGES", 2)
+    client = DatedHubClient(count=2000, size=50)
+    actor = hubActor({"us-east-1": client})
+
+    ids = [finding["Id"] for region, findings in
+        actor.streamFindings(filters={"RecordState": [{"Value": "ACTIVE",
+            "Comparison": "EQUALS"}]}, shards=4)
+        for finding in findings]
+
+    assert sorted(ids) == sorted(finding["Id"] for finding in client.findings)
+    # Shards that were too large were split, and user filters were kept
+    assert len({str(call["Filters"]["UpdatedAt"]) for call in client.calls}) > 4
+    assert all("RecordState" in call["Filters"] for call in client.calls)
+
+
+def test_sharded_download_holds_bounded_pages_when_timestamps_tie(hubActor,
+    monkeypatch):
+    monkeypatch.setattr(csvo.HubActor, "_SHARD_PAGES", 3)
+    client = DatedHubClient(count=1000, size=20, step=timedelta(0))
+    actor = hubActor({"us-east-1": client})
+    held = []
+    shardPages = csvo.HubActor.shardPages
+
+    def recordingShardPages(self, **kwargs):
+        pages, remainder = shardPages(self, **kwargs)
+        held.append(len(pages))
+        return pages, remainder
+
+    monkeypatch.setattr(csvo.HubActor, "shardPages", recordingShardPages)
+
+    ids = [finding["Id"] for region, findings in
+        actor.streamFindings(filters={}, shards=2) for finding in findings]
+
+    assert sorted(ids) == sorted(finding["Id"] for finding in client.findings)
+    assert max(held) == 3 and len(held) >= 5
+
+
+def test_sharded_download_keeps_findings_dated_outside_the_default_window(
+    hubActor, monkeypatch):
+    monkeypatch.setattr(csvo.HubActor, "_SHARD_PAGES", 2)
+    client = DatedHubClient(count=600, size=20)
+    format = csvo.FindingActions.formatTimestamp
+    now = datetime.now(timezone.utc)
+
+    # Imported findings from before Security Hub, and a skewed provider clock
+    for finding in client.findings[:50]:
+        finding["UpdatedAt"] = format(datetime(2012, 6, 1, tzinfo=timezone.utc))
+    for finding in client.findings[-50:]:
+        finding["UpdatedAt"] = format(now + timedelta(days=400))
+    actor = hubActor({"us-east-1": client})
+
+    ids = [finding["Id"] for region, findings in
+        actor.streamFindings(filters={}, shards=4) for finding in findings]
+
+    assert sorted(ids) == sorted(finding["Id"] for finding in client.findings)
+
+
+def test_sharded_download_respects_user_window(hubActor):
+    client = DatedHubClient(count=300, size=20)
+    actor = hubActor({"us-east-1": client})
+    window = {"UpdatedAt": [{"Start": "2022-01-05T00:00:00.000Z",
+        "End": "2022-01-10T00:00:00.000Z"}]}
+
+    sharded = [finding["Id"] for region, findings in
+        actor.streamFindings(filters=window, shards=3) for finding in findings]
+    serial = [finding["Id"] for region, findings in
+        actor.streamFindings(filters=window) for finding in findings]
+
+    assert sorted(sharded) == sorted(serial)
+    assert len(serial) > 0
+
+
+def test_time_shards_are_disjoint():
+    parse = csvo.FindingActions.parseTimestamp
+    shard = csvo.TimeShard("UpdatedAt", parse("2022-01-01T00:00:00Z"),
+        parse("2022-01-02T00:00:00Z"), closed=True)
+    first, second = shard.split(2)
+    boundary = {"Id": "a", "UpdatedAt": "2022-01-01T12:00:00.000Z"}
+
+    assert not first.contains(boundary) and second.contains(boundary)
+    assert second.contains({"Id": "b", "UpdatedAt": "2022-01-02T00:00:00.000Z"})
+
+    # Open outer edges stay with the first and last shards only
+    first, second = csvo.TimeShard("UpdatedAt", shard.start, shard.end,
+        closed=True, openStart=True, openEnd=True).split(2)
+    early = {"Id": "c", "UpdatedAt": "2012-01-01T00:00:00.000Z"}
+    late = {"Id": "d", "UpdatedAt": "2032-01-01T00:00:00.000Z"}
+
+    assert first.contains(early) and not second.contains(early)
+    assert second.contains(late) and not first.contains(late)
+    assert first.filters()["UpdatedAt"][0]["Start"].startswith("1970-")
+    assert second.filters()["UpdatedAt"][0]["End"].startswith("9999-")
+
+
+def test_direct_export_streams_to_s3_without_local_file(fakeAws, tmp_path, monkeypatch):
+    monkeypatch.setattr(csvo.S3Actor, "filePath",
+        lambda self, directory=None: str(tmp_path / self.filename))
+
+    answer = exporter.executor(region="us-east-1", filters={}, direct=True)
+
+    body = fakeAws["s3"].objects[("bucket", answer["exportKey"])]["Body"]
+
+    assert answer["success"] and answer["exportKey"].startswith("SecurityHub/")
+    assert len(list(csv.reader(io.StringIO(body.decode("utf-8"))))) == 21
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.parametrize("direct", [True, False])
+def test_compressed_export(fakeAws, tmp_path, monkeypatch, direct):
+    monkeypatch.setattr(csvo.S3Actor, "filePath",
+        lambda self, directory=None: str(tmp_path / self.filename))
+
+    answer = exporter.executor(region="us-east-1", filters={}, direct=direct,
+        compression="gzip")
+
+    stored = fakeAws["s3"].objects[("bucket", answer["exportKey"])]
+    rows = list(csv.reader(io.StringIO(gzip.decompress(stored["Body"]).decode("utf-8"))))
+
+    assert answer["exportKey"].endswith(".csv.gz")
+    assert stored["ContentEncoding"] == "gzip"
+    assert stored["ContentType"] == "text/csv"
+    assert len(rows) == 21
+
+
+@pytest.mark.parametrize("direct", [True, False])
+def test_parquet_export(fakeAws, tmp_path, monkeypatch, direct):
+    parquet = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(csvo.S3Actor, "filePath",
+        lambda self, directory=None: str(tmp_path / self.filename))
+    monkeypatch.setattr(csvo.ParquetFindingWriter, "_ROW_GROUP_SIZE", 8)
+
+    answer = exporter.executor(region="us-east-1", filters={}, direct=direct,
+        format="parquet", compression="zstd")
+
+    stored = fakeAws["s3"].objects[("bucket", answer["exportKey"])]
+    source = parquet.ParquetFile(io.BytesIO(stored["Body"]))
+    table = source.read()
+    schema = table.schema
+
+    assert answer["exportKey"].endswith(".parquet")
+    assert "ContentEncoding" not in stored
+    assert table.num_rows == 20 and source.metadata.num_row_groups == 3
+    assert str(schema.field("Criticality").type) == "int32"
+    assert str(schema.field("FirstObservedAt").type) == "timestamp[ms, tz=UTC]"
+    assert "RLE_DICTIONARY" in str(source.metadata.row_group(0).column(
+        table.column_names.index("ProductArn")).encodings)
+    assert table.column("SeverityLabel").to_pylist()[0] == "HIGH"
+
+
+def test_region_discovery_probes_once_and_caches_in_ssm(fakeAws, monkeypatch):
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2"]
+    fakeAws["securityhub"] = {region: FakeHubClient(region) for region in regions}
+    fakeAws["securityhub"]["us-east-2"].enabled = False
+    del fakeAws["ssm"].parameters["/csvManager/regionList"]
+    monkeypatch.delenv("CSV_SECURITYHUB_REGIONLIST", raising=False)
+    ssmActor = csvo.SsmActor(region="us-east-1")
+
+    discovery = csvo.RegionDiscovery(ssmActor=ssmActor)
+    assert discovery.regions(candidates=regions) == \
+        ["us-east-1", "us-west-1", "us-west-2"]
+    discovery.save()
+
+    cached = csvo.RegionDiscovery(ssmActor=csvo.SsmActor(region="us-east-1"))
+    assert cached.fresh
+    assert cached.regions(candidates=regions) == ["us-east-1", "us-west-1", "us-west-2"]
+    assert [client.calls.count("DescribeHub") for client in
+        fakeAws["securityhub"].values()] == [1, 1, 1, 1]
+
+    stale = csvo.RegionDiscovery(ssmActor=ssmActor,
+        now=datetime.now(timezone.utc) + timedelta(days=2))
+    assert not stale.fresh
+
+
+def test_region_breaker_skips_regions_that_keep_failing(fakeAws, tmp_path, monkeypatch):
+    class DisabledHubClient(FakeHubClient):
+        class exceptions:
+            class InvalidAccessException(FakeHubClient.exceptions.InvalidAccessException):
+                response = {"Error": {"Message": "not subscribed"}}
+
+        def get_findings(self, **kwargs):
+            self.calls.append("GetFindings")
+            raise self.exceptions.InvalidAccessException()
+
+    monkeypatch.setattr(csvo.S3Actor, "filePath",
+        lambda self, directory=None: str(tmp_path / self.filename))
+    fakeAws["ssm"].parameters["/csvManager/regionList"] = "us-east-1, us-west-2"
+    fakeAws["securityhub"]["us-west-2"] = broken = DisabledHubClient("us-west-2")
+
+    for run in range(csvo.RegionBreaker._THRESHOLD + 1):
+        answer = exporter.executor(region="us-east-1", filters={})
+        assert answer["success"]
+
+    # The region was tried until the breaker opened, then skipped
+    assert broken.calls.count("GetFindings") == csvo.RegionBreaker._THRESHOLD
+    state = json.loads(fakeAws["ssm"].parameters["/csvManager/enabledRegions"])
+    assert state["breaker"]["us-west-2"]["failures"] == csvo.RegionBreaker._THRESHOLD
+
+    later = csvo.RegionBreaker(state=state["breaker"],
+        now=datetime.now(timezone.utc) + timedelta(days=2))
+    assert later.allow("us-west-2")
+
+
+class AggregatingHubClient(FakeHubClient):
+    """
+    A fake aggregation-region client that returns the findings of every region
+    named in its Region filter.
+    """
+    def get_findings(self, Filters=None, MaxResults=100, NextToken=None):
+        self.calls.append({"Filters": Filters, "NextToken": NextToken})
+        return {"Findings": [makeFinding(number, region=value["Value"])
+            for value in Filters.get("Region", []) for number in range(self.size)]}
+
+
+def test_aggregation_region_replaces_linked_regions(hubActor):
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2"]
+    clients = {region: FakeHubClient(region, size=5) for region in regions}
+    clients["us-east-1"] = AggregatingHubClient("us-east-1", size=5)
+    aggregator = {"FindingAggregatorArn": "arn:aws:securityhub:us-east-1:" +
+            "111111111111:finding-aggregator/1", "FindingAggregationRegion": "us-east-1",
+        "RegionLinkingMode": "ALL_REGIONS_EXCEPT_SPECIFIED", "Regions": ["us-west-1"]}
+    for client in clients.values():
+        client.aggregator = aggregator
+    actor = hubActor(clients)
+
+    queried = actor.aggregatedRegions(regions)
+    ids = [finding["Id"] for region, findings in
+        actor.streamFindings(regions=queried, filters={}) for finding in findings]
+
+    assert queried == ["us-east-1", "us-west-1"]
+    assert sorted(ids) == sorted(makeFinding(number, region=region)["Id"]
+        for region in regions for number in range(5))
+    assert clients["us-east-2"].calls == [] and clients["us-west-2"].calls == []
+
+
+def test_throttled_aggregator_lookup_still_yields_aggregated_regions(hubActor):
+    class ThrottledOnceClient(FakeHubClient):
+        throttled = False
+
+        def list_finding_aggregators(self):
+            if not self.throttled:
+                self.throttled = True
+                raise ClientError({"Error": {"Code": "TooManyRequestsException",
+                    "Message": "Rate exceeded"}}, "ListFindingAggregators")
+            return super().list_finding_aggregators()
+
+    regions = ["us-east-1", "us-east-2", "us-west-1"]
+    clients = {region: FakeHubClient(region) for region in regions}
+    clients["us-east-1"] = ThrottledOnceClient("us-east-1")
+    aggregator = {"FindingAggregatorArn": "arn:aws:securityhub:us-east-1:" +
+            "111111111111:finding-aggregator/1", "FindingAggregationRegion": "us-east-1",
+        "RegionLinkingMode": "ALL_REGIONS"}
+    for client in clients.values():
+        client.aggregator = aggregator
+    actor = hubActor(clients)
+
+    assert actor.aggregatedRegions(regions) == ["us-east-1"]
+    assert clients["us-east-1"].throttled
+
+
+def test_duplicate_findings_are_dropped_across_regions(hubActor):
+    actor = hubActor({
+        "us-east-1": FakeHubClient("us-east-1", pages=2, size=10),
+        "us-west-2": FakeHubClient("us-east-1", pages=3, size=10),
+    })
+
+    ids = [finding["Id"] for region, findings in actor.streamFindings(filters={})
+        for finding in findings]
+
+    assert len(ids) == len(set(ids)) == 30
+    assert actor.count == 30
+
+
+def test_finding_key_set_is_compact():
+    keys = csvo.FindingKeySet()
+
+    assert keys.add(makeFinding(1)) and not keys.add(makeFinding(1))
+    assert keys.add(dict(makeFinding(1), ProductArn="other"))
+    assert len(keys) == 2 and keys.duplicates == 1
+    assert csvo.FindingKeySet.digest(makeFinding(1)) < 2 ** 64
+
+
+def test_incremental_export_writes_only_changed_findings(fakeAws, tmp_path, monkeypatch):
+    monkeypatch.setattr(csvo.S3Actor, "filePath",
+        lambda self, directory=None: str(tmp_path / self.filename))
+    fakeAws["securityhub"]["us-east-1"] = client = DatedHubClient(count=300, size=50)
+
+    first = exporter.executor(region="us-east-1", filters={}, incremental=True)
+    marks = json.loads(fakeAws["ssm"].parameters["/csvManager/watermark"])
+    everything = fakeAws["s3"].objects[("bucket", first["exportKey"])]["Body"]
+
+    assert everything.count(b"\r\n") == 301
+
+    # Some findings change after the first export
+    for finding in client.findings[:5]:
+        finding["UpdatedAt"] = csvo.FindingActions.formatTimestamp(
+            datetime.now(timezone.utc))
+    monkeypatch.setattr(csvo.S3Actor, "filename", "SecurityHub-delta-2.csv")
+
+    second = exporter.executor(region="us-east-1", filters={}, incremental=True)
+
+    body = fakeAws["s3"].objects[("bucket", second["exportKey"])]["Body"]
+    manifest = json.loads(fakeAws["s3"].objects[("bucket",
+        second["manifestKey"])]["Body"])
+    window = manifest["regions"]["us-east-1"]["window"]
+
+    assert first["exportKey"].startswith("SecurityHub/SecurityHub-delta-")
+    assert len(list(csv.reader(io.StringIO(body.decode("utf-8"))))) == 6
+    assert manifest["count"] == 5 and manifest["regions"]["us-east-1"]["complete"]
+    assert manifest["previousWatermark"] == marks
+    assert window["End"] == manifest["watermark"]["us-east-1"]
+    assert window["Start"] < marks["us-east-1"] < window["End"]
+
+
+def test_incremental_export_refuses_an_updated_at_filter(fakeAws):
+    window = {"UpdatedAt": [{"Start": "2022-01-05T00:00:00.000Z",
+        "End": "2022-01-10T00:00:00.000Z"}]}
+
+    with pytest.raises(csvo.ActorException):
+        exporter.executor(region="us-east-1", filters=window, incremental=True)
+
+    assert "/csvManager/watermark" not in fakeAws["ssm"].parameters
+
+
+class FakeContext:
+    """
+    A Lambda context whose deadline arrives after a number of checks.
+    """
+    invoked_function_arn = "arn:aws:lambda:us-east-1:111111111111:function:exporter"
+
+    def __init__(self, checks=None):
+        self.checks = checks
+
+    def get_remaining_time_in_millis(self):
+        if self.checks is None:
+            return 900000
+
+        self.checks -= 1
+        return 900000 if self.checks >= 0 else 1000
+
+
+class FakeLambdaClient:
+    def __init__(self):
+        self.invocations = []
+
+    def invoke(self, FunctionName=None, InvocationType=None, Payload=None):
+        self.invocations.append(json.loads(Payload))
+        return {"StatusCode": 202}
+
+
+def test_export_checkpoints_and_resumes_across_invocations(fakeAws, monkeypatch):
+    fakeAws["securityhub"] = {region: FakeHubClient(region, pages=3, size=10)
+        for region in ["us-east-1", "us-west-2"]}
+    fakeAws["ssm"].parameters["/csvManager/regionList"] = "us-east-1,us-west-2"
+    monkeypatch.setattr(csvo, "CLIENTS", type("Clients", (),
+        {"get": lambda self, **kwargs: invoker})())
+    invoker = FakeLambdaClient()
+    event = {"region": "us-east-1", "direct": True, "compression": "gzip"}
+
+    answers = [exporter.lambdaHandler(event, FakeContext(checks=1))]
+    while invoker.invocations:
+        answers.append(exporter.lambdaHandler(invoker.invocations.pop(0),
+            FakeContext(checks=1)))
+
+    final = answers[-1]
+    body = fakeAws["s3"].objects[("bucket", final["exportKey"])]["Body"]
+    rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode("utf-8"))))
+
+    assert [answer["message"] for answer in answers] == \
+        ["Export checkpointed"] * 2 + ["Export succeeded"]
+    assert rows[0][0] == "Id" and len(rows) == 61
+    assert [row[0] for row in rows[1:]] == [makeFinding(number, region=region)["Id"]
+        for region in ["us-east-1", "us-west-2"] for number in range(30)]
+    assert not any("checkpoints" in key for bucket, key in fakeAws["s3"].objects)
+
+
+def test_resumed_export_continues_its_multipart_upload(fakeAws, monkeypatch):
+    fakeAws["securityhub"]["us-east-1"] = FakeHubClient(pages=200, size=100)
+
+    first = exporter.executor(region="us-east-1", filters={}, direct=True,
+        context=FakeContext(checks=150))
+    upload = json.loads(fakeAws["s3"].objects[("bucket",
+        first["continuation"])]["Body"])["upload"]
+    second = exporter.executor(region="us-east-1", filters={}, direct=True,
+        context=FakeContext(), resume=first["continuation"])
+
+    body = fakeAws["s3"].objects[("bucket", second["exportKey"])]["Body"]
+
+    assert upload["parts"] and fakeAws["s3"].aborted == []
+    assert body.count(b"\r\n") == 20001
+    assert len(fakeAws["s3"].calls) and fakeAws["s3"].calls.count("CreateMultipartUpload") == 1
+
+
+def runExportStateMachine(event):
+    """
+    Play the export state machine locally: plan, one part per shard, merge.
+    """
+    plan = exporter.lambdaHandler({"mode": "plan", "options": event})
+    assert plan["resultCode"] == 200
+
+    parts = []
+
+    for shard in plan["shards"]:
+        result = exporter.lambdaHandler({"mode": "part",
+            "options": plan["options"], "shard": shard})
+        parts.append({name: result[name] for name in
+            ("partKey", "count", "resultCode")})
+
+    return plan, exporter.lambdaHandler({"mode": "merge",
+        "options": plan["options"], "run": plan["run"], "parts": parts})
+
+
+def test_state_machine_exports_regions_in_parts(fakeAws):
+    fakeAws["securityhub"]["us-west-2"] = FakeHubClient(region="us-west-2",
+        pages=3, size=10)
+
+    plan, answer = runExportStateMachine({"region": "us-east-1",
+        "regions": "us-east-1,us-west-2",
+        "compression": "gzip"})
+
+    body = fakeAws["s3"].objects[("bucket", answer["exportKey"])]["Body"]
+    rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode("utf-8"))))
+
+    assert [shard["region"] for shard in plan["shards"]] == ["us-east-1", "us-west-2"]
+    assert answer["message"] == "Export succeeded"
+    assert rows[0][0] == "Id" and len(rows) == 51
+    assert [row[0].split(":")[3] for row in rows[1:]] == ["us-east-1"] * 20 + ["us-west-2"] * 30
+    assert not [key for bucket, key in fakeAws["s3"].objects if "/parts/" in key]
+
+
+def test_state_machine_shards_regions_by_account(fakeAws):
+    plan, answer = runExportStateMachine({"region": "us-east-1", "regions": ["us-east-1"],
+        "accounts": [["111111111111"], ["222222222222"]]})
+
+    filters = [call["Filters"]["AwsAccountId"] for call
+        in fakeAws["securityhub"]["us-east-1"].calls
+        if isinstance(call, dict) and call["NextToken"] is None]
+
+    assert len(plan["shards"]) == 2
+    assert [value[0]["Value"] for value in filters] == ["111111111111", "222222222222"]
+    assert answer["message"] == "Export succeeded"
+
+
+def test_failed_part_leaves_export_unassembled(fakeAws):
+    answer = exporter.lambdaHandler({"mode": "merge", "region": "us-east-1",
+        "run": "SecurityHub-x.csv",
+        "parts": [{"partKey": "SecurityHub/parts/x/00000.csv", "count": 1,
+            "resultCode": 200}, {"partKey": None, "resultCode": 500}]})
+
+    assert answer["message"] == "Export incomplete"
+    assert answer["exportKey"] is None
+
+
+def test_failed_part_answers_with_every_part_key(fakeAws):
+    class BrokenHubClient(FakeHubClient):
+        def get_findings(self, **kwargs):
+            raise RuntimeError("connection reset")
+
+    plan = exporter.lambdaHandler({"mode": "plan", "options": {"region": "us-east-1"}})
+    fakeAws["securityhub"]["us-east-1"] = BrokenHubClient("us-east-1")
+
+    answer = exporter.lambdaHandler({"mode": "part", "options": plan["options"],
+        "shard": plan["shards"][0]})
+    merged = exporter.lambdaHandler({"mode": "merge", "options": plan["options"],
+        "run": plan["run"], "parts": [{name: answer[name] for name in
+            ("partKey", "count", "resultCode")}]})
+
+    assert answer["resultCode"] == 500 and answer["message"] == "connection reset"
+    assert answer["partKey"] is None and answer["count"] == 0
+    json.dumps(answer)
+    assert merged["resultCode"] == 400
+
+
+class SeverityHubClient(FakeHubClient):
+    """
+    A hub client whose findings cycle through the severity labels.
+    """
+    LABELS = ["CRITICAL", "HIGH", "MEDIUM"]
+
+    def get_findings(self, **parameters):
+        answer = super().get_findings(**parameters)
+
+        for finding in answer["Findings"]:
+            number = int(finding["Id"][-8:])
+            finding["Severity"] = {"Label": self.LABELS[number % 3]}
+
+        return answer
+
+
+def test_partitioned_export_writes_one_object_per_partition(fakeAws):
+    fakeAws["securityhub"] = {region: SeverityHubClient(region=region, pages=2,
+        size=9) for region in ("us-east-1", "us-west-2")}
+
+    answer = exporter.executor(region="us-east-1", filters={}, partitioned=True,
+        regions=["us-east-1", "us-west-2"])
+
+    today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    total = 0
+
+    assert len(answer["exportKeys"]) == 6
+
+    for key in answer["exportKeys"]:
+        folder, dt, region, severity, name = key.split("/")
+        rows = list(csv.reader(io.StringIO(fakeAws["s3"].objects[("bucket",
+            key)]["Body"].decode("utf-8"))))
+
+        assert (folder, dt) == ("SecurityHub", "dt=" + today)
+        assert rows[0][0] == "Id" and len(rows) == 7
+        assert {row[0].split(":")[3] for row in rows[1:]} == {region[len("region="):]}
+        total += len(rows) - 1
+
+    assert total == 36
+
+
+def test_partitioned_export_bounds_open_writers(fakeAws, caplog):
+    caplog.set_level(logging.INFO)
+    s3Actor = csvo.S3Actor(bucket="bucket", region="us-east-1", compression="gzip")
+    findings = [dict(makeFinding(number), Severity={"Label": label})
+        for number, label in enumerate(["HIGH", "LOW"] * 5)]
+
+    with csvo.PartitionedExport(s3Actor=s3Actor, columns=("Id",), maxOpen=1,
+        date="2022-11-20") as export:
+        for finding in findings:
+            export.writerows(partition=export.partition(finding),
+                rows=[(finding["Id"],)])
+
+            assert len(export.writers) == 1
+
+    high, low = sorted(export.keys)
+    rows = list(csv.reader(io.StringIO(gzip.decompress(fakeAws["s3"].objects[
+        ("bucket", high)]["Body"]).decode("utf-8"))))
+
+    assert high.startswith("SecurityHub/dt=2022-11-20/region=us-east-1/severity=HIGH/")
+    assert rows == [["Id"]] + [[finding["Id"]] for finding in findings[0::2]]
+    assert not [key for bucket, key in fakeAws["s3"].objects if "/parts/" in key]
+    assert "2 partitions in 10 segments" in caplog.text and "497040w" in caplog.text
+
+
+def test_concurrent_partitioned_export_writes_each_partition_once(fakeAws, caplog):
+    regions = ["us-east-1", "us-east-2", "us-west-1", "us-west-2", "eu-west-1",
+        "eu-central-1"]
+    fakeAws["securityhub"] = {region: SeverityHubClient(region=region, pages=3,
+        size=6) for region in regions}
+    caplog.set_level(logging.INFO)
+
+    # More partitions than writers may be open at once, paged concurrently
+    answer = exporter.executor(region="us-east-1", filters={}, partitioned=True,
+        regions=regions, workers=4)
+
+    assert len(answer["exportKeys"]) == 3 * len(regions) > csvo.PartitionedExport._OPEN
+    assert "wrote 108 rows to 18 partitions in 18 segments" in caplog.text
+    assert "497040w" not in caplog.text
+
+
+def test_lambda_response_and_log_carry_performance_metrics(fakeAws, capsys):
+    answer = exporter.lambdaHandler({"region": "us-east-1", "direct": True})
+
+    metrics = answer["metrics"]
+    emitted = [json.loads(line) for line in capsys.readouterr().out.splitlines()
+        if line.startswith("{")]
+
+    assert answer["resultCode"] == 200
+    assert metrics["counters"]["pages"] == 2 and metrics["counters"]["findings"] == 20
+    assert metrics["counters"]["bytesUploaded"] > 0
+    assert {"download", "transform", "write", "upload"} <= set(metrics["phases"])
+    assert metrics["regions"]["us-east-1"]["findings"] == 20
+    assert emitted[0]["Function"] == "exporter" and emitted[0]["mode"] == "export"
+    assert emitted[0]["findings"] == 20 and emitted[1]["Region"] == "us-east-1"
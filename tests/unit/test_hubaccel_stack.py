@@ -1,3 +1,5 @@
+import json
+
 import aws_cdk as core
 import aws_cdk.assertions as assertions
 
@@ -13,3 +15,54 @@ def test_sqs_queue_created():
 #     template.has_resource_properties("AWS::SQS::Queue", {
 #         "VisibilityTimeout": 300
 #     })
+
+
+def test_export_state_machine_fans_out_over_shards():
+    app = core.App()
+    stack = HubaccelStack(app, "hubaccel")
+    template = assertions.Template.from_stack(stack)
+
+    template.resource_count_is("AWS::StepFunctions::StateMachine", 1)
+
+    # The definition is joined around the function ARNs, which are left out
+    machine, = template.find_resources("AWS::StepFunctions::StateMachine").values()
+    definition = json.loads("".join(part for part
+        in machine["Properties"]["DefinitionString"]["Fn::Join"][1]
+        if isinstance(part, str)))
+    states = definition["States"]
+
+    assert definition["StartAt"] == "hubaccel_export_plan"
+    assert states["hubaccel_export_plan"]["Parameters"] == \
+        {"mode": "plan", "options.$": "$"}
+    assert states["hubaccel_export_shards"]["Type"] == "Map"
+    assert states["hubaccel_export_shards"]["ItemsPath"] == "$.shards"
+    assert states["hubaccel_export_shards"]["Parameters"]["mode"] == "part"
+    assert states["hubaccel_export_shards"]["Next"] == "hubaccel_export_merge"
+    assert states["hubaccel_export_merge"]["Parameters"]["parts.$"] == "$.parts"
+    assert states["hubaccel_export_merge"]["Next"] == "hubaccel_export_merged"
+
+
+def test_export_state_machine_reports_failed_parts_and_merges():
+    app = core.App()
+    stack = HubaccelStack(app, "hubaccel")
+    template = assertions.Template.from_stack(stack)
+
+    machine, = template.find_resources("AWS::StepFunctions::StateMachine").values()
+    definition = json.loads("".join(part for part
+        in machine["Properties"]["DefinitionString"]["Fn::Join"][1]
+        if isinstance(part, str)))
+    states = definition["States"]
+    iterator = states["hubaccel_export_shards"]["Iterator"]["States"]
+
+    # A part that throws still yields a result, so the Map (and merge) carry on
+    catch, = iterator["hubaccel_export_part"]["Catch"]
+    assert catch["ErrorEquals"] == ["States.ALL"]
+    assert iterator[catch["Next"]] == {"Type": "Pass", "End": True,
+        "Parameters": {"partKey.$": "States.StringToJson('null')",
+            "count": 0, "resultCode": 500}}
+
+    # A merge that refuses an incomplete export fails the execution
+    merged = states["hubaccel_export_merged"]
+    assert merged["Choices"][0]["Variable"] == "$.resultCode"
+    assert states[merged["Choices"][0]["Next"]]["Type"] == "Succeed"
+    assert states[merged["Default"]]["Type"] == "Fail"
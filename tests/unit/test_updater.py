@@ -0,0 +1,310 @@
+import csv
+import gzip
+import io
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.conftest import FakeHubClient, csvo, makeFinding, updater
+
+
+def updateCsv(count=5, workflow="RESOLVED", note="line one\nline two"):
+    """
+    Build an update CSV from the export columns, with a multi-line note.
+    """
+    target = io.StringIO()
+    writer = csv.writer(target)
+    writer.writerow(csvo.FINDING_SCHEMA.columns)
+
+    for number in range(count):
+        row = csvo.FINDING_SCHEMA.rowMap(csvo.FINDING_SCHEMA.row(makeFinding(number)))
+        row["Workflow"] = workflow
+        row["NoteText"] = note
+        writer.writerow(row.values())
+        writer.writerow([])
+
+    return target.getvalue()
+
+
+class CountingBody(io.BytesIO):
+    """
+    An S3 object body that records the size of each read.
+    """
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = []
+
+    def read(self, size=-1):
+        self.reads.append(size)
+        return super().read(size)
+
+
+def test_stream_reads_s3_objects_incrementally(fakeAws):
+    data = updateCsv(count=2000).encode("utf-8")
+    body = CountingBody(data)
+    fakeAws["s3"].get_object = lambda Bucket=None, Key=None: {"Body": body}
+    actor = csvo.S3Actor(bucket="bucket", region="us-east-1")
+
+    with actor.open(key="updates.csv") as stream:
+        rows = [row for row in csv.reader(stream) if row]
+
+    assert len(rows) == 2001
+    assert rows[1][csvo.FINDING_SCHEMA.index["NoteText"]] == "line one\nline two"
+    assert len(data) > 1024 * 1024 and len(body.reads) > 4
+    assert max(body.reads) <= 256 * 1024
+
+
+def test_updater_applies_multiline_notes_from_local_file(fakeAws, tmp_path):
+    source = tmp_path / "updates.csv"
+    source.write_text(updateCsv(count=3), encoding="utf-8")
+
+    answer = updater.executor(region="us-east-1", input=str(source))
+
+    update = fakeAws["securityhub"]["us-east-1"].updates[0]
+
+    assert answer["success"] and len(answer["processed"]) == 3
+    assert update["Note"]["Text"] == "line one\nline two"
+    assert update["Workflow"] == {"Status": "RESOLVED"}
+    assert len(update["FindingIdentifiers"]) == 3
+
+
+def test_stream_decompresses_gzip_exports(fakeAws):
+    body = CountingBody(gzip.compress(updateCsv(count=3).encode("utf-8")))
+    fakeAws["s3"].get_object = lambda Bucket=None, Key=None: {"Body": body}
+    actor = csvo.S3Actor(bucket="bucket", region="us-east-1")
+
+    with actor.open(key="export.csv.gz") as stream:
+        rows = [row for row in csv.reader(stream) if row]
+
+    assert rows[0][0] == "Id" and len(rows) == 4
+    assert body.closed
+
+
+def test_stream_decompresses_every_zstd_frame(fakeAws):
+    zstandard = pytest.importorskip("zstandard")
+    header, rows = updateCsv(count=3).split("\r\n", 1)
+    compressor = zstandard.ZstdCompressor()
+
+    # A header frame followed by a frame of rows, as concatenated exports are
+    fakeAws["s3"].objects[("bucket", "export.csv.zst")] = {
+        "Body": compressor.compress((header + "\r\n").encode("utf-8")) +
+            compressor.compress(rows.encode("utf-8"))}
+    actor = csvo.S3Actor(bucket="bucket", region="us-east-1")
+
+    with actor.open(key="export.csv.zst") as stream:
+        rows = [row for row in csv.reader(stream) if row]
+
+    assert rows[0][0] == "Id" and len(rows) == 4
+
+
+def _updateList(actor, count=250, region="us-east-1"):
+    updates = csvo.MinimumUpdateList()
+
+    for number in range(count):
+        row = csvo.FINDING_SCHEMA.rowMap(csvo.FINDING_SCHEMA.row(
+            makeFinding(number, region=region)))
+        row["Workflow"] = "RESOLVED"
+        updates.add(csvo.Finding(list(row.values()), actor=actor))
+
+    return updates
+
+
+def test_update_list_keeps_only_finding_keys(hubActor):
+    actor = hubActor({"us-east-1": FakeHubClient()})
+
+    queued, = _updateList(actor, count=3).findings.values()
+
+    assert queued == [{"Id": makeFinding(number)["Id"],
+        "ProductArn": makeFinding(number)["ProductArn"]} for number in range(3)]
+
+
+def test_parameter_sets_are_independent_batches(hubActor):
+    actor = hubActor({"us-east-1": FakeHubClient()})
+
+    batches = list(_updateList(actor).parameterSets())
+
+    assert [len(update["FindingIdentifiers"]) for region, update in batches] == \
+        [100, 100, 50]
+    assert batches[0][1] is not batches[1][1]
+    assert batches[0][1]["Workflow"] is not batches[1][1]["Workflow"]
+    assert batches[0][1]["FindingIdentifiers"][0]["Id"] == makeFinding(0)["Id"]
+    assert batches[2][1]["FindingIdentifiers"][0]["Id"] == makeFinding(200)["Id"]
+
+
+class SlowUpdateClient(FakeHubClient):
+    """
+    A fake client that records how many updates are in flight at once, and
+    fails the batches named in fail.
+    """
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, *args, fail=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail = fail
+        self.regionPeak = 0
+        self.regionActive = 0
+
+    def batch_update_findings(self, **parameters):
+        cls = SlowUpdateClient
+
+        with cls.lock:
+            cls.active += 1
+            self.regionActive += 1
+            cls.peak = max(cls.peak, cls.active)
+            self.regionPeak = max(self.regionPeak, self.regionActive)
+
+        time.sleep(0.02)
+
+        with cls.lock:
+            cls.active -= 1
+            self.regionActive -= 1
+
+        if parameters["FindingIdentifiers"][0]["Id"] in self.fail:
+            raise RuntimeError("throttled")
+
+        return super().batch_update_findings(**parameters)
+
+
+def test_dispatcher_bounds_concurrency_and_keeps_order(hubActor, monkeypatch):
+    monkeypatch.setattr(SlowUpdateClient, "peak", 0)
+    clients = {region: SlowUpdateClient(region)
+        for region in ["us-east-1", "us-west-2"]}
+    actor = hubActor(clients)
+    updates = _updateList(actor, count=1000, region="us-east-1")
+
+    for number in range(1000):
+        row = csvo.FINDING_SCHEMA.rowMap(csvo.FINDING_SCHEMA.row(
+            makeFinding(number, region="us-west-2")))
+        row["Workflow"] = "NOTIFIED"
+        updates.add(csvo.Finding(list(row.values()), actor=actor))
+
+    serial = [identifier for region, update in updates.parameterSets()
+        for identifier in update["FindingIdentifiers"]]
+
+    dispatcher = csvo.UpdateDispatcher(actor=actor, workers=4, regionWorkers=2)
+    response = dispatcher.dispatch(updates.parameterSets())
+
+    assert response["ProcessedFindings"] == serial
+    assert response["UnprocessedFindings"] == []
+    assert dispatcher.batches == 20
+    assert SlowUpdateClient.peak <= 4
+    assert max(client.regionPeak for client in clients.values()) == 2
+
+
+def test_dispatcher_reports_failed_batches_as_unprocessed(hubActor):
+    client = SlowUpdateClient(fail={makeFinding(100)["Id"]})
+    actor = hubActor({"us-east-1": client})
+
+    response = csvo.UpdateDispatcher(actor=actor).dispatch(
+        _updateList(actor).parameterSets())
+
+    assert len(response["ProcessedFindings"]) == 150
+    assert len(response["UnprocessedFindings"]) == 100
+    assert response["UnprocessedFindings"][0] == {
+        "FindingIdentifier": {"Id": makeFinding(100)["Id"],
+            "ProductArn": makeFinding(100)["ProductArn"]},
+        "ErrorCode": "BatchFailed",
+        "ErrorMessage": "securityhub:batch_update_findings failed"}
+
+
+def test_updater_reports_parse_grouping_and_apply_metrics(fakeAws, tmp_path):
+    source = tmp_path / "updates.csv"
+    source.write_text(updateCsv(count=3), encoding="utf-8")
+
+    answer = updater.lambdaHandler({"primaryRegion": "us-east-1",
+        "input": str(source)})
+
+    assert answer["resultCode"] == 200
+    assert {"parse", "grouping", "apply"} <= set(answer["metrics"]["phases"])
+    assert answer["metrics"]["counters"]["batches"] == 1
+
+
+def test_updater_accepts_string_tuning_values(fakeAws, tmp_path):
+    source = tmp_path / "updates.csv"
+    source.write_text(updateCsv(count=3), encoding="utf-8")
+
+    # Console and CLI invocations pass event values as strings
+    answer = updater.lambdaHandler({"primaryRegion": "us-east-1",
+        "input": str(source), "workers": "2", "retryRounds": "2"})
+
+    assert answer["resultCode"] == 200
+
+
+def test_throttled_update_batches_are_retried_not_dropped(hubActor):
+    class ThrottlingClient(FakeHubClient):
+        throttled = 0
+
+        def batch_update_findings(self, **parameters):
+            if ThrottlingClient.throttled < 3:
+                ThrottlingClient.throttled += 1
+                raise ClientError({"Error": {"Code": "TooManyRequestsException",
+                    "Message": "Rate exceeded"}}, "BatchUpdateFindings")
+            return super().batch_update_findings(**parameters)
+
+    actor = hubActor({"us-east-1": ThrottlingClient()})
+
+    response = csvo.UpdateDispatcher(actor=actor, workers=1).dispatch(
+        _updateList(actor).parameterSets())
+
+    assert ThrottlingClient.throttled == 3
+    assert len(response["ProcessedFindings"]) == 250
+    assert response["UnprocessedFindings"] == []
+
+
+def test_retryable_unprocessed_findings_are_repacked_and_resubmitted(hubActor):
+    class FlakyClient(FakeHubClient):
+        """
+        Fails the first 40 findings of each first-time batch with a retryable
+        code, and finding 7 always with a permanent one.
+        """
+        def batch_update_findings(self, **parameters):
+            self.updates = getattr(self, "updates", [])
+            self.updates.append(parameters)
+            identifiers = parameters["FindingIdentifiers"]
+            gone = [identifier for identifier in identifiers
+                if identifier["Id"] == makeFinding(7)["Id"]]
+            retry = [identifier for identifier in identifiers[:40]
+                if identifier not in gone] if len(self.updates) <= 3 else []
+            failures = [{"FindingIdentifier": identifier,
+                "ErrorCode": "ConcurrentUpdateError", "ErrorMessage": "busy"}
+                for identifier in retry]
+            failures += [{"FindingIdentifier": identifier,
+                "ErrorCode": "FindingNotFound", "ErrorMessage": "gone"}
+                for identifier in gone]
+            failed = [failure["FindingIdentifier"] for failure in failures]
+            return {"ProcessedFindings": [identifier for identifier in identifiers
+                if identifier not in failed], "UnprocessedFindings": failures}
+
+    client = FlakyClient()
+    actor = hubActor({"us-east-1": client})
+
+    response = csvo.UpdateDispatcher(actor=actor, workers=1, backoff=0).dispatch(
+        _updateList(actor).parameterSets())
+
+    assert [len(update["FindingIdentifiers"]) for update in client.updates] == \
+        [100, 100, 50, 100, 19]
+    assert all(update["Workflow"] == {"Status": "RESOLVED"} for update in client.updates)
+    assert response["RetriedFindings"] == 119
+    assert len(response["ProcessedFindings"]) == 249
+    assert [failure["ErrorCode"] for failure in response["UnprocessedFindings"]] == \
+        ["FindingNotFound"]
+
+
+def test_findings_still_failing_after_the_last_round_are_unprocessed(hubActor):
+    class BusyClient(FakeHubClient):
+        def batch_update_findings(self, **parameters):
+            return {"ProcessedFindings": [], "UnprocessedFindings": [
+                {"FindingIdentifier": identifier, "ErrorCode": "LimitExceeded"}
+                for identifier in parameters["FindingIdentifiers"]]}
+
+    actor = hubActor({"us-east-1": BusyClient()})
+
+    response = csvo.UpdateDispatcher(actor=actor, rounds=2, backoff=0).dispatch(
+        _updateList(actor, count=30).parameterSets())
+
+    assert response["RetriedFindings"] == 60
+    assert len(response["UnprocessedFindings"]) == 30